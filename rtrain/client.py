@@ -1,17 +1,50 @@
 #!/usr/bin/env python3
 """Client for remote training of Keras models."""
 
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import random
 import requests
+import requests.adapters
 import requests_toolbelt.adapters.host_header_ssl
 import sys
+import threading
 import time
 import tqdm
+import urllib3.exceptions
+import urllib3.util.retry
 
-from rtrain.utils import serialize_training_job, deserialize_model
+import rtrain.compression
+import rtrain.wire_format
+from rtrain.utils import LABEL_PRECISIONS, PRECISIONS, PROFILERS, \
+    ModelDescription, serialize_training_batch, \
+    serialize_training_batch_binary, serialize_training_job, \
+    serialize_training_job_binary, deserialize_model, \
+    deserialize_model_binary, to_transfer_precision
 
 progressbar_type = tqdm.tqdm
 notebook = False
 
+# Seconds for which the server may hold a status request open.
+long_poll_wait = 30
+
+# How many times an interrupted result download is resumed.
+download_attempts = 5
+
+# The most jobs whose status is asked for in one request.
+status_batch_size = 100
+
+# Responses that indicate a transient failure, such as a reverse proxy
+# that could not reach rtraind, and so are retried.
+retry_statuses = (429, 502, 503, 504)
+
+# The longest wait between retries, in seconds.
+max_backoff = 120
+
 
 def set_notebook(in_notebook):
     """Specify whether or not rtrain should use Jupyter Notebook widgets."""
@@ -24,14 +57,89 @@ def set_notebook(in_notebook):
         progressbar_type = tqdm.tqdm
 
 
+def _server_sent_events(lines):
+    """Parse a stream of server-sent events with JSON data.
+
+    Yields the type and decoded data of each event."""
+    event = 'message'
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads('\n'.join(data))
+            event = 'message'
+            data = []
+        elif line.startswith(':'):
+            continue
+        else:
+            field, _, value = line.partition(':')
+            if value.startswith(' '):
+                value = value[1:]
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data.append(value)
+
+
 class RTrainSession(object):
     """Represent a session with a remote server.
 
     Session is something of a misnomer here as the protocol is stateless."""
 
-    def __init__(self, url, certificate=None, tls_host='rtraind'):
-        """Prepare to connect to a remote-training server."""
+    def __init__(self,
+                 url,
+                 certificate=None,
+                 tls_host='rtraind',
+                 wire_format='binary',
+                 cache_datasets=True,
+                 compression='auto',
+                 compression_level=None,
+                 max_workers=8,
+                 retries=5,
+                 backoff_factor=0.5,
+                 backoff_jitter=1.0,
+                 pool_size=None):
+        """Prepare to connect to a remote-training server.
+
+        The wire_format may be 'binary' or 'json'.  If the server does not
+        understand the binary format, the session falls back to JSON.
+
+        If cache_datasets is set, training data is uploaded only if the
+        server does not already hold a copy.
+
+        Uploads are compressed with the given content coding, or with the
+        best one that the server accepts if compression is 'auto'; None
+        disables compression in both directions.  The compression_level is
+        passed to the codec, None selecting its default.
+
+        Up to max_workers jobs started with submit() or train_async() are
+        followed at once; the rest wait their turn.  The connection pool
+        holds pool_size connections, by default enough for every worker.
+
+        Requests that fail to connect, time out, or receive one of the
+        retry_statuses are retried up to retries times, waiting
+        backoff_factor * 2**n seconds before the n-th retry, plus a random
+        jitter of up to backoff_jitter seconds.  Before a job submission is
+        retried, the server is asked whether the failed attempt created the
+        job, so that it is not submitted twice."""
+        if wire_format not in ('binary', 'json'):
+            raise ValueError('Unknown wire format %r.' % wire_format)
+        if compression not in ('auto', None) and \
+                compression not in rtrain.compression.ENCODINGS:
+            raise ValueError('Unknown compression %r.' % compression)
+
         self.url = url
+        self.wire_format = wire_format
+        self.cache_datasets = cache_datasets
+        self.compression = compression
+        self.compression_level = compression_level
+        self._server_encodings = None
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
         self.session = requests.Session()
 
         if certificate is not None:
@@ -39,34 +147,493 @@ class RTrainSession(object):
         else:
             self.verify = None
 
+        # Idempotent requests are retried by the adapters themselves;
+        # uploads are retried by _send().
+        if pool_size is None:
+            pool_size = max(10, max_workers + 2)
+        retry = _retry_policy(retries, backoff_factor, backoff_jitter)
         self.session.mount(
             "https://",
-            requests_toolbelt.adapters.host_header_ssl.HostHeaderSSLAdapter())
+            requests_toolbelt.adapters.host_header_ssl.HostHeaderSSLAdapter(
+                pool_maxsize=pool_size, max_retries=retry))
+        self.session.mount(
+            "http://",
+            requests.adapters.HTTPAdapter(
+                pool_maxsize=pool_size, max_retries=retry))
         self.host = tls_host
 
-    def train(self,
-              model,
-              loss,
-              optimizer,
-              x_train,
-              y_train,
-              epochs,
-              batch_size,
-              quiet=False):
-        """Train a model on a remote server."""
-        global progressbar_type
-        global notebook
+    def _backoff(self, attempt):
+        """Wait before the given retry, counting from zero."""
+        time.sleep(
+            min(max_backoff, self.backoff_factor * 2**attempt) +
+            random.uniform(0, self.backoff_jitter))
 
-        serialized_model = serialize_training_job(
-            model, loss, optimizer, x_train, y_train, epochs, batch_size)
+    def _request_encoding(self):
+        """Choose the content coding with which to compress uploads.
+
+        Returns None if uploads should not be compressed."""
+        if self.compression is None:
+            return None
+        if self._server_encodings is None:
+            try:
+                response = self.session.get(
+                    "%s/ping" % self.url,
+                    verify=self.verify,
+                    headers={'Host': self.host})
+                self._server_encodings = \
+                    rtrain.compression.parse_accept_encoding(
+                        response.headers.get('Accept-Encoding'))
+            except requests.RequestException:
+                return None
+
+        if self.compression == 'auto':
+            candidates = rtrain.compression.supported()
+        else:
+            candidates = [self.compression]
+        for encoding in candidates:
+            if encoding in self._server_encodings:
+                return encoding
+        return None
+
+    def _send(self, method, path, body, content_type, recover=None):
+        """Send a request body, given as a sequence of bytes-like chunks.
+
+        The body must be iterable more than once, so that the request can
+        be retried.  If recover is given, it is called before each retry;
+        if it returns a response, that is returned instead of repeating
+        the request."""
+        for attempt in itertools.count():
+            try:
+                response = self._send_once(method, path, body, content_type)
+                if response.status_code not in retry_statuses or \
+                        attempt >= self.retries:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+
+            self._backoff(attempt)
+            if recover is not None:
+                response = recover()
+                if response is not None:
+                    return response
+
+    def _send_once(self, method, path, body, content_type):
+        """Send a request body once, compressing it if the server accepts it."""
+        encoding = self._request_encoding()
+        headers = {'Host': self.host, 'Content-Type': content_type}
+        data = body
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            data = rtrain.compression.compress(body, encoding,
+                                               self.compression_level)
+        elif isinstance(body, list):
+            # requests would send a list as form fields.
+            data = b''.join(body)
+
+        response = self.session.request(
+            method,
+            "%s/%s" % (self.url, path),
+            data=data,
+            verify=self.verify,
+            headers=headers)
+        if response.status_code == 415 and encoding is not None and \
+                'Accept-Encoding' in response.headers:
+            accepted = rtrain.compression.parse_accept_encoding(
+                response.headers['Accept-Encoding'])
+            if encoding not in accepted:
+                # The server's codings have changed since we asked.
+                self._server_encodings = accepted
+                return self._send_once(method, path, body, content_type)
+        return response
+
+    def _post_jobs(self, path, body, content_type, count=None):
+        """Submit a job, or a batch of count jobs, returning the response.
+
+        If an attempt fails in a way that leaves it unclear whether the
+        jobs were created, the server is asked for jobs with the same
+        checksum before trying again."""
+        started = time.time()
+        return self._send('POST', path, body, content_type,
+                          lambda: self._find_submitted(body, count, started))
+
+    def _find_submitted(self, body, count, started):
+        """Find the jobs created by an earlier attempt to submit a body.
+
+        Returns a stand-in for the lost response if they exist, or None."""
+        digest = hashlib.sha256()
+        for chunk in body:
+            digest.update(chunk)
+        checksum = digest.hexdigest().upper()
+        if count is None:
+            checksums = [checksum]
+        else:
+            # The jobs of a batch are identified by their position in it.
+            checksums = [
+                hashlib.sha256(('%s:%d' % (checksum, i)).encode('ascii'))
+                .hexdigest().upper() for i in range(count)
+            ]
+
+        try:
+            response = self.session.post(
+                "%s/jobs/find" % self.url,
+                json={
+                    'checksums': checksums,
+                    'max_age': time.time() - started + 60
+                },
+                verify=self.verify,
+                headers={'Host': self.host})
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+
+        found = response.json()['jobs']
+        if not all(c in found for c in checksums):
+            return None
+        return _RecoveredResponse([found[c] for c in checksums],
+                                  count is not None)
+
+    def _upload_datasets(self, arrays):
+        """Make sure that the server holds copies of some arrays.
+
+        Returns a dictionary mapping the names of the arrays to their
+        digests, or None if the server has no dataset store."""
+        encoded = {
+            name: rtrain.wire_format.EncodedArray(array)
+            for name, array in arrays.items()
+        }
         response = self.session.post(
-            "%s/train" % self.url,
-            json=serialized_model,
+            "%s/datasets/missing" % self.url,
+            json={'datasets': [e.digest for e in encoded.values()]},
             verify=self.verify,
             headers={'Host': self.host})
+        if response.status_code == 404:
+            self.cache_datasets = False
+            return None
         if response.status_code != 200:
-            raise Exception('Job not created.')
-        job_id = response.text
+            raise IOError('Dataset query failed.')
+
+        missing = set(response.json()['missing'])
+        for e in encoded.values():
+            if e.digest not in missing:
+                continue
+            response = self._send('PUT', 'datasets/%s' % e.digest, e,
+                                  rtrain.wire_format.ARRAY_CONTENT_TYPE)
+            if response.status_code != 200:
+                raise IOError('Dataset upload failed.')
+
+        return {name: e.digest for name, e in encoded.items()}
+
+    def _post_container(self, container):
+        """Upload a training job in the binary format."""
+        return self._post_jobs('train', container,
+                               rtrain.wire_format.CONTENT_TYPE)
+
+    def _submit(self,
+                model,
+                loss,
+                optimizer,
+                x_train,
+                y_train,
+                epochs,
+                batch_size,
+                precision=None,
+                label_precision=None,
+                profile=None):
+        """Upload a training job, returning the HTTP response."""
+        transfer = _job_options(precision, label_precision, profile)
+
+        if self.wire_format == 'binary':
+            references = None
+            if self.cache_datasets:
+                # The stored datasets are already at the transfer precision.
+                references = self._upload_datasets({
+                    'x_train':
+                    to_transfer_precision(x_train, precision),
+                    'y_train':
+                    to_transfer_precision(y_train, label_precision
+                                          or precision)
+                })
+
+            response = self._post_container(
+                serialize_training_job_binary(model, loss, optimizer, x_train,
+                                              y_train, epochs, batch_size,
+                                              references, **transfer))
+            if response.status_code == 409 and references:
+                # The datasets were evicted before the job was submitted,
+                # so send them along with the job instead.
+                response = self._post_container(
+                    serialize_training_job_binary(
+                        model, loss, optimizer, x_train, y_train, epochs,
+                        batch_size, **transfer))
+            if response.status_code != 415:
+                return response
+
+            # The server predates the binary format.
+            self.wire_format = 'json'
+
+        serialized_model = serialize_training_job(
+            model, loss, optimizer, x_train, y_train, epochs, batch_size,
+            **transfer)
+        return self._post_jobs('train',
+                               [json.dumps(serialized_model).encode('utf8')],
+                               'application/json')
+
+    def _submit_batch(self, jobs, precision, label_precision, profile=None):
+        """Upload several training jobs together, returning their IDs.
+
+        Returns None if the server does not accept batches."""
+        transfer = _job_options(precision, label_precision, profile)
+
+        if self.wire_format == 'binary':
+            references = None
+            if self.cache_datasets:
+                # Each distinct array is uploaded once, however many jobs
+                # use it.
+                arrays = {}
+                for job in jobs:
+                    arrays[('x_train', id(job['x_train']))] = \
+                        to_transfer_precision(job['x_train'], precision)
+                    arrays[('y_train', id(job['y_train']))] = \
+                        to_transfer_precision(job['y_train'],
+                                              label_precision or precision)
+                digests = self._upload_datasets(arrays)
+                if digests is not None:
+                    references = [{
+                        name: digests[(name, id(job[name]))]
+                        for name in ('x_train', 'y_train')
+                    } for job in jobs]
+
+            response = self._post_jobs(
+                'train/batch',
+                serialize_training_batch_binary(jobs, references, **transfer),
+                rtrain.wire_format.CONTENT_TYPE, len(jobs))
+            if response.status_code == 409 and references:
+                response = self._post_jobs(
+                    'train/batch',
+                    serialize_training_batch_binary(jobs, **transfer),
+                    rtrain.wire_format.CONTENT_TYPE, len(jobs))
+        else:
+            response = self._post_jobs('train/batch', [
+                json.dumps(serialize_training_batch(jobs, **transfer))
+                .encode('utf8')
+            ], 'application/json', len(jobs))
+
+        if response.status_code in (404, 405, 415):
+            return None
+        if response.status_code != 200:
+            raise Exception('Jobs not created.')
+        return response.json()
+
+    def _poll_statuses(self, job_ids, on_status):
+        """Follow the progress of several jobs until all have finished.
+
+        The status of many jobs is requested at once, and on_status is
+        called with a dictionary mapping job IDs to their latest status.
+        Returns that dictionary when every job has finished, or None if the
+        server does not support bulk status requests.  Failed requests have
+        already been retried by the adapter, so they are not retried here."""
+        statuses = {}
+        version = -1
+        while True:
+            unfinished = [
+                j for j in job_ids
+                if not statuses.get(j, {}).get('finished')
+            ]
+            if not unfinished:
+                return statuses
+
+            groups = [
+                unfinished[i:i + status_batch_size]
+                for i in range(0, len(unfinished), status_batch_size)
+            ]
+            # Waiting for changes only makes sense with a single request.
+            wait = long_poll_wait if len(groups) == 1 else 0
+            for group in groups:
+                try:
+                    response = self.session.get(
+                        "%s/status" % self.url,
+                        params={
+                            'ids': ','.join(group),
+                            'wait': wait,
+                            'since': version
+                        },
+                        verify=self.verify,
+                        timeout=(30, wait + 30),
+                        headers={'Host': self.host})
+                except requests.RequestException as e:
+                    raise IOError('Status check failed.') from e
+                if response.status_code == 404:
+                    return None
+                if response.status_code != 200:
+                    raise IOError('Status check failed.')
+
+                for job_id, status in response.json()['jobs'].items():
+                    if status is None:
+                        raise IOError('Job %s not found.' % job_id)
+                    statuses[job_id] = status
+                    version = max(version, status.get('version', -1))
+            on_status(statuses)
+
+            if not wait:
+                time.sleep(5)
+
+    def _follow_events(self, job_id, on_status, on_epoch):
+        """Follow the progress of a job through its event stream.
+
+        Returns the final status of the job, or None if the stream is not
+        available or is interrupted."""
+        try:
+            response = self.session.get(
+                "%s/events/%s" % (self.url, job_id),
+                stream=True,
+                verify=self.verify,
+                timeout=(30, 120),
+                headers={
+                    'Host': self.host,
+                    'Accept': 'text/event-stream'
+                })
+        except requests.RequestException:
+            return None
+
+        with response:
+            content_type = response.headers.get('Content-Type', '')
+            if response.status_code != 200 or \
+                    not content_type.startswith('text/event-stream'):
+                return None
+
+            try:
+                for event, data in _server_sent_events(
+                        response.iter_lines(decode_unicode=True)):
+                    if event == 'epoch':
+                        on_epoch(data)
+                    elif event == 'status':
+                        on_status(data)
+                        if data['finished']:
+                            return data
+            except requests.RequestException:
+                pass
+        return None
+
+    def _poll_status(self, job_id, on_status):
+        """Follow the progress of a job by polling its status.
+
+        Servers that support it hold each request open until the status
+        changes.  Returns the final status of the job, or None on failure;
+        failed requests have already been retried by the adapter."""
+        finished = False
+        version = -1
+        while not finished:
+            try:
+                response = self.session.get(
+                    "%s/status/%s" % (self.url, job_id),
+                    params={
+                        'wait': long_poll_wait,
+                        'since': version
+                    },
+                    verify=self.verify,
+                    timeout=(30, long_poll_wait + 30),
+                    headers={'Host': self.host})
+            except requests.RequestException:
+                response = None
+            if response is None or response.status_code != 200:
+                print("Status check failed.", file=sys.stderr)
+                return None
+
+            status = response.json()
+            if status.get('error', None) is not None:
+                raise IOError(status['error'])
+
+            on_status(status)
+
+            finished = status['finished']
+            if 'version' in status:
+                version = status['version']
+            elif not finished:
+                # The server does not support long polling.
+                time.sleep(5)
+        return status
+
+    def _download_result(self, job_id, keras_model=True):
+        """Download and deserialise the trained model from a job.
+
+        The model is requested in the binary format, falling back to JSON
+        for servers that do not offer it.  If the connection fails part way
+        through, the download resumes from where it stopped.  If keras_model
+        is false, a ModelDescription is returned instead of a Keras model."""
+        if self.compression is None:
+            accept_encoding = 'identity'
+        else:
+            accept_encoding = ', '.join(rtrain.compression.supported() +
+                                        ['identity;q=0.5'])
+
+        data = bytearray()
+        etag = None
+        for attempt in range(download_attempts):
+            headers = {
+                'Host': self.host,
+                'Accept': '%s, application/json;q=0.5' %
+                rtrain.wire_format.MODEL_CONTENT_TYPE,
+                'Accept-Encoding': accept_encoding
+            }
+            if data and etag is not None:
+                headers['Range'] = 'bytes=%d-' % len(data)
+                headers['If-Range'] = etag
+            else:
+                del data[:]
+
+            try:
+                with self.session.get(
+                        "%s/result/%s" % (self.url, job_id),
+                        verify=self.verify,
+                        headers=headers,
+                        stream=True,
+                        timeout=(30, 300)) as response:
+                    content_type = response.headers.get('Content-Type', '')
+                    if response.status_code == 200 and \
+                            not content_type.startswith(
+                                rtrain.wire_format.MODEL_CONTENT_TYPE):
+                        return deserialize_model(response.text, keras_model)
+
+                    if response.status_code == 200:
+                        # The server ignored the range, or the result
+                        # has changed; start again.
+                        del data[:]
+                    elif response.status_code != 206 or \
+                            not response.headers.get(
+                                'Content-Range', '').startswith(
+                                    'bytes %d-' % len(data)):
+                        raise IOError('Result download failed (HTTP %d).' %
+                                      response.status_code)
+                    etag = response.headers.get('ETag')
+                    encoding = response.headers.get('Content-Encoding')
+
+                    # Ranges refer to the compressed data, so it is only
+                    # decompressed once it is complete.
+                    for chunk in response.raw.stream(
+                            1 << 20, decode_content=False):
+                        data += chunk
+                if encoding in rtrain.compression.ENCODINGS:
+                    data = rtrain.compression.decompress(data, encoding)
+                return deserialize_model_binary(data, keras_model)
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    urllib3.exceptions.HTTPError):
+                if attempt == download_attempts - 1:
+                    raise
+                print(
+                    "Result download interrupted, resuming.",
+                    file=sys.stderr)
+                self._backoff(attempt)
+
+    def _wait_for_result(self, job_id, quiet, keras_model=True):
+        """Follow a job until it finishes, then download the trained model.
+
+        Returns None if the job's progress could not be followed, and
+        raises JobFailedError if the job failed."""
+        global progressbar_type
+        global notebook
 
         if not quiet:
             if notebook:
@@ -83,44 +650,387 @@ class RTrainSession(object):
                     mininterval=0,
                     bar_format=
                     '{desc}{percentage:3.0f}% |{bar}| {elapsed} ({remaining} rem.)'
+                    '{postfix}'
                 )
 
-        time.sleep(2)
+        progress = {'last_status': 0}
 
-        finished = False
-        last_status = 0
-        failures = 0
-        wait_time = 2
-        while not finished:
+        def on_status(status):
+            if not quiet:
+                current = int(round(10 * status['status']))
+                bar.update(current - progress['last_status'])
+                progress['last_status'] = current
+
+        def on_epoch(metrics):
+            if not quiet:
+                bar.set_postfix({
+                    k: v
+                    for k, v in sorted(metrics.items()) if k != 'epoch'
+                })
+
+        # Servers without an event stream, or proxies that cannot carry
+        # one, are handled by polling instead.
+        status = self._follow_events(job_id, on_status, on_epoch)
+        if status is None:
+            status = self._poll_status(job_id, on_status)
+            if status is None:
+                return None
+
+        if not quiet:
+            bar.close()
+
+        # Older servers report failure only by a status of -1.
+        if status.get('state') == 'failed' or status['status'] == -1:
+            raise JobFailedError(job_id, self._failure_message(job_id))
+        return self._download_result(job_id, keras_model)
+
+    def _failure_message(self, job_id):
+        """Get the server's account of why a job failed, if it has one."""
+        try:
             response = self.session.get(
-                "%s/status/%s" % (self.url, job_id),
+                "%s/result/%s" % (self.url, job_id),
                 verify=self.verify,
+                timeout=(30, 300),
                 headers={'Host': self.host})
-            if response.status_code != 200:
-                print("Status check failed.", file=sys.stderr)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.text
 
-                time.sleep(wait_time)
-                failures += 1
-                wait_time *= 2
+    def _get_executor(self):
+        """Get the pool of threads that follow submitted jobs."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='rtrain-client')
+            return self._executor
 
-                return None
+    def submit(self,
+               model,
+               loss,
+               optimizer,
+               x_train,
+               y_train,
+               epochs,
+               batch_size,
+               quiet=True,
+               precision=None,
+               label_precision=None,
+               profile=None):
+        """Submit a model for training without waiting for it to finish.
 
-            status = response.json()
-            if status.get('error', None) is not None:
-                raise IOError(status['error'])
+        The job is uploaded before submit() returns.  Returns a JobFuture
+        whose result is the trained model, as would be returned by train(),
+        or whose exception is a JobFailedError if the job failed; use wait()
+        or as_completed() to wait for several jobs at once."""
+        keras_model = not isinstance(model, ModelDescription)
+        response = self._submit(model, loss, optimizer, x_train, y_train,
+                                epochs, batch_size, precision,
+                                label_precision, profile)
+        if response.status_code != 200:
+            raise Exception('Job not created.')
 
-            if not quiet:
-                bar.update(int(round(10 * status['status'])) - last_status)
-                last_status = int(round(10 * status['status']))
+        future = JobFuture(self, response.text)
 
-            finished = status['finished']
-            time.sleep(5)
+        def follow():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(
+                    self._wait_for_result(future.job_id, quiet, keras_model))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._get_executor().submit(follow)
+        return future
+
+    def train(self,
+              model,
+              loss,
+              optimizer,
+              x_train,
+              y_train,
+              epochs,
+              batch_size,
+              quiet=False,
+              precision=None,
+              label_precision=None,
+              profile=None):
+        """Train a model on a remote server.
+
+        Floating-point weights and data are sent as float32, float16 or
+        bfloat16 if precision is given, and the labels at label_precision,
+        which may also be int8 for integer-valued labels.  The trained
+        weights are returned in their original dtypes.
+
+        If profile is 'cprofile' or 'tensorflow', the server profiles the
+        training with that profiler; use submit() to learn the job's ID,
+        with which to fetch the profile using download_profile().
+
+        The model may be a ModelDescription rather than a Keras model, in
+        which case Keras need not be installed, and the trained model is
+        returned as a ModelDescription too.  Raises JobFailedError if
+        training fails on the server."""
+        response = self._submit(model, loss, optimizer, x_train, y_train,
+                                epochs, batch_size, precision,
+                                label_precision, profile)
+        if response.status_code != 200:
+            raise Exception('Job not created.')
+        return self._wait_for_result(
+            response.text, quiet, not isinstance(model, ModelDescription))
+
+    def train_many(self,
+                   jobs,
+                   quiet=False,
+                   precision=None,
+                   label_precision=None,
+                   profile=None):
+        """Train several models on a remote server.
+
+        Each job is a dictionary of the arguments model, loss, optimizer,
+        x_train, y_train, epochs and batch_size, as for train().  The jobs
+        are submitted in a single request, in which arrays shared between
+        them are sent only once, and their progress is followed together.
+
+        Returns a list of the trained models, in order; the entry for a job
+        that failed is None."""
+        global progressbar_type
+
+        job_ids = self._submit_batch(jobs, precision, label_precision,
+                                     profile)
+        if job_ids is None:
+            # The server predates batches.
+            futures = [
+                self.submit(
+                    precision=precision,
+                    label_precision=label_precision,
+                    profile=profile,
+                    **job) for job in jobs
+            ]
+            return [_result_or_none(f.result) for f in futures]
 
+        if not quiet:
+            bar = progressbar_type(
+                desc="Training Remotely",
+                total=1000.0,
+                unit='‰',
+                mininterval=0)
+        progress = {'last_status': 0}
+
+        def on_status(statuses):
+            if not quiet:
+                total = sum(100.0 if s['finished'] else s['status']
+                            for s in statuses.values())
+                current = int(round(10 * total / len(job_ids)))
+                bar.update(current - progress['last_status'])
+                progress['last_status'] = current
+                bar.set_postfix(
+                    finished='%d/%d' % (sum(
+                        1 for s in statuses.values() if s['finished']),
+                                        len(job_ids)))
+
+        statuses = self._poll_statuses(job_ids, on_status)
         if not quiet:
             bar.close()
+        keras_models = [
+            not isinstance(job['model'], ModelDescription) for job in jobs
+        ]
+        if statuses is None:
+            return [
+                _result_or_none(self._wait_for_result, j, True, k)
+                for j, k in zip(job_ids, keras_models)
+            ]
 
-        response = self.session.get(
-            "%s/result/%s" % (self.url, job_id),
-            verify=self.verify,
-            headers={'Host': self.host})
-        return deserialize_model(response.text)
+        def download(job_id, keras_model):
+            if statuses[job_id].get('state') == 'failed':
+                return None
+            return self._download_result(job_id, keras_model)
+
+        return list(
+            self._get_executor().map(download, job_ids, keras_models))
+
+    async def train_async(self,
+                          model,
+                          loss,
+                          optimizer,
+                          x_train,
+                          y_train,
+                          epochs,
+                          batch_size,
+                          precision=None,
+                          label_precision=None,
+                          profile=None):
+        """Train a model on a remote server from a coroutine.
+
+        The arguments are as for train(), but no progress bar is shown.
+        Jobs share the session's connections with submit() and train()."""
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.submit,
+                model,
+                loss,
+                optimizer,
+                x_train,
+                y_train,
+                epochs,
+                batch_size,
+                precision=precision,
+                label_precision=label_precision,
+                profile=profile))
+        return await asyncio.wrap_future(future)
+
+    def download_profile(self, job_id, path):
+        """Download the profile recorded while training a job to a file.
+
+        A cProfile profile may be read with pstats; a TensorFlow trace is a
+        gzipped tar archive of a TensorBoard log directory."""
+        with self.session.get(
+                "%s/profile/%s" % (self.url, job_id),
+                verify=self.verify,
+                headers={'Host': self.host},
+                stream=True) as response:
+            if response.status_code != 200:
+                raise IOError(
+                    'Profile download failed (HTTP %d).' %
+                    response.status_code)
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(1 << 20):
+                    f.write(chunk)
+
+    def close(self):
+        """Stop following submitted jobs and close the session's connections.
+
+        Jobs that are already being followed are allowed to finish."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.session.close()
+
+
+class _IdempotentRetry(urllib3.util.retry.Retry):
+    """A retry policy that retries only the allowed methods.
+
+    urllib3 retries failed connections whatever the method, which would
+    compound the retries that _send() makes of uploads."""
+
+    def increment(self, method=None, *args, **kwargs):
+        if method is not None and not self._is_method_retryable(method):
+            return super(_IdempotentRetry, self.new(total=0)).increment(
+                method, *args, **kwargs)
+        return super().increment(method, *args, **kwargs)
+
+
+def _retry_policy(retries, backoff_factor, backoff_jitter):
+    """Build the policy under which idempotent requests are retried."""
+    options = dict(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        status_forcelist=retry_statuses,
+        backoff_factor=backoff_factor,
+        raise_on_status=False)
+    try:
+        return _IdempotentRetry(backoff_jitter=backoff_jitter, **options)
+    except TypeError:
+        # Versions of urllib3 before 2.0 cannot add jitter.
+        return _IdempotentRetry(**options)
+
+
+class _RecoveredResponse(object):
+    """Stands in for the lost response to a successful job submission."""
+
+    status_code = 200
+
+    def __init__(self, job_ids, batch):
+        self.text = json.dumps(job_ids) if batch else job_ids[0]
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _job_options(precision, label_precision, profile):
+    """Check the transfer precision and profiling options for a job."""
+    if precision not in (None, ) + PRECISIONS:
+        raise ValueError('Unknown precision %r.' % precision)
+    if label_precision not in (None, ) + LABEL_PRECISIONS:
+        raise ValueError('Unknown label precision %r.' % label_precision)
+    if profile not in (None, ) + PROFILERS:
+        raise ValueError('Unknown profiler %r.' % profile)
+    return {
+        'precision': precision,
+        'label_precision': label_precision,
+        'profile': profile
+    }
+
+
+class JobFailedError(Exception):
+    """Raised when a job fails on the server.
+
+    The message is the server's account of the failure, usually the
+    traceback of the error that stopped training."""
+
+    def __init__(self, job_id, message=None):
+        super().__init__('Job %s failed.' % job_id if message is None else
+                         'Job %s failed:\n%s' % (job_id, message))
+        self.job_id = job_id
+        self.message = message
+
+
+def _result_or_none(result, *args):
+    """Call result, returning None if it raises JobFailedError."""
+    try:
+        return result(*args)
+    except JobFailedError:
+        return None
+
+
+class JobFuture(concurrent.futures.Future):
+    """The eventual result of a job submitted with RTrainSession.submit().
+
+    This is an ordinary concurrent.futures.Future, so the standard wait()
+    and as_completed() functions may also be used."""
+
+    def __init__(self, session, job_id):
+        super().__init__()
+        self.session = session
+        self.job_id = job_id
+
+    def status(self):
+        """Get the latest status of the job from the server."""
+        response = self.session.session.get(
+            "%s/status/%s" % (self.session.url, self.job_id),
+            verify=self.session.verify,
+            headers={'Host': self.session.host})
+        if response.status_code != 200:
+            raise IOError('Status check failed.')
+        return response.json()
+
+    def timings(self):
+        """Get the time taken by each phase of the job so far.
+
+        Returns None if the server does not report timings."""
+        return self.status().get('timings')
+
+    def download_profile(self, path):
+        """Download the job's profile to a file, as for download_profile()."""
+        self.session.download_profile(self.job_id, path)
+
+
+def wait(futures, timeout=None, return_when=concurrent.futures.ALL_COMPLETED):
+    """Wait for submitted jobs to finish.
+
+    As for concurrent.futures.wait(), returns a pair of sets of the futures
+    that are done and not done."""
+    return concurrent.futures.wait(futures, timeout, return_when)
+
+
+def as_completed(futures, timeout=None):
+    """Iterate over submitted jobs as they finish."""
+    return concurrent.futures.as_completed(futures, timeout)
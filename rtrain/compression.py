@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Content codings used to compress request and response bodies.
+
+gzip is always available; zstd and lz4 are used if the ``zstandard`` and
+``lz4`` packages are installed.  Each side advertises the codings it can
+decode in an ``Accept-Encoding`` header, and the sender chooses among them.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Compressed data is read, and decoded, in pieces of this size, so that a
+# small request cannot expand into a great deal of memory at once.
+_CHUNK_SIZE = 1 << 16
+
+
+def _gzip_compressor(level):
+    compressor = zlib.compressobj(6 if level is None else level,
+                                  zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+class _GzipDecompressor(object):
+    """A gzip decompressor with the interface of bz2.BZ2Decompressor.
+
+    Input that cannot be decoded without exceeding max_length is kept for
+    the next call."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.needs_input = True
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    def decompress(self, data, max_length=-1):
+        data = self._decompressor.unconsumed_tail + data
+        output = self._decompressor.decompress(data, max(max_length, 0))
+        self.needs_input = not self._decompressor.unconsumed_tail and (
+            max_length < 0 or len(output) < max_length)
+        return output
+
+
+def _gzip_decompressor(stream):
+    return _BoundedReader(stream, _GzipDecompressor(), 'gzip')
+
+
+def _zstd_compressor(level):
+    compressor = zstandard.ZstdCompressor(
+        level=3 if level is None else level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+def _zstd_decompressor(stream):
+    # The reader cannot tell a truncated stream from a complete one, but
+    # everything sent with compression carries its own length.
+    return zstandard.ZstdDecompressor().stream_reader(
+        stream, read_size=_CHUNK_SIZE)
+
+
+def _lz4_compressor(level):
+    compressor = lz4.frame.LZ4FrameCompressor(
+        compression_level=0 if level is None else level)
+    started = []
+
+    def compress(data):
+        if started:
+            return compressor.compress(data)
+        started.append(True)
+        return compressor.begin() + compressor.compress(data)
+
+    def flush():
+        if started:
+            return compressor.flush()
+        return compressor.begin() + compressor.flush()
+
+    return compress, flush
+
+
+def _lz4_decompressor(stream):
+    return _BoundedReader(stream, lz4.frame.LZ4FrameDecompressor(), 'lz4')
+
+
+class _BoundedReader(object):
+    """Decode a stream with a decompressor like bz2.BZ2Decompressor.
+
+    Each read returns at most the requested number of bytes, however much
+    the data expands."""
+
+    def __init__(self, stream, decompressor, encoding):
+        self.stream = stream
+        self.decompressor = decompressor
+        self.encoding = encoding
+
+    def read(self, size):
+        while not (self.decompressor.eof and self.decompressor.needs_input):
+            data = b''
+            if self.decompressor.needs_input:
+                data = self.stream.read(_CHUNK_SIZE)
+                if not data:
+                    raise ValueError('Truncated %s data.' % self.encoding)
+            output = self.decompressor.decompress(data, max_length=size)
+            if output:
+                return output
+        return b''
+
+
+# The available codings, from most to least preferred.
+ENCODINGS = {}
+_errors = (zlib.error, )
+if zstandard is not None:
+    ENCODINGS['zstd'] = (_zstd_compressor, _zstd_decompressor)
+    _errors += (zstandard.ZstdError, )
+if lz4 is not None:
+    ENCODINGS['lz4'] = (_lz4_compressor, _lz4_decompressor)
+    _errors += (RuntimeError, )
+ENCODINGS['gzip'] = (_gzip_compressor, _gzip_decompressor)
+
+
+def supported():
+    """List the available codings, from most to least preferred."""
+    return list(ENCODINGS)
+
+
+def parse_accept_encoding(header):
+    """List the codings named in an Accept-Encoding header.
+
+    Only available codings are returned, in the order in which they appear,
+    and codings with a quality of zero are ignored."""
+    encodings = []
+    for item in (header or '').split(','):
+        name, _, parameters = item.partition(';')
+        name = name.strip().lower()
+        parameters = parameters.replace(' ', '')
+        if name in ENCODINGS and parameters not in ('q=0', 'q=0.0', 'q=0.00',
+                                                    'q=0.000'):
+            encodings.append(name)
+    return encodings
+
+
+def compress(chunks, encoding, level=None):
+    """Compress a sequence of bytes-like chunks, yielding compressed chunks.
+
+    The level is passed to the codec; None selects the codec's default."""
+    compress_chunk, flush = ENCODINGS[encoding][0](level)
+    for chunk in chunks:
+        compressed = compress_chunk(chunk)
+        if compressed:
+            yield compressed
+    yield flush()
+
+
+def decompress(data, encoding):
+    """Decompress a complete buffer."""
+    return DecompressingReader(memoryview(data), encoding).read()
+
+
+class DecompressingReader(object):
+    """A file-like object that decompresses a stream as it is read.
+
+    The stream may be any object with a read() method, or a buffer.  No
+    more than the requested amount is decompressed at a time.  Corrupt
+    data raises ValueError, as does truncated data except in zstd, which
+    cannot detect it."""
+
+    def __init__(self, stream, encoding):
+        if isinstance(stream, memoryview):
+            stream = _BufferReader(stream)
+        self.stream = stream
+        self.encoding = encoding
+        self._reader = ENCODINGS[encoding][1](stream)
+
+    def read(self, size=-1):
+        pieces = []
+        remaining = size
+        while remaining != 0:
+            try:
+                piece = self._reader.read(
+                    _CHUNK_SIZE if remaining < 0 else remaining)
+            except _errors as e:
+                raise ValueError('Invalid %s data.' % self.encoding) from e
+            if not piece:
+                break
+            pieces.append(piece)
+            if remaining > 0:
+                remaining -= len(piece)
+        return b''.join(pieces)
+
+
+class _BufferReader(object):
+    """Read a buffer in pieces, as though it were a file."""
+
+    def __init__(self, view):
+        self.view = view
+        self.offset = 0
+
+    def read(self, size):
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
@@ -2,46 +2,160 @@
 """Keras remote-training server."""
 
 import argparse
+import contextlib
+import cProfile
+import copy
+import datetime
 from functools import wraps
+import io
+import itertools
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import resource
+import shutil
+import socket
 import sys
+import tempfile
 import threading
 import time
 import traceback
 
 import flask
-import keras.models
+import numpy
+import sqlalchemy.exc
 import sqlalchemy.orm
 
 import structlog
 import structlog.stdlib
 
+import rtrain.compression
 import rtrain.server_utils.config
+import rtrain.server_utils.http
+import rtrain.server_utils.metrics
 import rtrain.server_utils.model
 import rtrain.server_utils.model.database_operations as _database_operations
-
-from rtrain.utils import deserialize_array, serialize_model
-from rtrain.validation import validate_training_request
+import rtrain.server_utils.model_cache
+import rtrain.server_utils.notify
+import rtrain.server_utils.status
+import rtrain.server_utils.storage
+import rtrain.wire_format
+
+from rtrain.server_utils.status import new_timings
+from rtrain.utils import dataset_references, deserialize_array, \
+    from_transfer_precision, is_dataset_reference, label_precision, \
+    model_container_to_json, resolve_training_job_arrays, \
+    serialize_model_binary
+from rtrain.validation import validate_array_headers, \
+    validate_binary_training_request, validate_training_request
 
 rtraind_blueprint = flask.Blueprint('rtraind', __name__)
 
 Session = None
 password = None
+spool_directory = None
+result_directory = None
+dataset_store = None
+model_cache = rtrain.server_utils.model_cache.ModelCache(0)
+job_notifier = rtrain.server_utils.notify.PollingNotifier()
+status_board = rtrain.server_utils.status.StatusBoard()
+
+# How often an event stream with nothing new to report is kept alive.
+event_keepalive_interval = 15
+
+# The longest time for which a status request may wait for a change.
+max_status_wait = 60
+
+# The most jobs that may be submitted, or asked after, in one request.
+max_batch_size = 1000
+
+# Finished jobs are kept, and may stand in for identical new ones, for
+# this many seconds.
+result_retention = 3600
+deduplicate_jobs = True
+
+# Seconds to wait before replacing a trainer process that failed.
+trainer_restart_delay = 5
+
+# Entries in the status board older than this are checked against the
+# database, in case the job is being run by another rtraind.
+status_refresh_interval = 5
+
+# The configuration file read when no other is given.
+default_config_path = '/etc/rtraind.conf'
 
 logger = structlog.get_logger()
 
+metrics_registry = rtrain.server_utils.metrics.Registry()
+http_requests = metrics_registry.counter(
+    'rtraind_http_requests', 'HTTP requests handled.',
+    ('method', 'endpoint', 'status'))
+http_request_seconds = metrics_registry.histogram(
+    'rtraind_http_request_duration_seconds',
+    'Time taken to produce HTTP responses.', ('method', 'endpoint'))
+http_request_bytes = metrics_registry.counter(
+    'rtraind_http_request_bytes', 'Bytes received in HTTP request bodies.',
+    ('endpoint', ))
+http_response_bytes = metrics_registry.counter(
+    'rtraind_http_response_bytes',
+    'Bytes sent in HTTP response bodies of known length.', ('endpoint', ))
+jobs_submitted = metrics_registry.counter('rtraind_jobs_submitted',
+                                          'Jobs queued for training.')
+jobs_deduplicated = metrics_registry.counter(
+    'rtraind_jobs_deduplicated',
+    'Submitted jobs answered with an identical existing job.')
+job_bytes = metrics_registry.counter(
+    'rtraind_job_bytes', 'Bytes of training requests received, uncompressed.')
+submit_phase_seconds = metrics_registry.histogram(
+    'rtraind_submit_phase_duration_seconds',
+    'Time taken by each phase of submitting a job.', ('phase', ))
+job_wait_seconds = metrics_registry.histogram(
+    'rtraind_job_wait_seconds', 'Time for which jobs wait to be claimed.')
+job_phase_seconds = metrics_registry.histogram(
+    'rtraind_job_phase_duration_seconds',
+    'Time taken by each phase of training a job.', ('phase', ))
+job_seconds = metrics_registry.histogram(
+    'rtraind_job_duration_seconds',
+    'Time taken to train jobs, from claim to finish.', ('state', ))
+model_cache_lookups = metrics_registry.counter(
+    'rtraind_model_cache_lookups',
+    'Lookups of compiled models in the trainers\' caches, by result.',
+    ('result', ))
+trainers_started = metrics_registry.counter(
+    'rtraind_trainers_started',
+    'Trainer worker processes started, by reason.', ('reason', ))
+jobs_by_state = metrics_registry.gauge(
+    'rtraind_jobs',
+    'Jobs held in the database, by state.', ('state', ),
+    function=lambda: _job_counts())
+
 # Tell TensorFlow to be quiet.
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 
-def create_app(config):
+def create_app(config, notifier=None):
+    """Create the rtraind application.
+
+    The notifier, if given, is told whenever a new job is submitted.
+    Requests with bodies larger than the configured limit are rejected."""
     global password
+    global job_notifier
+    global status_refresh_interval
+    global result_retention
+    global deduplicate_jobs
 
     app = flask.Flask(__name__)
     app.register_blueprint(rtraind_blueprint)
+    app.config['MAX_CONTENT_LENGTH'] = config.max_request_bytes
     password = config.password
+    result_retention = config.result_retention
+    deduplicate_jobs = config.deduplicate_jobs
+    status_refresh_interval = max(5, 2 * config.status_flush_interval)
+    prepare_storage(config)
+    if notifier is not None:
+        job_notifier = notifier
     return app
 
 
@@ -53,32 +167,308 @@ def prepare_database(config):
     Session = sqlalchemy.orm.scoped_session(session_factory)
 
 
+def prepare_storage(config):
+    """Prepare the on-disk stores for jobs, results and datasets."""
+    global spool_directory
+    global result_directory
+    global dataset_store
+
+    spool_directory = config.spool_directory
+    result_directory = config.result_directory
+    dataset_store = rtrain.server_utils.storage.DatasetStore(
+        config.dataset_directory,
+        config.dataset_cache_bytes,
+        in_use=_datasets_in_use)
+
+
+def _datasets_in_use():
+    """List the stored datasets that unfinished jobs still need."""
+    return _database_operations.datasets_in_use(Session())
+
+
+def prepare_trainer(config):
+    """Prepare the state kept by a trainer between jobs."""
+    global model_cache
+    model_cache = rtrain.server_utils.model_cache.ModelCache(
+        config.model_cache_bytes)
+
+
+def _array_header(value):
+    """Get the shape and dtype of an array from a training job.
+
+    Serialised arrays have only their headers decoded, and datasets are
+    memory-mapped rather than read.  Datasets that the server does not hold
+    give None; requests referring to them are rejected separately."""
+    if isinstance(value, str):
+        return rtrain.wire_format.read_base64_npy_header(value)
+    if is_dataset_reference(value):
+        try:
+            value = dataset_store.load(value['dataset'])
+        except FileNotFoundError:
+            return None
+    return value.shape, value.dtype
+
+
+def _valid_training_request(json_data):
+    """Check a JSON training request, including the headers of its arrays."""
+    return validate_training_request(json_data) and validate_array_headers(
+        json_data, _array_header)
+
+
 def extract_training_request(json_data):
     """Validate a training request."""
-    if not validate_training_request(json_data):
+    if not _valid_training_request(json_data):
         return None
 
     return json_data
 
 
-def execute_training_request(training_job, callback):
-    """Execute a deserialised training request, returning a trained model."""
-    model = keras.models.model_from_json(training_job['architecture'])
-    model.compile(
-        loss=training_job['loss'], optimizer=training_job['optimizer'])
+def _batch_jobs(document):
+    """Get the list of jobs from a batch request, or None if it is invalid."""
+    jobs = document.get('jobs') if isinstance(document, dict) else None
+    if not isinstance(jobs, list) or not 0 < len(jobs) <= max_batch_size:
+        return None
+    return jobs
+
+
+def extract_training_batch(json_data):
+    """Validate a batch of training requests, returning the list of jobs."""
+    jobs = _batch_jobs(json_data)
+    if jobs is None or not all(_valid_training_request(j) for j in jobs):
+        return None
+    return jobs
+
+
+def extract_binary_training_request(data, index=None):
+    """Validate a binary training request, returning the decoded job.
+
+    If index is given, the request is a batch, and the job at that position
+    is returned.  The arrays in the returned job are views onto ``data``."""
+    try:
+        header, arrays = rtrain.wire_format.read_container(data)
+    except ValueError:
+        return None
+
+    if index is None:
+        job = header.get('job')
+    else:
+        jobs = _batch_jobs(header)
+        job = jobs[index] if jobs is not None and index < len(jobs) else None
+    if not validate_binary_training_request(job):
+        return None
+
+    try:
+        job = resolve_training_job_arrays(job, arrays)
+    except ValueError:
+        return None
+    if not validate_array_headers(job, _array_header):
+        return None
+    return job
+
+
+def extract_binary_training_batch(data):
+    """Validate a binary batch of training requests, returning the jobs.
+
+    The jobs may share arrays, which are views onto ``data``."""
+    try:
+        header, arrays = rtrain.wire_format.read_container(data)
+    except ValueError:
+        return None
+
+    jobs = _batch_jobs(header)
+    if jobs is None or not all(
+            validate_binary_training_request(j) for j in jobs):
+        return None
+
+    try:
+        jobs = [resolve_training_job_arrays(j, arrays) for j in jobs]
+    except ValueError:
+        return None
+    if not all(validate_array_headers(j, _array_header) for j in jobs):
+        return None
+    return jobs
+
+
+def extract_spooled_training_request(path, binary, batch=False):
+    """Validate a training request that has been spooled to a file.
 
-    model.set_weights([deserialize_array(w) for w in training_job['weights']])
-    x_train = deserialize_array(training_job['x_train'])
-    y_train = deserialize_array(training_job['y_train'])
+    If batch is set, the file holds a batch of requests, and a list of jobs
+    is returned.  Binary requests are memory-mapped, so that only the
+    headers are read; JSON requests must be parsed in full."""
+    if binary:
+        data = rtrain.server_utils.storage.map_file(path)
+        if batch:
+            return extract_binary_training_batch(data)
+        return extract_binary_training_request(data)
+
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            json_data = json.load(f)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    if batch:
+        return extract_training_batch(json_data)
+    return extract_training_request(json_data)
+
+
+def load_training_request(data, index=None):
+    """Decode a stored training request of either format.
+
+    If index is given, the request is a batch, and the job at that position
+    is returned, or None if there is none.  If data is memory-mapped, so
+    are the arrays of a binary request.  Requests are validated only when
+    they are submitted, not again here."""
+    binary = rtrain.wire_format.is_container(data)
+    if binary:
+        document, arrays = rtrain.wire_format.read_container(data)
+    else:
+        document = json.loads(str(data, 'utf8'))
+    if index is None:
+        job = document.get('job') if binary else document
+    else:
+        jobs = _batch_jobs(document)
+        if jobs is None or index >= len(jobs):
+            return None
+        job = jobs[index]
+    if binary:
+        job = resolve_training_job_arrays(job, arrays)
+    return job
+
+
+def _training_array(value, precision=None, dtype=None):
+    """Decode an array from a training job if it is still serialised.
+
+    Arrays sent as bfloat16 are widened to float32; other reduced
+    precisions are left for Keras to convert batch by batch."""
+    if isinstance(value, str):
+        array = deserialize_array(value)
+    elif is_dataset_reference(value):
+        array = dataset_store.load(value['dataset'])
+    else:
+        array = value
 
-    model.fit(
-        x_train,
-        y_train,
-        epochs=training_job['epochs'],
-        callbacks=[callback],
-        verbose=0,
-        batch_size=training_job['batch_size'])
-    return serialize_model(model)
+    if precision == 'bfloat16' and dtype is not None and \
+            numpy.issubdtype(numpy.dtype(dtype), numpy.floating):
+        array = from_transfer_precision(array, precision, numpy.float32)
+    return array
+
+
+@contextlib.contextmanager
+def _phase(timings, phase):
+    """Time a phase of a job, for the job's timings and for the metrics."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings['phases'][phase] = \
+            timings['phases'].get(phase, 0.0) + elapsed
+        job_phase_seconds.observe(elapsed, phase=phase)
+
+
+def execute_training_request(training_job, callback, timings=None):
+    """Execute a deserialised training request.
+
+    The time taken by each phase is added to timings, if given.  Returns
+    the trained model as a binary container, whose header holds the
+    timings up to the end of training."""
+    # Keras is only imported by trainers, when they first need it.
+    import keras.models
+    from rtrain.server_utils.training import ArraySequence, StatusCallback
+
+    if timings is None:
+        timings = new_timings()
+
+    key = rtrain.server_utils.model_cache.model_key(
+        training_job['architecture'], training_job['loss'],
+        training_job['optimizer'])
+    cached = model_cache.take(key)
+    if cached is not None:
+        model_cache_lookups.inc(result='hit')
+        model, optimizer_state = cached
+        with _phase(timings, 'reset_optimizer'):
+            for variable, value in zip(model.optimizer.variables,
+                                       optimizer_state):
+                variable.assign(value)
+    else:
+        model_cache_lookups.inc(result='miss')
+        with _phase(timings, 'model_from_json'):
+            model = keras.models.model_from_json(training_job['architecture'])
+        with _phase(timings, 'compile'):
+            model.compile(
+                loss=training_job['loss'],
+                optimizer=training_job['optimizer'])
+            optimizer_state = None
+            # The optimizers of Keras before 2.11 cannot be built ahead of
+            # training, so their models are not cached.
+            if (model_cache.max_bytes > 0 and
+                    hasattr(model.optimizer, 'build')):
+                # The optimizer is built now, rather than by fit(), so that
+                # its initial state can be restored when the model is reused.
+                model.optimizer.build(model.trainable_variables)
+                optimizer_state = [
+                    variable.numpy() for variable in model.optimizer.variables
+                ]
+
+    precision = training_job.get('precision')
+    dtypes = training_job.get('dtypes', {})
+    weight_dtypes = dtypes.get('weights', [None] * len(training_job['weights']))
+    if len(weight_dtypes) != len(training_job['weights']):
+        raise ValueError('Weight dtypes do not match the weights.')
+
+    with _phase(timings, 'set_weights'):
+        model.set_weights([
+            _training_array(w, precision, dtype)
+            for w, dtype in zip(training_job['weights'], weight_dtypes)
+        ])
+    with _phase(timings, 'decode'):
+        x_train = _training_array(training_job['x_train'], precision,
+                                  dtypes.get('x_train'))
+        y_train = _training_array(training_job['y_train'],
+                                  label_precision(training_job),
+                                  dtypes.get('y_train'))
+    if isinstance(callback, StatusCallback):
+        callback.samples_per_epoch = len(x_train)
+
+    if rtrain.server_utils.storage.is_mapped(x_train) or \
+            rtrain.server_utils.storage.is_mapped(y_train):
+        # Passing the arrays directly to fit() could cause them to be
+        # copied into memory in their entirety.
+        fit_arguments = dict(
+            x=ArraySequence(x_train, y_train, training_job['batch_size']),
+            shuffle=False)
+    else:
+        fit_arguments = dict(
+            x=x_train, y=y_train, batch_size=training_job['batch_size'])
+    with _phase(timings, 'fit'):
+        model.fit(
+            epochs=training_job['epochs'],
+            callbacks=[callback],
+            verbose=0,
+            **fit_arguments)
+
+    # The trained weights are returned at the precision at which they
+    # were sent.
+    with _phase(timings, 'serialize_model'):
+        result = serialize_model_binary(model, precision,
+                                        dtypes.get('weights'),
+                                        copy.deepcopy(timings))
+
+    if optimizer_state is not None:
+        model_cache.put(key, (model, optimizer_state),
+                        _model_bytes(model, optimizer_state))
+    return result
+
+
+def _model_bytes(model, optimizer_state):
+    """Estimate the memory held by a cached model.
+
+    This counts the model's weights, and its optimizer's variables twice,
+    once for the variables themselves and once for their initial values."""
+    weight_bytes = sum(
+        int(numpy.prod(w.shape)) * numpy.dtype(w.dtype).itemsize
+        for w in model.weights)
+    return weight_bytes + 2 * sum(value.nbytes for value in optimizer_state)
 
 
 ##########################################################################
@@ -119,45 +509,109 @@ def requires_auth(f):
 ##########################################################################
 
 
-class StatusCallback(keras.callbacks.Callback):
-    """A callback class to store job status to the database."""
-
-    def __init__(self, job_id, db):
-        self.db = db
-        self.job_id = job_id
-        self.epochs_finished = 0
-        self.samples_this_epoch = 0
-        self.last_update = -1
-
-    def on_epoch_begin(self, epoch, logs=None):
-        self.samples_this_epoch = 0
-
-    def on_batch_end(self, batch, logs=None):
-        batch_size = logs.get('size', 0)
-        self.samples_this_epoch += batch_size
+# The files to which each profiler's output is written.
+_profile_suffixes = {'cprofile': '.prof', 'tensorflow': '.trace.tar.gz'}
 
-        current_time = time.time()
-        if current_time - self.last_update > 0.5:
-            _database_operations.update_status(
-                self.job_id, 100.0 *
-                (float(self.samples_this_epoch) / self.params['samples'] +
-                 self.epochs_finished) / self.params['epochs'], self.db)
-            self.last_update = current_time
 
-    def on_epoch_end(self, epoch, logs=None):
-        self.epochs_finished += 1
+@contextlib.contextmanager
+def _profiled(profiler, path):
+    """Profile the body of a with statement, writing the profile to path.
 
-
-def trainer():
-    """Thread that performs the actual model training."""
+    The cProfile profile is in the format read by pstats; the TensorFlow
+    trace is a gzipped tar archive of a TensorBoard log directory."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+    else:
+        import tensorflow
+        log_directory = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            tensorflow.profiler.experimental.start(log_directory)
+            try:
+                yield
+            finally:
+                tensorflow.profiler.experimental.stop()
+                archive = shutil.make_archive(log_directory, 'gztar',
+                                              log_directory)
+                os.replace(archive, path)
+        finally:
+            shutil.rmtree(log_directory, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def _heartbeat(job_id, worker_name, interval):
+    """Report that a worker is alive every interval seconds while it runs
+    the body of a with statement.
+
+    The reports come from a thread of their own, so that they continue
+    through long phases of a job that report no progress."""
+    if interval is None:
+        yield
+        return
+
+    stopped = threading.Event()
+
+    def beat():
+        session = Session()
+        try:
+            while not stopped.wait(interval):
+                try:
+                    _database_operations.heartbeat(job_id, worker_name,
+                                                   session)
+                except sqlalchemy.exc.SQLAlchemyError:
+                    session.rollback()
+                    logger.new(
+                        worker=worker_name, job_id=job_id).error(
+                            'trainer::heartbeat::failed', exc_info=True)
+        finally:
+            Session.remove()
+
+    thread = threading.Thread(
+        target=beat, name='rtraind-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def trainer(worker_name,
+            notifier,
+            poll_interval,
+            publisher,
+            max_jobs=None,
+            max_memory=None,
+            retiring=None,
+            heartbeat_interval=None):
+    """Thread that performs the actual model training.
+
+    While idle, the trainer sleeps until the notifier tells it of a new
+    job, only checking the database every poll_interval seconds.  Changes
+    in job status are sent to the publisher.  The trainer returns once it
+    has run max_jobs jobs, or after a job that leaves its process with
+    more than max_memory resident bytes, so that it can be replaced.  If
+    given, retiring is called as soon as the trainer knows that it will
+    return, which may be before it has finished its last job.  While it
+    runs a job, the trainer reports that it is alive every
+    heartbeat_interval seconds, if given.  A job that has been given to
+    another worker in the meantime is not finished by this one."""
     session = Session()
-    log = logger.new()
+    log = logger.new(worker=worker_name)
+    jobs_run = 0
     while True:
         log.debug('trainer::job::wait_for_next')
         while True:
-            next_job = _database_operations.get_next_job(session)
+            next_job = _database_operations.claim_next_job(
+                worker_name, session)
             if next_job is None:
-                time.sleep(1)
+                notifier.wait(poll_interval)
                 continue
             else:
                 break
@@ -170,119 +624,1100 @@ def trainer():
             continue
 
         job_log.info('trainer::job::job_start')
-        for i, tj in enumerate(job.training_jobs):
-            subjob_log = job_log.bind(subjob_type='training', subjob=i)
-            subjob_log.info('trainer::job::subjob_start')
-            training_data = str(tj.training_job, 'utf8')
-            training_request = extract_training_request(
-                json.loads(training_data))
-            callback = StatusCallback(job.id, session)
-            try:
-                result = execute_training_request(training_request, callback)
-                _database_operations.finish_job(job.id, result, session)
-            except:
-                subjob_log.error('trainer::job::error', exc_info=True)
-                _database_operations.update_status(job.id, -1, session)
-                _database_operations.finish_job(job.id,
-                                                traceback.format_exc(),
-                                                session)
-            subjob_log.info('trainer::job::subjob_finished')
+        jobs_run += 1
+        if max_jobs is not None and jobs_run >= max_jobs and \
+                retiring is not None:
+            retiring()
+        publisher.publish(job.id, state=job.state)
+        if job.claim_time is not None and job.creation_time is not None:
+            job_wait_seconds.observe(
+                max(0, (job.claim_time - job.creation_time).total_seconds()))
+        job_start = time.perf_counter()
+        with _heartbeat(job.id, worker_name, heartbeat_interval):
+            _run_job(job, worker_name, session, publisher, job_log,
+                     job_start)
         job_log.info('trainer::job::job_finished')
 
+        if max_jobs is not None and jobs_run >= max_jobs:
+            log.info('trainer::worker::recycle', reason='max_jobs')
+            return
+        if max_memory is not None and _resident_bytes() > max_memory:
+            log.info('trainer::worker::recycle', reason='max_memory')
+            if retiring is not None:
+                retiring()
+            return
+
+
+def _run_job(job, worker_name, session, publisher, job_log, job_start):
+    """Train the models of a job claimed by a worker, recording the results.
+
+    Nothing is recorded if the job has been given to another worker."""
+    from rtrain.server_utils.training import StatusCallback
+
+    for i, tj in enumerate(job.training_jobs):
+        subjob_log = job_log.bind(subjob_type='training', subjob=i)
+        subjob_log.info('trainer::job::subjob_start')
+        timings = new_timings()
+        callback = StatusCallback(job.id, publisher, timings)
+        profile_path = None
+        try:
+            with _phase(timings, 'load'):
+                if tj.training_job_path is not None:
+                    training_data = rtrain.server_utils.storage.map_file(
+                        tj.training_job_path)
+                else:
+                    training_data = tj.training_job
+                training_request = load_training_request(
+                    training_data, tj.training_job_index)
+
+            profiler = (training_request or {}).get('profile')
+            if profiler is not None:
+                profile_path = os.path.join(
+                    result_directory, job.id + _profile_suffixes[profiler])
+                with _profiled(profiler, profile_path):
+                    result = execute_training_request(
+                        training_request, callback, timings)
+            else:
+                result = execute_training_request(training_request,
+                                                  callback, timings)
+
+            # The result would replace that of the worker now running it.
+            if not _database_operations.heartbeat(job.id, worker_name,
+                                                  session):
+                subjob_log.warn('trainer::job::claim_lost')
+                return
+            result_path = os.path.join(result_directory, '%s.model' % job.id)
+            with _phase(timings, 'store'):
+                rtrain.server_utils.storage.write_file(result_path, result)
+            finished = _database_operations.finish_job(
+                job.id,
+                None,
+                session,
+                result_path=result_path,
+                result_size=len(result),
+                timings=timings,
+                profile_path=profile_path,
+                worker_name=worker_name)
+            state = rtrain.server_utils.model.JOB_DONE
+        except:
+            subjob_log.error('trainer::job::error', exc_info=True)
+            if profile_path is not None and \
+                    not os.path.exists(profile_path):
+                profile_path = None
+            finished = _database_operations.finish_job(
+                job.id,
+                traceback.format_exc(),
+                session,
+                failed=True,
+                timings=timings,
+                profile_path=profile_path,
+                worker_name=worker_name)
+            state = rtrain.server_utils.model.JOB_FAILED
+
+        if not finished:
+            subjob_log.warn('trainer::job::claim_lost')
+            return
+        fields = dict(finished=1, state=state, timings=timings)
+        if state == rtrain.server_utils.model.JOB_FAILED:
+            fields['status'] = -1
+        publisher.publish(job.id, **fields)
+        job_seconds.observe(time.perf_counter() - job_start, state=state)
+        subjob_log.info('trainer::job::subjob_finished')
+
+
+def _resident_bytes():
+    """The memory in use by this process, in bytes.
+
+    Where the current resident set size is unavailable, its peak is used."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # The peak is given in kilobytes, except on macOS.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
 
-def cleaner():
-    """Thread that purges old jobs from the database."""
+def _available_cores():
+    """The number of cores on which this process may run."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def warm_up(threads=None):
+    """Initialise the Keras backend before the first job arrives.
+
+    A tiny model is trained, so that the backend's devices, thread pools
+    and kernels are ready for the first job.  If threads is given, the
+    TensorFlow backend uses no more than that many threads per pool."""
+    import keras
+    import keras.layers
+    import keras.models
+
+    if threads is not None and keras.backend.backend() == 'tensorflow':
+        import tensorflow
+        tensorflow.config.threading.set_intra_op_parallelism_threads(threads)
+        tensorflow.config.threading.set_inter_op_parallelism_threads(threads)
+
+    model = keras.models.Sequential(
+        [keras.layers.Input((1, )), keras.layers.Dense(1)])
+    model.compile(loss='mean_squared_error', optimizer='sgd')
+    model.fit(numpy.zeros((1, 1)), numpy.zeros((1, 1)), verbose=0)
+
+
+def trainer_process(config,
+                    worker_name,
+                    local_notifier,
+                    status_queue,
+                    metrics_queue,
+                    threads=None,
+                    retiring=None):
+    """Entry point for a trainer worker process.
+
+    Each worker has its own database connection and Keras backend, which
+    is warmed up, using at most threads threads, before the worker claims
+    any jobs.  Changes in job status are sent to the main process through
+    status_queue, and metrics through metrics_queue.  The process exits
+    when the trainer is due to be replaced, having first sent a message
+    on the connection retiring, if given, so that its replacement can
+    warm up while it finishes its last job."""
+    metrics_registry.forward(metrics_queue)
+    prepare_database(config)
+    prepare_storage(config)
+    prepare_trainer(config)
+    notifier = rtrain.server_utils.notify.make_notifier(
+        config, local_notifier)
+
+    log = logger.new(worker=worker_name)
+    start = time.perf_counter()
+    warm_up(threads)
+    log.info(
+        'trainer::worker::ready', warm_up_seconds=time.perf_counter() - start)
+    trainer(worker_name, notifier, config.idle_poll_interval,
+            rtrain.server_utils.status.QueuePublisher(status_queue),
+            config.worker_max_jobs, config.worker_max_memory,
+            (lambda: retiring.send(worker_name))
+            if retiring is not None else None, config.claim_timeout / 4)
+
+
+def start_trainers(config, local_notifier):
+    """Start a pool of trainer worker processes, and keep it full.
+
+    There is at most one worker per available core, and the cores are
+    divided between them.  Workers are started in advance, and warm up
+    before claiming jobs; those that retire or fail are replaced by
+    supervise_trainers().  Status updates and metrics from the workers are
+    relayed to the status board and the metrics registry.  Returns the
+    list of workers, as for supervise_trainers(), which is kept up to
+    date."""
+    log = logger.new()
+    cores = _available_cores()
+    worker_count = config.workers
+    if worker_count > cores:
+        log.warn(
+            'startup::workers::limited_to_cores',
+            workers=worker_count,
+            cores=cores)
+        worker_count = cores
+    threads = max(1, cores // worker_count) if worker_count else None
+
+    # Forking would share the parent's backend state with the workers.
+    context = multiprocessing.get_context('spawn')
+    status_queue = context.Queue()
+    threading.Thread(
+        target=rtrain.server_utils.status.relay,
+        args=(status_queue, status_board),
+        daemon=True).start()
+    metrics_queue = context.Queue()
+    threading.Thread(
+        target=rtrain.server_utils.metrics.relay,
+        args=(metrics_queue, metrics_registry),
+        daemon=True).start()
+
+    started = itertools.count()
+
+    def start_worker(reason):
+        i = next(started)
+        worker_name = '%s:%d:%d' % (socket.gethostname(), os.getpid(), i)
+        connection, retiring = context.Pipe(duplex=False)
+        worker = context.Process(
+            target=trainer_process,
+            args=(config, worker_name, local_notifier, status_queue,
+                  metrics_queue, threads, retiring),
+            name='rtraind-trainer-%d' % i,
+            daemon=True)
+        worker.start()
+        retiring.close()
+        trainers_started.inc(reason=reason)
+        return worker, connection
+
+    workers = [start_worker('start') for _ in range(worker_count)]
+    if workers:
+        threading.Thread(
+            target=supervise_trainers,
+            args=(workers, start_worker),
+            daemon=True).start()
+    return workers
+
+
+def supervise_trainers(workers, start_worker):
+    """Replace trainer processes as they retire or fail, forever.
+
+    workers is a list of pairs of a process and a connection on which it
+    announces that it is about to retire; a replacement is started at once,
+    to warm up while the retiring worker finishes its last job.  Workers
+    that exit without doing so have failed, and are replaced when they
+    exit.  start_worker is called with the reason for starting a new
+    worker, and returns a new pair."""
+    log = logger.new()
+    retiring = []
+    while True:
+        multiprocessing.connection.wait(
+            [w.sentinel for w, _ in workers] +
+            [c for _, c in workers if c is not None] +
+            [w.sentinel for w in retiring])
+
+        for worker in [w for w in retiring if not w.is_alive()]:
+            worker.join()
+            retiring.remove(worker)
+            log.info(
+                'trainer::worker::exited',
+                worker=worker.name,
+                exitcode=worker.exitcode)
+
+        for i, (worker, connection) in enumerate(workers):
+            if connection is not None and connection.poll():
+                try:
+                    connection.recv()
+                except EOFError:
+                    # The worker exited without a word.
+                    connection.close()
+                    workers[i] = worker, None
+                else:
+                    connection.close()
+                    retiring.append(worker)
+                    workers[i] = start_worker('recycle')
+                    continue
+
+            if worker.is_alive():
+                continue
+            worker.join()
+            if connection is not None:
+                connection.close()
+            log.error(
+                'trainer::worker::failed',
+                worker=worker.name,
+                exitcode=worker.exitcode)
+            # Don't spin if workers fail as soon as they start.
+            time.sleep(trainer_restart_delay)
+            workers[i] = start_worker('failure')
+
+
+def cleaner(config):
+    """Thread that purges old jobs from the database.
+
+    Jobs are kept according to the retention policy in the configuration,
+    and their files are removed with them.  The thread also returns jobs
+    whose workers have stopped reporting that they are alive to the queue,
+    failing those that have been tried too many times."""
     session = Session()
+    log = logger.new()
     while True:
-        _database_operations.purge_old_jobs(session)
+        for path in _database_operations.purge_old_jobs(
+                session,
+                max_age=config.result_retention,
+                max_jobs=config.max_jobs,
+                max_result_bytes=config.max_result_bytes,
+                max_unfinished_age=config.unfinished_job_retention):
+            rtrain.server_utils.storage.remove_file(path)
+            for encoding in rtrain.compression.supported():
+                rtrain.server_utils.storage.remove_file(
+                    rtrain.server_utils.storage.compressed_path(
+                        path, encoding))
+
+        cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=config.claim_timeout)
+        requeued, failed = _database_operations.requeue_stale_jobs(
+            cutoff_time, session, config.max_attempts)
+        if requeued:
+            log.warn('cleaner::requeue_stale_jobs', jobs=requeued)
+        if failed:
+            log.error('cleaner::fail_abandoned_jobs', jobs=failed)
+        status_board.prune(600)
         time.sleep(30)
 
 
-@rtraind_blueprint.route("/ping")
-def ping():
-    """Basic health check request."""
-    return '{}'
+def status_writer(interval):
+    """Thread that writes job progress from the status board to the database.
 
+    Progress is written in batches every interval seconds."""
+    session = Session()
+    log = logger.new()
 
-@rtraind_blueprint.route("/train", methods=['POST'])
+    def write(statuses):
+        try:
+            _database_operations.update_statuses(statuses, session)
+        except sqlalchemy.exc.SQLAlchemyError:
+            session.rollback()
+            log.error('status_writer::write_failed', exc_info=True)
+
+    rtrain.server_utils.status.writer(status_board, write, interval)
+
+
+def status_pruner():
+    """Thread that forgets jobs that finished long ago from the status board.
+
+    This is needed only by processes without a cleaner thread."""
+    while True:
+        time.sleep(30)
+        status_board.prune(600)
+
+
+class _CountingReader(object):
+    """Count the bytes read from a stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class _LimitedReader(object):
+    """Reject a request once more than limit bytes are read from a stream.
+
+    This applies the limit on the size of a request to its body after
+    decompression, which may be far larger than the body as sent."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        if self.count > self.limit:
+            flask.abort(413)
+        return data
+
+
+@rtraind_blueprint.before_request
+def _start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@rtraind_blueprint.teardown_app_request
+def _remove_session(exception=None):
+    """Return the request thread's database connection to the pool.
+
+    Threads serving requests live as long as the server, so a session left
+    open would hold its connection, and its transaction, indefinitely."""
+    _release_session()
+
+
+def _release_session():
+    """Close the current thread's database session, if it has one."""
+    if Session is not None:
+        Session.remove()
+
+
+@rtraind_blueprint.after_request
+def _record_request_metrics(response):
+    """Record the latency and size of each request and its response."""
+    endpoint = flask.request.endpoint or 'none'
+    http_requests.inc(
+        method=flask.request.method,
+        endpoint=endpoint,
+        status=response.status_code)
+    http_request_seconds.observe(
+        time.perf_counter() - flask.g.request_start,
+        method=flask.request.method,
+        endpoint=endpoint)
+
+    # Bodies streamed with chunked encoding have no Content-Length.
+    request_body = flask.g.get('request_body')
+    if request_body is not None:
+        http_request_bytes.inc(request_body.count, endpoint=endpoint)
+    elif flask.request.content_length:
+        http_request_bytes.inc(
+            flask.request.content_length, endpoint=endpoint)
+    if response.content_length:
+        http_response_bytes.inc(response.content_length, endpoint=endpoint)
+    return response
+
+
+def _job_counts():
+    """Count the jobs in each state, for the rtraind_jobs gauge."""
+    if Session is None:
+        return {}
+    return {(state, ): count
+            for state, count in _database_operations.count_jobs_by_state(
+                Session()).items()}
+
+
+@rtraind_blueprint.route("/metrics")
 @requires_auth
-def request_training():
-    """Request handler for training requests."""
-    log = logger.new()
-    request_content = flask.request.get_json()
-    if request_content is None:
+def request_metrics():
+    """Handler for server metrics, in the Prometheus text format.
+
+    Metrics from trainer processes are included."""
+    return flask.Response(
+        metrics_registry.render(),
+        content_type=rtrain.server_utils.metrics.CONTENT_TYPE)
+
+
+@rtraind_blueprint.route("/ping")
+def ping():
+    """Basic health check request.
+
+    The response lists the content codings accepted in request bodies."""
+    return flask.Response(
+        '{}',
+        headers={'Accept-Encoding': ', '.join(
+            rtrain.compression.supported())})
+
+
+def _request_stream():
+    """Get the request body, decompressing it if necessary.
+
+    Bodies that decompress to more than the request size limit are
+    rejected as they are read."""
+    encoding = flask.request.headers.get('Content-Encoding',
+                                         'identity').strip().lower()
+    flask.g.request_body = _CountingReader(flask.request.stream)
+    if encoding == 'identity':
+        return flask.g.request_body
+    if encoding not in rtrain.compression.ENCODINGS:
+        logger.new().error(
+            'frontend::request::unsupported_encoding', encoding=encoding)
+        flask.abort(
+            flask.Response(
+                status=415,
+                headers={
+                    'Accept-Encoding': ', '.join(
+                        rtrain.compression.supported())
+                }))
+    stream = rtrain.compression.DecompressingReader(flask.g.request_body,
+                                                    encoding)
+    limit = flask.current_app.config['MAX_CONTENT_LENGTH']
+    if limit is not None:
+        stream = _LimitedReader(stream, limit)
+    return stream
+
+
+def _spool_training_request(log, batch):
+    """Spool and validate the body of a training request.
+
+    Returns the spooled file; for each job that it holds, the digests of
+    the stored datasets to which the job refers; and, for a JSON batch, the
+    paths of the files to which its jobs have been split, or None.  Invalid
+    requests, and those referring to datasets that the server does not
+    hold, are rejected."""
+    binary = flask.request.mimetype == rtrain.wire_format.CONTENT_TYPE
+    if not binary and not flask.request.is_json:
         log.error('frontend::train_request::invalid_json')
         flask.abort(415)
 
-    training_request = extract_training_request(request_content)
+    # The request body is streamed to disk rather than held in memory.
+    try:
+        with submit_phase_seconds.time(phase='spool'):
+            spooled = rtrain.server_utils.storage.spool_stream(
+                _request_stream(), spool_directory)
+    except ValueError:
+        log.error('frontend::train_request::invalid_encoding')
+        flask.abort(400)
+    job_bytes.inc(spooled.size)
+    try:
+        with submit_phase_seconds.time(phase='validate'):
+            training_request = extract_spooled_training_request(
+                spooled.path, binary, batch)
+    except:
+        rtrain.server_utils.storage.remove_file(spooled.path)
+        raise
+
     if training_request is None:
+        rtrain.server_utils.storage.remove_file(spooled.path)
         log.error('frontend::train_request::invalid_request')
         flask.abort(400)
 
-    job_id = _database_operations.create_new_job(training_request, Session())
+    jobs = training_request if batch else [training_request]
+    datasets = [list(dict.fromkeys(dataset_references(job))) for job in jobs]
+    missing = dataset_store.missing(
+        list(dict.fromkeys(digest for d in datasets for digest in d)))
+    if missing:
+        rtrain.server_utils.storage.remove_file(spooled.path)
+        log.error('frontend::train_request::missing_datasets')
+        flask.abort(
+            flask.Response(
+                json.dumps({
+                    'missing': missing
+                }), 409, mimetype='application/json'))
+
+    # Each job of a JSON batch is stored on its own, since trainers would
+    # otherwise parse the whole batch to read any one of its jobs.
+    paths = None
+    if batch and not binary:
+        try:
+            with submit_phase_seconds.time(phase='spool'):
+                paths = _spool_jobs(jobs)
+        finally:
+            rtrain.server_utils.storage.remove_file(spooled.path)
+    return spooled, datasets, paths
+
+
+def _spool_jobs(jobs):
+    """Spool each of several JSON jobs to a file, returning their paths."""
+    paths = []
+    try:
+        for job in jobs:
+            paths.append(
+                rtrain.server_utils.storage.spool_stream(
+                    io.BytesIO(json.dumps(job).encode('utf8')),
+                    spool_directory).path)
+    except BaseException:
+        for path in paths:
+            rtrain.server_utils.storage.remove_file(path)
+        raise
+    return paths
+
+
+def _duplicate_jobs(checksums):
+    """Find existing jobs that new jobs with the given checksums duplicate.
+
+    Returns a dictionary mapping checksums to job IDs, which is empty if
+    deduplication is disabled."""
+    if not deduplicate_jobs:
+        return {}
+    session = Session()
+    duplicates = _database_operations.find_duplicate_jobs(
+        checksums, result_retention, session)
+    if duplicates:
+        _database_operations.record_access(
+            list(set(duplicates.values())), session)
+    return duplicates
+
+
+@rtraind_blueprint.route("/train", methods=['POST'])
+@requires_auth
+def request_training():
+    """Request handler for training requests.
+
+    Jobs may be submitted either as JSON or as a binary container; clients
+    that receive a 415 response for the latter should fall back to JSON."""
+    log = logger.new()
+    spooled, (datasets, ), _ = _spool_training_request(log, batch=False)
+
+    duplicates = _duplicate_jobs([spooled.checksum])
+    if duplicates:
+        rtrain.server_utils.storage.remove_file(spooled.path)
+        job_id = duplicates[spooled.checksum]
+        jobs_deduplicated.inc()
+        log.info('frontend::train_request::duplicate_job', job_id=job_id)
+        return job_id
+
+    with submit_phase_seconds.time(phase='create_job'):
+        job_id = _database_operations.create_spooled_job(
+            spooled.path, spooled.checksum, Session(), datasets=datasets)
+    jobs_submitted.inc()
+    status_board.publish(job_id, state=rtrain.server_utils.model.JOB_QUEUED)
+    job_notifier.notify()
     log.info('frontend::train_request::request_training', job_id=job_id)
     return job_id
 
 
+@rtraind_blueprint.route("/train/batch", methods=['POST'])
+@requires_auth
+def request_training_batch():
+    """Request handler for batches of training requests.
+
+    The request is as for /train, except that in place of a single job
+    there is a list of 'jobs'; in a binary container, they may share
+    arrays.  Returns a JSON list of the new jobs' IDs, in order."""
+    log = logger.new()
+    spooled, datasets, paths = _spool_training_request(log, batch=True)
+    count = len(datasets)
+
+    checksums = _database_operations.batch_checksums(spooled.checksum, count)
+    duplicates = _duplicate_jobs(checksums)
+    new_indices = [
+        i for i, checksum in enumerate(checksums) if checksum not in duplicates
+    ]
+    if new_indices:
+        with submit_phase_seconds.time(phase='create_job'):
+            new_job_ids = iter(
+                _database_operations.create_spooled_batch(
+                    spooled.path,
+                    spooled.checksum,
+                    count,
+                    Session(),
+                    new_indices,
+                    datasets=datasets,
+                    paths=paths))
+    else:
+        rtrain.server_utils.storage.remove_file(spooled.path)
+        new_job_ids = iter([])
+    if paths is not None:
+        for i, checksum in enumerate(checksums):
+            if checksum in duplicates:
+                rtrain.server_utils.storage.remove_file(paths[i])
+
+    job_ids = [
+        duplicates[checksum] if checksum in duplicates else next(new_job_ids)
+        for checksum in checksums
+    ]
+    for i in new_indices:
+        status_board.publish(
+            job_ids[i], state=rtrain.server_utils.model.JOB_QUEUED)
+    if new_indices:
+        job_notifier.notify(len(new_indices))
+    jobs_submitted.inc(len(new_indices))
+    jobs_deduplicated.inc(count - len(new_indices))
+    if duplicates:
+        log.info('frontend::train_request::duplicate_jobs',
+                 job_ids=sorted(set(duplicates.values())))
+    log.info('frontend::train_request::request_training_batch',
+             job_ids=job_ids)
+    return flask.Response(json.dumps(job_ids), mimetype='application/json')
+
+
+@rtraind_blueprint.route("/jobs/find", methods=['POST'])
+@requires_auth
+def request_find_jobs():
+    """Handler to find jobs recently submitted with given checksums.
+
+    A client whose submission failed part way through uses this to learn
+    whether the job was created anyway, before submitting it again.  The
+    checksum of a job is the upper-case hexadecimal SHA-256 digest of the
+    uncompressed request body; for a job in a batch it is that of
+    '<batch checksum>:<index>'."""
+    request_content = flask.request.get_json(silent=True)
+    if not isinstance(request_content, dict):
+        flask.abort(400)
+
+    checksums = request_content.get('checksums')
+    max_age = request_content.get('max_age', 3600)
+    if not isinstance(checksums, list) or \
+            not 0 < len(checksums) <= max_batch_size or \
+            not all(isinstance(c, str) and len(c) == 64 for c in checksums) \
+            or not isinstance(max_age, (int, float)) or max_age < 0:
+        flask.abort(400)
+
+    return json.dumps({
+        'jobs':
+        _database_operations.find_jobs(checksums, max_age, Session())
+    })
+
+
+@rtraind_blueprint.route("/datasets/missing", methods=['POST'])
+@requires_auth
+def request_missing_datasets():
+    """Handler to determine which of a list of datasets must be uploaded."""
+    request_content = flask.request.get_json(silent=True)
+    if not isinstance(request_content, dict):
+        flask.abort(400)
+
+    digests = request_content.get('datasets')
+    if not isinstance(digests, list) or not all(
+            dataset_store.valid_digest(d) for d in digests):
+        flask.abort(400)
+
+    return json.dumps({'missing': dataset_store.missing(digests)})
+
+
+@rtraind_blueprint.route("/datasets/<digest>", methods=['PUT'])
+@requires_auth
+def request_upload_dataset(digest):
+    """Handler for dataset uploads."""
+    log = logger.new()
+    if not dataset_store.valid_digest(digest):
+        flask.abort(404)
+
+    try:
+        dataset_store.add(digest, _request_stream())
+    except ValueError:
+        log.error('frontend::dataset_upload::invalid_dataset', digest=digest)
+        flask.abort(400)
+
+    log.info('frontend::dataset_upload::dataset_stored', digest=digest)
+    return '{}'
+
+
 @rtraind_blueprint.route("/status/<job_id>", methods=['GET'])
 @requires_auth
 def request_status(job_id):
-    """Handler for job status requests."""
+    """Handler for job status requests.
+
+    If the 'wait' parameter is given, the request blocks for up to that
+    many seconds until the version of the job's status exceeds 'since'."""
+    wait = flask.request.args.get('wait', type=float)
+    since = flask.request.args.get('since', -1, type=int)
+
+    # Known jobs are answered from the status board, not the database.
+    if wait and status_board.get(job_id) is not None:
+        if not _wait_for_status([job_id], since, min(wait, max_status_wait)):
+            _database_status(job_id)
+    elif not _database_status(job_id):
+        flask.abort(404)
+
+    entry = status_board.get(job_id)
+    if entry is None:
+        flask.abort(404)
+    return json.dumps(_status_document(entry))
+
+
+def _status_document(entry):
+    """Describe a job's status, from its entry in the status board.
+
+    Once the job has started, 'timings' gives the time taken by each
+    phase so far and the samples trained per second in each epoch."""
+    return {
+        'status': entry['status'],
+        'finished': entry['finished'],
+        'state': entry['state'],
+        'version': entry['version'],
+        'timings': entry['timings']
+    }
+
+
+@rtraind_blueprint.route("/status", methods=['GET'])
+@requires_auth
+def request_statuses():
+    """Handler for the status of several jobs at once.
+
+    The 'ids' parameter is a comma-separated list of job IDs.  Returns an
+    object whose 'jobs' member maps each ID to the job's status, or to null
+    if there is no such job.  As for /status/<job_id>, 'wait' and 'since'
+    may be given to wait until any of the jobs' versions exceeds 'since'."""
+    job_ids = [
+        job_id for job_id in flask.request.args.get('ids', '').split(',')
+        if job_id
+    ]
+    if not job_ids or len(job_ids) > max_batch_size:
+        flask.abort(400)
+    wait = flask.request.args.get('wait', type=float)
+    since = flask.request.args.get('since', -1, type=int)
+
+    if wait and all(status_board.get(j) is not None for j in job_ids):
+        _wait_for_status(job_ids, since, min(wait, max_status_wait))
+    _database_statuses(job_ids)
+
+    statuses = {}
+    for job_id in job_ids:
+        entry = status_board.get(job_id)
+        statuses[job_id] = None if entry is None else _status_document(entry)
+    return json.dumps({'jobs': statuses})
+
+
+def _wait_for_status(job_ids, since, timeout):
+    """Wait until the version of any of several jobs exceeds since.
+
+    Nothing is published here for jobs being run by trainers in another
+    process, so the database is checked every status_refresh_interval
+    seconds while waiting.  Returns True if a job's version changed, or
+    False if the timeout expired first."""
+    deadline = time.time() + timeout
+    while True:
+        # No connection is held while waiting.
+        _release_session()
+        remaining = max(0, deadline - time.time())
+        with rtrain.server_utils.http.waiting(flask.request.environ):
+            changed = status_board.wait_any(
+                job_ids, since, min(remaining, status_refresh_interval))
+        if changed:
+            return True
+        if remaining <= status_refresh_interval:
+            return False
+        _database_statuses(job_ids)
+
+
+def _database_statuses(job_ids):
+    """Read the status of several jobs from the database in one query.
+
+    As for _database_status(), jobs updated recently are left alone."""
+    now = time.time()
+    stale = []
+    for job_id in job_ids:
+        current = status_board.get(job_id)
+        if current is None or \
+                now - current['updated'] >= status_refresh_interval:
+            stale.append(job_id)
+    if not stale:
+        return
+
+    statuses = _database_operations.get_statuses(stale, Session())
+    for job_id, status in statuses.items():
+        _refresh_status(job_id, status)
+
+
+def _database_status(job_id):
+    """Read the status of a job from the database into the status board.
+
+    This picks up changes made by trainers that report elsewhere, such as
+    on other hosts.  Jobs updated recently enough that the database may
+    not yet have caught up are left alone.  Returns False if the job does
+    not exist."""
+    current = status_board.get(job_id)
+    if current is not None and \
+            time.time() - current['updated'] < status_refresh_interval:
+        return True
+
     status = _database_operations.get_status(job_id, Session())
     if status is None:
+        return False
+
+    _refresh_status(job_id, status)
+    return True
+
+
+def _refresh_status(job_id, status):
+    """Copy a job's status, as read from the database, to the status board."""
+    fields = dict(
+        status=status.status, finished=status.finished, state=status.state)
+    # Timings are only written when the job finishes, so the status board
+    # may know more of them than the database.
+    if status.timings is not None:
+        fields['timings'] = json.loads(status.timings)
+    status_board.refresh(job_id, **fields)
+
+
+def _server_sent_event(event, data, event_id=None):
+    """Format a server-sent event."""
+    lines = []
+    if event_id is not None:
+        lines.append('id: %s' % event_id)
+    lines.append('event: %s' % event)
+    lines.append('data: %s' % json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
+
+
+@rtraind_blueprint.route("/events/<job_id>", methods=['GET'])
+@requires_auth
+def request_events(job_id):
+    """Handler for a stream of server-sent events describing a job.
+
+    A 'status' event is sent whenever the progress or state of the job
+    changes, and an 'epoch' event with the training metrics at the end of
+    each epoch.  The stream ends once the job has finished."""
+    if status_board.get(job_id) is None and not _database_status(job_id):
         flask.abort(404)
-    else:
-        return json.dumps({
-            'status': status.status,
-            'finished': status.finished
+    environ = flask.request.environ
+
+    def stream():
+        version = -1
+        epochs_sent = 0
+        last_sent = time.time()
+        while True:
+            # No connection is held while waiting.
+            _release_session()
+            with rtrain.server_utils.http.waiting(environ):
+                entry = status_board.wait(job_id, version,
+                                          status_refresh_interval)
+            if entry is None:
+                return
+
+            if entry['version'] == version:
+                # Nothing has been published here, but the job may be
+                # running somewhere else.
+                _database_status(job_id)
+                if time.time() - last_sent >= event_keepalive_interval:
+                    yield ': keepalive\n\n'
+                    last_sent = time.time()
+                continue
+            version = entry['version']
+            last_sent = time.time()
+
+            for metrics in entry['epochs'][epochs_sent:]:
+                yield _server_sent_event('epoch', metrics)
+            epochs_sent = len(entry['epochs'])
+
+            yield _server_sent_event(
+                'status', {
+                    'status': entry['status'],
+                    'finished': entry['finished'],
+                    'state': entry['state']
+                },
+                event_id=version)
+            if entry['finished']:
+                return
+
+    return flask.Response(
+        flask.stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
         })
 
 
+def _accepts(mimetype):
+    """Determine whether the client explicitly accepts a content type."""
+    return any(value == mimetype and quality > 0
+               for value, quality in flask.request.accept_mimetypes)
+
+
 @rtraind_blueprint.route("/result/<job_id>", methods=['GET'])
 @requires_auth
 def request_result(job_id):
-    """Handler for job result downloads."""
-    result = _database_operations.get_results(job_id, Session())
-    if result is None:
-        flask.abort(404)
-    else:
+    """Handler for job result downloads.
+
+    Trained models are sent in the binary format to clients that accept
+    it, with support for range requests so that interrupted downloads can
+    be resumed.  Other clients receive the JSON format."""
+    session = Session()
+    result = _database_operations.get_results(job_id, session)
+    if result is not None:
         return result
 
+    path = _database_operations.get_result_path(job_id, session)
+    if path is None or not os.path.exists(path):
+        flask.abort(404)
+    _database_operations.record_access([job_id], session)
+
+    if _accepts(rtrain.wire_format.MODEL_CONTENT_TYPE):
+        # Each coding is stored alongside the result once it is first
+        # requested, so that ranges refer to the same bytes every time.
+        encoding = flask.request.accept_encodings.best_match(
+            rtrain.compression.supported())
+        if encoding is not None:
+            path = rtrain.server_utils.storage.compressed_file(
+                path, encoding)
+        response = flask.send_file(
+            path,
+            mimetype=rtrain.wire_format.MODEL_CONTENT_TYPE,
+            conditional=True,
+            etag=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    return flask.Response(
+        model_container_to_json(rtrain.server_utils.storage.map_file(path)),
+        mimetype='application/json')
+
+
+@rtraind_blueprint.route("/profile/<job_id>")
+@requires_auth
+def request_profile(job_id):
+    """Handler for downloads of the profile recorded while training a job.
 
-def main():
-    global password
+    Profiles are recorded only for jobs that ask for one."""
+    path = _database_operations.get_profile_path(job_id, Session())
+    if path is None or not os.path.exists(path):
+        flask.abort(404)
+    return flask.send_file(
+        path,
+        mimetype='application/octet-stream',
+        as_attachment=True,
+        download_name=os.path.basename(path),
+        conditional=True)
+
+
+def read_config(path):
+    """Read the configuration file, using the defaults if there is none."""
+    log = logger.new()
+    try:
+        with open(path) as config_fh:
+            return rtrain.server_utils.config.RTrainConfig(config_fh.read())
+    except FileNotFoundError:
+        log.warn('startup::config_file::file_not_found', config_file=path)
+        return rtrain.server_utils.config.RTrainConfig('')
+    except IOError:
+        log.fatal("startup::config_file::read_failed", config_file=path)
+        sys.exit(1)
+
+
+def make_app(config_path=None):
+    """Create the rtraind application, to be served by a WSGI server.
+
+    The application only handles requests; trainers are run by rtraind,
+    which may be told not to serve HTTP itself.  The configuration is read
+    from config_path, from the file named by the RTRAIND_CONFIG environment
+    variable, or from the default location, in that order.  The versions
+    of job statuses and the metrics are kept in memory, so the application
+    must be served by a single process, with as many threads as needed:
+
+        gunicorn --workers 1 --threads 64 'rtrain.server:make_app()'
+    """
+    if config_path is None:
+        config_path = os.environ.get('RTRAIND_CONFIG', default_config_path)
+    config = read_config(config_path)
+    prepare_database(config)
+    app = create_app(config, rtrain.server_utils.notify.make_notifier(config))
+    threading.Thread(target=status_pruner, daemon=True).start()
+    return app
 
+
+def http_server(config, app, sock=None):
+    """Create an HTTP server for the application, as configured."""
+    return rtrain.server_utils.http.Server(
+        config.bind,
+        config.port,
+        app,
+        config.http_threads,
+        config.http_timeout,
+        sock,
+        waiters=config.http_waiters)
+
+
+def serve(config, app, sock):
+    """Serve the application over HTTP on the listening socket sock, forever."""
+    logger.new().info(
+        'startup::http::listening',
+        bind=config.bind,
+        port=config.port,
+        threads=config.http_threads)
+    http_server(config, app, sock).serve_forever()
+
+
+def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-c',
         '--config',
-        default='/etc/rtraind.conf',
+        default=default_config_path,
         help='Path to configuration file.')
     args = parser.parse_args()
 
     log = logger.new()
-
-    try:
-        with open(args.config) as config_fh:
-            config = rtrain.server_utils.config.RTrainConfig(config_fh.read())
-    except FileNotFoundError:
-        log.warn(
-            'startup::config_file::file_not_found', config_file=args.config)
-        config = rtrain.server_utils.config.RTrainConfig('')
-    except IOError:
-        log.fatal("startup::config_file::read_failed", config_file=args.config)
+    config = read_config(args.config)
+    if not config.workers and not config.http_workers:
+        log.fatal('startup::nothing_to_run')
         sys.exit(1)
+    if config.http_workers > 1:
+        # Processes cannot compare the versions of their job statuses, and
+        # each would count its own metrics.
+        log.fatal(
+            'startup::http::too_many_workers', workers=config.http_workers)
+        sys.exit(1)
+
+    # Fail before starting anything else if the port is taken.
+    if config.http_workers:
+        sock = rtrain.server_utils.http.listen(config.bind, config.port)
 
     prepare_database(config)
+    local_notifier = rtrain.server_utils.notify.LocalNotifier(
+        multiprocessing.get_context('spawn'))
+    app = create_app(
+        config,
+        rtrain.server_utils.notify.make_notifier(config, local_notifier))
 
-    worker_thread = threading.Thread(target=trainer)
-    worker_thread.start()
+    start_trainers(config, local_notifier)
 
-    cleaner_thread = threading.Thread(target=cleaner)
+    cleaner_thread = threading.Thread(target=cleaner, args=(config, ))
     cleaner_thread.start()
 
-    app = create_app(config)
-    app.run()
+    writer_thread = threading.Thread(
+        target=status_writer, args=(config.status_flush_interval, ))
+    writer_thread.start()
+
+    if config.http_workers:
+        serve(config, app, sock)
 
 
 if __name__ == '__main__':
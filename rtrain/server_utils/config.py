@@ -2,6 +2,8 @@
 """Configuration parser for rtraind."""
 
 import configparser
+import os
+import tempfile
 
 
 class RTrainConfig(object):
@@ -18,3 +20,127 @@ class RTrainConfig(object):
     @property
     def password(self):
         return self.config['rtraind'].get('Password', '')
+
+    @property
+    def data_directory(self):
+        return self.config['rtraind'].get(
+            'DataDirectory', os.path.join(tempfile.gettempdir(), 'rtraind'))
+
+    @property
+    def spool_directory(self):
+        return os.path.join(self.data_directory, 'spool')
+
+    @property
+    def result_directory(self):
+        return os.path.join(self.data_directory, 'results')
+
+    @property
+    def dataset_directory(self):
+        return os.path.join(self.data_directory, 'datasets')
+
+    @property
+    def dataset_cache_bytes(self):
+        return self.config['rtraind'].getint('DatasetCacheBytes', 10 << 30)
+
+    @property
+    def model_cache_bytes(self):
+        """The most bytes of compiled models each trainer keeps for reuse."""
+        return self.config['rtraind'].getint('ModelCacheBytes', 256 << 20)
+
+    @property
+    def bind(self):
+        """The address on which to listen for HTTP requests."""
+        return self.config['rtraind'].get('Bind', '127.0.0.1')
+
+    @property
+    def port(self):
+        """The port on which to listen for HTTP requests."""
+        return self.config['rtraind'].getint('Port', 5000)
+
+    @property
+    def http_workers(self):
+        """Whether to serve HTTP: one server process, or zero to serve none."""
+        return self.config['rtraind'].getint('HttpWorkers', 1)
+
+    @property
+    def http_threads(self):
+        """The most requests the HTTP server handles at once."""
+        return self.config['rtraind'].getint('HttpThreads', 64)
+
+    @property
+    def http_waiters(self):
+        """The most long polls and event streams that may wait at once,
+        in addition to the requests being handled."""
+        return self.config['rtraind'].getint('HttpWaiters', 256)
+
+    @property
+    def http_timeout(self):
+        """Seconds after which a stalled HTTP connection is closed."""
+        return self.config['rtraind'].getfloat('HttpTimeout', 60)
+
+    @property
+    def max_request_bytes(self):
+        """The largest request body accepted, or None for no limit."""
+        return self.config['rtraind'].getint('MaxRequestBytes', None)
+
+    @property
+    def workers(self):
+        return self.config['rtraind'].getint('Workers', 1)
+
+    @property
+    def worker_max_jobs(self):
+        """Jobs after which a trainer is replaced, or None for no limit."""
+        return self.config['rtraind'].getint('WorkerMaxJobs', None)
+
+    @property
+    def worker_max_memory(self):
+        """Resident bytes beyond which a trainer is replaced, if any."""
+        return self.config['rtraind'].getint('WorkerMaxMemory', None)
+
+    @property
+    def claim_timeout(self):
+        """Seconds after which a running job whose worker has not reported
+        that it is alive is requeued."""
+        return self.config['rtraind'].getint('ClaimTimeout', 600)
+
+    @property
+    def max_attempts(self):
+        """Claims after which a job whose worker dies fails instead of being
+        requeued."""
+        return self.config['rtraind'].getint('MaxAttempts', 3)
+
+    @property
+    def idle_poll_interval(self):
+        """Seconds between database polls by an idle trainer."""
+        return self.config['rtraind'].getfloat('IdlePollInterval', 30)
+
+    @property
+    def status_flush_interval(self):
+        """Seconds between writes of job progress to the database."""
+        return self.config['rtraind'].getfloat('StatusFlushInterval', 2)
+
+    @property
+    def result_retention(self):
+        """Seconds for which finished jobs and their results are kept."""
+        return self.config['rtraind'].getint('ResultRetention', 3600)
+
+    @property
+    def max_jobs(self):
+        """The most finished jobs to keep, or None for no limit."""
+        return self.config['rtraind'].getint('MaxJobs', None)
+
+    @property
+    def max_result_bytes(self):
+        """The most bytes of results to keep, or None for no limit."""
+        return self.config['rtraind'].getint('MaxResultBytes', None)
+
+    @property
+    def unfinished_job_retention(self):
+        """Seconds after which a job that makes no progress is abandoned."""
+        return self.config['rtraind'].getint('UnfinishedJobRetention',
+                                             7 * 24 * 3600)
+
+    @property
+    def deduplicate_jobs(self):
+        """Whether a job identical to a recent one reuses its result."""
+        return self.config['rtraind'].getboolean('DeduplicateJobs', True)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""The HTTP server used by rtraind to serve its application.
+
+Each connection is served by a thread of its own, but only a fixed number
+of requests do work at once, so that slow uploads and long polls do not
+hold up other clients.  Requests that only wait for something to happen,
+such as long polls and event streams, are counted separately."""
+
+import contextlib
+import socket
+import threading
+
+import werkzeug.serving
+
+# The key in the WSGI environment of the function with which a request
+# tells the server that it is waiting.
+WAITING_KEY = 'rtrain.waiting'
+
+# The response sent to connections beyond the server's limits.
+_unavailable_response = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                         b'Retry-After: 1\r\n'
+                         b'Content-Length: 0\r\n'
+                         b'Connection: close\r\n\r\n')
+
+
+class _RequestHandler(werkzeug.serving.WSGIRequestHandler):
+    # Allow chunked responses, such as event streams.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Clients that stop sending or receiving are disconnected.
+        self.timeout = self.server.connection_timeout
+        super().setup()
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[WAITING_KEY] = self.server.waiting
+        return environ
+
+
+class Server(werkzeug.serving.BaseWSGIServer):
+    """A WSGI server that handles each connection in a thread of its own.
+
+    The server listens on host and port, or on the already listening
+    socket sock if given.  At most threads requests are handled at once,
+    the rest waiting their turn, except that up to waiters requests may
+    also wait for events without being counted, as long as they do so
+    within waiting().  Connections beyond these are refused with a 503
+    response.  Connections on which nothing can be sent or received for
+    timeout seconds are closed."""
+
+    multithread = True
+
+    def __init__(self,
+                 host,
+                 port,
+                 app,
+                 threads,
+                 timeout,
+                 sock=None,
+                 waiters=0):
+        super().__init__(
+            host,
+            port,
+            app,
+            handler=_RequestHandler,
+            fd=sock.fileno() if sock is not None else None)
+        self.connection_timeout = timeout
+        self._connections = threading.BoundedSemaphore(threads + waiters)
+        self._working = threading.BoundedSemaphore(threads)
+        self._waiting = threading.BoundedSemaphore(waiters) \
+            if waiters else None
+
+    def process_request(self, request, client_address):
+        if not self._connections.acquire(blocking=False):
+            self._refuse(request)
+            return
+        threading.Thread(
+            target=self._handle_request,
+            args=(request, client_address),
+            name='rtraind-http',
+            daemon=True).start()
+
+    def _refuse(self, request):
+        try:
+            request.settimeout(self.connection_timeout)
+            request.sendall(_unavailable_response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _handle_request(self, request, client_address):
+        try:
+            with self._working:
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+        finally:
+            self._connections.release()
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """Let other requests work while this one waits.
+
+        If too many requests are waiting already, this one carries on
+        counting as working."""
+        if self._waiting is None or not self._waiting.acquire(blocking=False):
+            yield
+            return
+        self._working.release()
+        try:
+            yield
+        finally:
+            self._working.acquire()
+            self._waiting.release()
+
+
+def listen(host, port):
+    """Open a listening socket, to be served by a Server."""
+    family = werkzeug.serving.select_address_family(host, port)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(werkzeug.serving.get_sockaddr(host, port, family))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def waiting(environ):
+    """Get a context in which a request waits without counting as working.
+
+    Outside of a Server, this does nothing."""
+    return environ.get(WAITING_KEY, contextlib.nullcontext)()
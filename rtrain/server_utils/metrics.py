@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Prometheus-style metrics for rtraind.
+
+Counters, gauges and histograms are kept in a Registry, which renders
+them in the Prometheus text exposition format.  Trainer processes forward
+their observations to the main process through a queue, so that a single
+/metrics endpoint covers every worker."""
+
+import contextlib
+import math
+import threading
+import time
+
+import structlog
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300, 900, 3600)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in zip(names, values))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric %s takes labels %s, not %s.' %
+                             (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _record(self, value, labels):
+        self.registry.record(self.name, value, self._key(labels))
+
+    def snapshot(self):
+        """Copy the samples of the metric, with the registry locked."""
+        return list(self._samples())
+
+    def render(self, samples):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace(
+                '\\', r'\\').replace('\n', r'\n')),
+            '# TYPE %s %s' % (self.name, self.kind)
+        ]
+        for suffix, names, values, value in samples:
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        _format_labels(names, values),
+                                        _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only increases, such as a number of requests."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters cannot be decreased.')
+        self._record(amount, labels)
+
+    def _apply(self, value, key):
+        self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield '_total', self.labelnames, key, value
+
+
+class Gauge(_Metric):
+    """A value that may go up or down, such as the length of a queue.
+
+    If a function is given, it is called whenever the metrics are rendered,
+    without the registry locked, and returns either the value or a
+    dictionary mapping tuples of label values to values."""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, labelnames,
+                 function=None):
+        super().__init__(registry, name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        self._record(value, labels)
+
+    def _apply(self, value, key):
+        self._values[key] = value
+
+    def snapshot(self):
+        if self.function is not None:
+            return None
+        return super().snapshot()
+
+    def evaluate(self):
+        """Call the function of the gauge, returning its samples."""
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return list(self._samples(values))
+
+    def _samples(self, values=None):
+        if values is None:
+            values = self._values
+        for key, value in sorted(values.items()):
+            yield '', self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """The distribution of a quantity, such as request latency."""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf, )
+
+    def observe(self, value, **labels):
+        self._record(value, labels)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the time taken to run the body of a with statement."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _apply(self, value, key):
+        counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        bucket_names = self.labelnames + ('le', )
+        for key, (counts, total) in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', bucket_names, key + (
+                    _format_value(bound), ), count
+            yield '_sum', self.labelnames, key, total
+            yield '_count', self.labelnames, key, counts[-1]
+
+
+class Registry(object):
+    """A collection of metrics.
+
+    Observations are recorded in the registry unless it has been told to
+    forward them to a queue, which relay() reads in another process."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('Metric %s already exists.' % metric.name)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._add(
+            Gauge(self, name, documentation, labelnames, function))
+
+    def histogram(self,
+                  name,
+                  documentation,
+                  labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._add(
+            Histogram(self, name, documentation, labelnames, buckets))
+
+    def forward(self, queue):
+        """Send future observations to a queue instead of recording them."""
+        self._queue = queue
+
+    def record(self, name, value, key):
+        """Record an observation of a metric for a tuple of label values."""
+        if self._queue is not None:
+            self._queue.put((name, value, key))
+            return
+        with self._lock:
+            self._metrics[name]._apply(value, key)
+
+    def render(self):
+        """Render every metric in the Prometheus text format.
+
+        Metrics whose values are computed when rendered are computed after
+        the others have been copied, so that observations are not held up
+        meanwhile.  If computing one fails, it is left out."""
+        with self._lock:
+            snapshots = [(metric, metric.snapshot())
+                         for metric in self._metrics.values()]
+        lines = []
+        for metric, samples in snapshots:
+            if samples is None:
+                try:
+                    samples = metric.evaluate()
+                except Exception:
+                    structlog.get_logger().exception(
+                        'metrics::gauge::failed', metric=metric.name)
+                    continue
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
+
+
+def relay(queue, registry):
+    """Record observations forwarded from other processes, forever."""
+    while True:
+        name, value, key = queue.get()
+        registry.record(name, value, tuple(key))
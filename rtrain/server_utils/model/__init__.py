@@ -6,6 +6,12 @@ import sqlalchemy.orm as orm
 
 Base = sqlalchemy.ext.declarative.declarative_base()
 
+# Values of Job.state.
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
 
 class Job(Base):
     """Represent a job in the database."""
@@ -17,6 +23,17 @@ class Job(Base):
     status = sa.Column(sa.REAL)
     finished = sa.Column(sa.INTEGER)
     job_type = sa.Column(sa.VARCHAR(16))
+    state = sa.Column(sa.VARCHAR(16), default=JOB_QUEUED, index=True)
+    claimed_by = sa.Column(sa.VARCHAR(255))
+    claim_time = sa.Column(sa.TIMESTAMP)
+    # How many times the job has been claimed, and when the worker running
+    # it last reported that it was alive.
+    attempts = sa.Column(sa.INTEGER, default=0)
+    heartbeat_time = sa.Column(sa.TIMESTAMP)
+    # When the job's result was last fetched or reused, if ever.
+    access_time = sa.Column(sa.TIMESTAMP)
+    # How long each phase of training took, as JSON.
+    timings = sa.Column(sa.TEXT)
     training_jobs = orm.relationship(
         'TrainingJob',
         cascade='all,delete,delete-orphan',
@@ -25,6 +42,10 @@ class Job(Base):
         'TrainingResult',
         cascade='all,delete,delete-orphan',
         passive_deletes=True)
+    dataset_references = orm.relationship(
+        'DatasetReference',
+        cascade='all,delete,delete-orphan',
+        passive_deletes=True)
 
 
 class TrainingJob(Base):
@@ -37,8 +58,27 @@ class TrainingJob(Base):
         sa.CHAR(32), sa.ForeignKey('Jobs.id', ondelete='CASCADE'))
     job = orm.relationship('Job', back_populates='training_jobs')
 
+    # Jobs are either stored in the database or spooled to a file.
     training_job = sa.Column(sa.LargeBinary)
-    job_checksum = sa.Column(sa.CHAR(64))
+    training_job_path = sa.Column(sa.VARCHAR(4096))
+    job_checksum = sa.Column(sa.CHAR(64), index=True)
+
+    # Jobs submitted together share a file, each being identified by its
+    # position in the batch.
+    training_job_index = sa.Column(sa.INT)
+
+
+class DatasetReference(Base):
+    """Represent a stored dataset to which a job refers."""
+    __tablename__ = 'DatasetReferences'
+
+    id = sa.Column(sa.INT, primary_key=True)
+
+    job_id = sa.Column(
+        sa.CHAR(32), sa.ForeignKey('Jobs.id', ondelete='CASCADE'), index=True)
+    job = orm.relationship('Job', back_populates='dataset_references')
+
+    digest = sa.Column(sa.CHAR(64))
 
 
 class TrainingResult(Base):
@@ -51,5 +91,10 @@ class TrainingResult(Base):
         sa.CHAR(32), sa.ForeignKey('Jobs.id', ondelete='CASCADE'))
     job = orm.relationship('Job', back_populates='training_results')
 
+    # Results are either stored in the database or written to a file.
     result_type = sa.Column(sa.VARCHAR(16))
     result = sa.Column(sa.LargeBinary)
+    result_path = sa.Column(sa.VARCHAR(4096))
+    result_size = sa.Column(sa.BIGINT)
+    # A profile of the training, if the job asked for one.
+    profile_path = sa.Column(sa.VARCHAR(4096))
@@ -10,6 +10,14 @@ import sqlalchemy
 
 import rtrain.server_utils.model as model
 
+# Dialects on which a worker can claim a job with SELECT ... FOR UPDATE
+# SKIP LOCKED; elsewhere we fall back to a conditional UPDATE.
+_skip_locked_dialects = ('postgresql', 'oracle')
+
+# Old jobs are deleted this many at a time, each batch in its own
+# transaction, so that the database is never locked for long.
+_purge_batch_size = 500
+
 
 def _create_job_id():
     """Create a new job ID."""
@@ -18,18 +26,29 @@ def _create_job_id():
 
 
 def create_new_job(training_request, session):
-    """Insert a new job into the database."""
+    """Insert a new job into the database.
+
+    The request is stored verbatim if it is already encoded as bytes, and
+    as JSON otherwise."""
     job_id = _create_job_id()
 
-    training_data = json.dumps(training_request)
+    if isinstance(training_request, bytes):
+        training_data = training_request
+    else:
+        training_data = json.dumps(training_request).encode('utf8')
 
     digest = hashlib.sha256()
-    digest.update(training_data.encode())
+    digest.update(training_data)
 
-    new_job = model.Job(id=job_id, status=0, finished=0, job_type='train')
+    new_job = model.Job(
+        id=job_id,
+        status=0,
+        finished=0,
+        job_type='train',
+        state=model.JOB_QUEUED)
     new_training = model.TrainingJob(
         job_id=job_id,
-        training_job=training_data.encode('utf8'),
+        training_job=training_data,
         job_checksum=str(base64.b16encode(digest.digest()), 'ascii'))
     session.add(new_job)
     session.add(new_training)
@@ -38,26 +57,348 @@ def create_new_job(training_request, session):
     return job_id
 
 
+def _add_dataset_references(job_id, digests, session):
+    """Record the stored datasets to which a job refers."""
+    for digest in digests:
+        session.add(model.DatasetReference(job_id=job_id, digest=digest))
+
+
+def create_spooled_job(path, checksum, session, datasets=()):
+    """Insert a new job into the database whose request is stored in a file.
+
+    The checksum must be the hexadecimal SHA-256 digest of the file, and
+    datasets lists the digests of the stored datasets to which the job
+    refers."""
+    job_id = _create_job_id()
+
+    new_job = model.Job(
+        id=job_id,
+        status=0,
+        finished=0,
+        job_type='train',
+        state=model.JOB_QUEUED)
+    new_training = model.TrainingJob(
+        job_id=job_id, training_job_path=path, job_checksum=checksum)
+    session.add(new_job)
+    session.add(new_training)
+    _add_dataset_references(job_id, datasets, session)
+    session.commit()
+
+    return job_id
+
+
+def batch_checksums(checksum, count):
+    """Derive the checksums of the jobs in a batch from that of its file.
+
+    Each is the digest of '<batch checksum>:<index>'."""
+    return [
+        hashlib.sha256(('%s:%d' % (checksum, index)).encode('ascii'))
+        .hexdigest().upper() for index in range(count)
+    ]
+
+
+def create_spooled_batch(path,
+                         checksum,
+                         count,
+                         session,
+                         indices=None,
+                         datasets=None,
+                         paths=None):
+    """Insert a batch of new jobs whose requests are stored in one file.
+
+    Each job's checksum is derived from that of the file and its position
+    in the batch.  If indices is given, only the jobs at those positions
+    are created.  If datasets is given, it lists for each position the
+    digests of the stored datasets to which that job refers.  If paths is
+    given, it lists for each position a file holding that job alone, which
+    is stored in place of the batch file.  Returns the IDs of the new jobs,
+    in order."""
+    job_checksums = batch_checksums(checksum, count)
+    if indices is None:
+        indices = range(count)
+    job_ids = []
+    for index in indices:
+        job_id = _create_job_id()
+        job_checksum = job_checksums[index]
+        session.add(
+            model.Job(
+                id=job_id,
+                status=0,
+                finished=0,
+                job_type='train',
+                state=model.JOB_QUEUED))
+        if paths is not None:
+            training_job = model.TrainingJob(
+                job_id=job_id,
+                training_job_path=paths[index],
+                job_checksum=job_checksum)
+        else:
+            training_job = model.TrainingJob(
+                job_id=job_id,
+                training_job_path=path,
+                training_job_index=index,
+                job_checksum=job_checksum)
+        session.add(training_job)
+        if datasets is not None:
+            _add_dataset_references(job_id, datasets[index], session)
+        job_ids.append(job_id)
+    session.commit()
+
+    return job_ids
+
+
+def datasets_in_use(session):
+    """List the digests of the stored datasets to which unfinished jobs
+    refer."""
+    digests = [
+        digest for digest, in session.query(model.DatasetReference.digest)
+        .join(model.Job, model.Job.id == model.DatasetReference.job_id)
+        .filter(model.Job.finished == 0).distinct()
+    ]
+    session.commit()
+    return digests
+
+
+def find_jobs(checksums, max_age, session):
+    """Find recent jobs with the given checksums.
+
+    Only jobs created in the last max_age seconds are considered.  Returns
+    a dictionary mapping each checksum found to the ID of the most recent
+    job with that checksum."""
+    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=max_age)
+    found = {}
+    for checksum, job_id in session.query(
+            model.TrainingJob.job_checksum, model.Job.id).join(
+                model.Job, model.Job.id == model.TrainingJob.job_id).filter(
+                    model.TrainingJob.job_checksum.in_(checksums),
+                    model.Job.creation_time >= cutoff_time).order_by(
+                        model.Job.creation_time):
+        found[checksum] = job_id
+    return found
+
+
+def find_duplicate_jobs(checksums, max_age, session):
+    """Find jobs that would produce the same result as new ones.
+
+    A job is a duplicate if it has the same checksum and is queued,
+    running, or finished successfully and used in the last max_age seconds.
+    Returns a dictionary mapping each checksum found to the ID of the most
+    recent such job."""
+    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=max_age)
+    found = {}
+    for checksum, job_id in session.query(
+            model.TrainingJob.job_checksum, model.Job.id).join(
+                model.Job, model.Job.id == model.TrainingJob.job_id).filter(
+                    model.TrainingJob.job_checksum.in_(checksums),
+                    model.Job.state != model.JOB_FAILED,
+                    sqlalchemy.or_(model.Job.finished == 0,
+                                   _last_used() >= cutoff_time)
+                ).order_by(model.Job.creation_time):
+        found[checksum] = job_id
+    return found
+
+
+def count_jobs_by_state(session):
+    """Count the jobs in each state, returning a dictionary."""
+    counts = dict(
+        session.query(model.Job.state, sqlalchemy.func.count(
+            model.Job.id)).group_by(model.Job.state))
+    session.commit()
+    return counts
+
+
 def get_next_job(session):
-    """Get the next unfinished job from the database."""
+    """Get the next queued job from the database."""
     return session.query(model.Job).filter_by(
-        finished=0).order_by(model.Job.creation_time).first()
+        state=model.JOB_QUEUED).order_by(model.Job.creation_time).first()
+
+
+def claim_next_job(worker_name, session):
+    """Claim the next queued job for a worker, marking it as running.
+
+    No two workers, even on different hosts, can claim the same job.
+    Returns None if there are no jobs waiting."""
+    if session.get_bind().dialect.name in _skip_locked_dialects:
+        return _claim_next_job_skip_locked(worker_name, session)
+
+    while True:
+        job = get_next_job(session)
+        if job is None:
+            session.commit()
+            return None
+
+        # Only one worker's UPDATE can match while the job is still queued.
+        now = datetime.datetime.utcnow()
+        claimed = session.query(model.Job).filter_by(
+            id=job.id, state=model.JOB_QUEUED).update(
+                {
+                    'state': model.JOB_RUNNING,
+                    'claimed_by': worker_name,
+                    'claim_time': now,
+                    'heartbeat_time': now,
+                    'modification_time': now,
+                    'attempts': sqlalchemy.func.coalesce(
+                        model.Job.attempts, 0) + 1
+                },
+                synchronize_session=False)
+        session.commit()
+        if claimed:
+            session.refresh(job)
+            return job
+
+
+def _claim_next_job_skip_locked(worker_name, session):
+    """Claim a job using SELECT ... FOR UPDATE SKIP LOCKED.
+
+    Jobs being claimed by other workers are skipped rather than waited on,
+    so workers never contend for the same row."""
+    job = session.query(model.Job).filter_by(
+        state=model.JOB_QUEUED).order_by(
+            model.Job.creation_time).with_for_update(skip_locked=True).first()
+    if job is None:
+        session.commit()
+        return None
+
+    job.state = model.JOB_RUNNING
+    job.claimed_by = worker_name
+    job.claim_time = job.heartbeat_time = job.modification_time = \
+        datetime.datetime.utcnow()
+    job.attempts = (job.attempts or 0) + 1
+    session.commit()
+    return job
+
+
+def heartbeat(job_id, worker_name, session):
+    """Record that a worker running a job is still alive.
+
+    Returns False if the job is no longer claimed by the worker."""
+    alive = session.query(model.Job).filter_by(
+        id=job_id, state=model.JOB_RUNNING, claimed_by=worker_name).update(
+            {
+                'heartbeat_time': datetime.datetime.utcnow()
+            },
+            synchronize_session=False)
+    session.commit()
+    return bool(alive)
+
+
+def requeue_stale_jobs(cutoff_time, session, max_attempts=None):
+    """Return running jobs whose workers have not been heard from since
+    cutoff_time to the queue.
+
+    This recovers jobs whose workers have died.  A job that has already
+    been claimed max_attempts times is taken to be killing its workers,
+    and fails instead.  Returns the numbers of jobs requeued and failed."""
+    stale = session.query(model.Job).filter(
+        model.Job.state == model.JOB_RUNNING,
+        sqlalchemy.func.coalesce(model.Job.heartbeat_time,
+                                 model.Job.modification_time) < cutoff_time)
+
+    failed = 0
+    if max_attempts is not None:
+        exhausted = stale.filter(
+            sqlalchemy.func.coalesce(model.Job.attempts, 0) >= max_attempts)
+        for job_id, attempts in exhausted.with_entities(
+                model.Job.id, model.Job.attempts).all():
+            failed += _fail_abandoned_job(job_id, attempts, cutoff_time,
+                                          session)
+
+    requeued = stale.update(
+        {
+            'state': model.JOB_QUEUED,
+            'claimed_by': None,
+            'claim_time': None
+        },
+        synchronize_session=False)
+    session.commit()
+    return requeued, failed
+
+
+def _fail_abandoned_job(job_id, attempts, cutoff_time, session):
+    """Fail a job whose worker has died, unless it has since recovered.
+
+    Returns 1 if the job was failed, or 0 otherwise."""
+    failed = session.query(model.Job).filter(
+        model.Job.id == job_id, model.Job.state == model.JOB_RUNNING,
+        sqlalchemy.func.coalesce(model.Job.heartbeat_time,
+                                 model.Job.modification_time) <
+        cutoff_time).update(
+            {
+                'state': model.JOB_FAILED,
+                'finished': 1,
+                'status': -1,
+                'claimed_by': None,
+                'modification_time': datetime.datetime.utcnow()
+            },
+            synchronize_session=False)
+    if failed:
+        session.add(
+            model.TrainingResult(
+                job_id=job_id,
+                result_type='error',
+                result=('The job was abandoned after its worker stopped '
+                        'responding on each of %d attempts.\n' %
+                        attempts).encode('utf8')))
+    session.commit()
+    return failed
 
 
 def get_status(job_id, session):
     """Get the status of a particular job from the database."""
-    return session.query(model.Job.finished, model.Job.status).filter_by(
-        id=job_id).first()
+    return session.query(model.Job.finished, model.Job.status,
+                         model.Job.state, model.Job.timings).filter_by(
+                             id=job_id).first()
+
+
+def get_statuses(job_ids, session):
+    """Get the status of several jobs from the database in one query.
+
+    Returns a dictionary mapping the IDs of the jobs that exist to their
+    status, as returned by get_status()."""
+    return {
+        row.id: row
+        for row in session.query(
+            model.Job.id, model.Job.finished, model.Job.status,
+            model.Job.state, model.Job.timings).filter(
+                model.Job.id.in_(job_ids))
+    }
 
 
 def get_results(job_id, session):
-    """Get the results of a training job from the database."""
+    """Get the results of a training job from the database.
+
+    Returns None if the job has no results, or they are stored in a file."""
     job = session.query(model.Job).filter_by(id=job_id).first()
-    if not job.training_results:
+    if job is None or not job.training_results or \
+            job.training_results[0].result is None:
         return None
     return str(job.training_results[0].result, 'utf8')
 
 
+def get_result_path(job_id, session):
+    """Get the path to the file holding the results of a training job.
+
+    Returns None if there is no such file."""
+    result = session.query(model.TrainingResult.result_path).filter_by(
+        job_id=job_id).first()
+    if result is None:
+        return None
+    return result.result_path
+
+
+def get_profile_path(job_id, session):
+    """Get the path to the file holding the profile of a training job.
+
+    Returns None if there is no such file."""
+    result = session.query(model.TrainingResult.profile_path).filter_by(
+        job_id=job_id).first()
+    if result is None:
+        return None
+    return result.profile_path
+
+
 def update_status(job_id, percentage, session):
     """Update the status of a job in the database."""
     job = session.query(model.Job).filter_by(id=job_id).first()
@@ -66,21 +407,255 @@ def update_status(job_id, percentage, session):
     session.commit()
 
 
-def finish_job(job_id, result, session):
-    """Mark a training job as finished in the database."""
-    job = session.query(model.Job).filter_by(id=job_id).first()
-    job.finished = 1
-    job.modification_time = datetime.datetime.utcnow()
+def update_statuses(statuses, session):
+    """Update the status of several unfinished jobs in one statement.
+
+    The statuses argument maps job IDs to percentages."""
+    now = datetime.datetime.utcnow()
+    jobs = model.Job.__table__
+    session.execute(
+        jobs.update().where(
+            sqlalchemy.and_(jobs.c.id == sqlalchemy.bindparam('job_id'),
+                            jobs.c.finished == 0)).values(
+                                status=sqlalchemy.bindparam('new_status'),
+                                modification_time=now),
+        [{
+            'job_id': job_id,
+            'new_status': status
+        } for job_id, status in statuses.items()])
+    session.commit()
+
+
+def finish_job(job_id,
+               result,
+               session,
+               failed=False,
+               result_path=None,
+               result_size=None,
+               timings=None,
+               profile_path=None,
+               worker_name=None):
+    """Mark a training job as finished in the database.
 
+    The result is either a string or, if result is None, a file at
+    result_path of result_size bytes.  If the job failed, the result should
+    describe the error.  The timings of the job's phases and the path to
+    its profile may also be recorded.  If worker_name is given, the job is
+    only finished if that worker still has it claimed.  Returns whether the
+    job was finished."""
+    values = {
+        'finished': 1,
+        'state': model.JOB_FAILED if failed else model.JOB_DONE,
+        'modification_time': datetime.datetime.utcnow()
+    }
+    if failed:
+        values['status'] = -1
+    if timings is not None:
+        values['timings'] = json.dumps(timings)
+    jobs = session.query(model.Job).filter_by(id=job_id)
+    if worker_name is not None:
+        jobs = jobs.filter_by(
+            state=model.JOB_RUNNING, claimed_by=worker_name)
+    if not jobs.update(values, synchronize_session=False):
+        session.rollback()
+        return False
+
+    if result is not None:
+        result = result.encode('utf8')
+        result_size = len(result)
     training_result = model.TrainingResult(
-        job_id=job.id, result=result.encode('utf8'))
+        job_id=job_id,
+        result_type='error' if failed else 'model',
+        result=result,
+        result_path=result_path,
+        result_size=result_size,
+        profile_path=profile_path)
     session.add(training_result)
     session.commit()
+    return True
 
 
-def purge_old_jobs(session):
-    """Purge jobs older than one minute from the database."""
-    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
-    session.query(model.Job).filter(model.Job.modification_time < cutoff_time,
-                                    model.Job.finished != 0).delete()
+def record_access(job_ids, session):
+    """Note that the results of some jobs have just been fetched or reused.
+
+    The least recently used jobs are the first to be purged."""
+    session.query(model.Job).filter(model.Job.id.in_(job_ids)).update(
+        {
+            'access_time': datetime.datetime.utcnow()
+        },
+        synchronize_session=False)
     session.commit()
+
+
+def _last_used():
+    """The time at which a job was last updated or its result used."""
+    return sqlalchemy.func.coalesce(model.Job.access_time,
+                                    model.Job.modification_time)
+
+
+def _least_recently_used(max_jobs, max_result_bytes, session):
+    """Choose the finished jobs to purge to stay within the given limits.
+
+    The most recently used jobs are kept while there are no more than
+    max_jobs of them and their results total no more than
+    max_result_bytes; either limit may be None."""
+    result_bytes = sqlalchemy.func.coalesce(
+        sqlalchemy.func.sum(model.TrainingResult.result_size), 0)
+    rows = session.query(model.Job.id, result_bytes).outerjoin(
+        model.TrainingResult,
+        model.TrainingResult.job_id == model.Job.id).filter(
+            model.Job.finished != 0).group_by(model.Job.id).order_by(
+                _last_used().desc(), model.Job.id)
+
+    purged = []
+    kept_bytes = 0
+    for kept_jobs, (job_id, size) in enumerate(rows):
+        kept_bytes += size
+        if purged or (max_jobs is not None and kept_jobs >= max_jobs) or (
+                max_result_bytes is not None and
+                kept_bytes > max_result_bytes):
+            purged.append(job_id)
+    session.commit()
+    return purged
+
+
+def _delete_jobs(job_ids, session):
+    """Delete some jobs, with their requests and results, in one transaction.
+
+    The rows belonging to each job are deleted explicitly, since not every
+    database enforces foreign keys.  Returns the paths of the spooled
+    requests and of the result files of the deleted jobs."""
+    training_jobs = session.query(model.TrainingJob).filter(
+        model.TrainingJob.job_id.in_(job_ids))
+    training_results = session.query(model.TrainingResult).filter(
+        model.TrainingResult.job_id.in_(job_ids))
+
+    request_paths = {
+        path
+        for path, in training_jobs.with_entities(
+            model.TrainingJob.training_job_path) if path is not None
+    }
+    result_paths = {
+        path
+        for paths in training_results.with_entities(
+            model.TrainingResult.result_path,
+            model.TrainingResult.profile_path) for path in paths
+        if path is not None
+    }
+    training_jobs.delete(synchronize_session=False)
+    training_results.delete(synchronize_session=False)
+    session.query(model.DatasetReference).filter(
+        model.DatasetReference.job_id.in_(job_ids)).delete(
+            synchronize_session=False)
+    session.query(model.Job).filter(model.Job.id.in_(job_ids)).delete(
+        synchronize_session=False)
+    session.commit()
+    return request_paths, result_paths
+
+
+def _delete_orphans(table, path_columns, batch_size, session):
+    """Delete the rows of a table that belong to no job.
+
+    Returns the paths held by the deleted rows."""
+    orphaned = session.query(table.id, *path_columns).filter(
+        sqlalchemy.or_(
+            table.job_id.is_(None),
+            table.job_id.notin_(
+                session.query(model.Job.id).scalar_subquery())))
+    paths = set()
+    while True:
+        rows = orphaned.limit(batch_size).all()
+        if not rows:
+            session.commit()
+            return paths
+        paths.update(
+            path for row in rows for path in row[1:] if path is not None)
+        session.query(table).filter(
+            table.id.in_([row[0] for row in rows])).delete(
+                synchronize_session=False)
+        session.commit()
+
+
+def _incremental_vacuum(session):
+    """Return the pages freed in an SQLite database to the filesystem.
+
+    This does nothing unless the database was created with
+    auto_vacuum=INCREMENTAL."""
+    # The pragma frees one page each time the statement is stepped, and
+    # only executescript() steps it to completion.
+    dbapi_connection = session.connection().connection.driver_connection
+    dbapi_connection.executescript('PRAGMA incremental_vacuum;')
+    session.commit()
+
+
+def purge_old_jobs(session,
+                   max_age=60,
+                   max_jobs=None,
+                   max_result_bytes=None,
+                   max_unfinished_age=None,
+                   batch_size=None):
+    """Purge old jobs from the database.
+
+    Finished jobs are purged once they have been neither updated nor used
+    for max_age seconds; beyond that, the least recently used are purged
+    while there are more than max_jobs of them or their results total more
+    than max_result_bytes.  Unfinished jobs not updated for
+    max_unfinished_age seconds are taken to be abandoned and purged too,
+    as are requests and results left without a job.  Jobs are deleted in
+    transactions of at most batch_size jobs.
+
+    Returns the paths of any spooled requests and result files belonging
+    to the purged jobs, which the caller should remove.  Requests shared
+    with jobs that remain are kept."""
+    if batch_size is None:
+        batch_size = _purge_batch_size
+    now = datetime.datetime.utcnow()
+
+    expired = session.query(model.Job.id).filter(
+        model.Job.finished != 0,
+        _last_used() < now - datetime.timedelta(seconds=max_age))
+    if max_unfinished_age is not None:
+        expired = expired.union(
+            session.query(model.Job.id).filter(
+                model.Job.finished == 0, model.Job.modification_time <
+                now - datetime.timedelta(seconds=max_unfinished_age)))
+    purged = [job_id for job_id, in expired]
+    session.commit()
+
+    request_paths = set()
+    result_paths = set()
+
+    def delete_jobs(job_ids):
+        for i in range(0, len(job_ids), batch_size):
+            batch_request_paths, batch_result_paths = _delete_jobs(
+                job_ids[i:i + batch_size], session)
+            request_paths.update(batch_request_paths)
+            result_paths.update(batch_result_paths)
+
+    delete_jobs(purged)
+    if max_jobs is not None or max_result_bytes is not None:
+        delete_jobs(
+            _least_recently_used(max_jobs, max_result_bytes, session))
+
+    request_paths.update(
+        _delete_orphans(model.TrainingJob,
+                        [model.TrainingJob.training_job_path], batch_size,
+                        session))
+    result_paths.update(
+        _delete_orphans(model.TrainingResult, [
+            model.TrainingResult.result_path,
+            model.TrainingResult.profile_path
+        ], batch_size, session))
+    _delete_orphans(model.DatasetReference, [], batch_size, session)
+
+    if request_paths:
+        request_paths -= {
+            path
+            for path, in session.query(model.TrainingJob.training_job_path)
+            .filter(model.TrainingJob.training_job_path.in_(request_paths))
+        }
+    session.commit()
+
+    if session.get_bind().dialect.name == 'sqlite':
+        _incremental_vacuum(session)
+    return sorted(request_paths) + sorted(result_paths)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""A cache of compiled models, shared by the jobs run by one trainer."""
+
+import collections
+import hashlib
+import json
+import threading
+
+
+def model_key(architecture, loss, optimizer):
+    """The key under which a model compiled for a job is cached.
+
+    Jobs with the same architecture, loss and optimizer may share a model,
+    whatever their weights, data or number of epochs."""
+    return hashlib.sha256(
+        json.dumps([architecture, loss, optimizer]).encode('utf8')).hexdigest()
+
+
+class ModelCache(object):
+    """A size-bounded, least-recently-used cache of compiled models.
+
+    A model is taken out of the cache while a job uses it, so that no two
+    jobs can share a model at once, and put back when the job has finished
+    with it.  Models are evicted, least recently used first, while the
+    total size of those in the cache exceeds max_bytes; a max_bytes of zero
+    disables the cache."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """The total size in bytes of the cached models."""
+        return self._bytes
+
+    def take(self, key):
+        """Remove a model from the cache, returning None if it is absent."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            model, size = entry
+            self._bytes -= size
+            return model
+
+    def put(self, key, model, size):
+        """Add a model of the given size in bytes to the cache.
+
+        Any model already cached under the same key is replaced.  Returns
+        False if the model is too large to cache at all."""
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (model, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return True
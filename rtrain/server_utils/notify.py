@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Notification of idle trainers when new jobs are submitted."""
+
+import multiprocessing
+import select
+import time
+
+import sqlalchemy
+
+
+class PollingNotifier(object):
+    """A notifier that notifies nobody; waiting trainers simply poll."""
+
+    def notify(self, count=1):
+        pass
+
+    def wait(self, timeout):
+        """Wait for a new job, returning True if one may be available."""
+        time.sleep(timeout)
+        return False
+
+
+class LocalNotifier(object):
+    """Notify trainers started by this rtraind process.
+
+    The notifier may be passed to worker processes when they are started.
+    Each notification wakes exactly one waiting trainer; notifications made
+    while all trainers are busy are remembered, so none are lost."""
+
+    def __init__(self, context=multiprocessing):
+        self._semaphore = context.Semaphore(0)
+
+    def notify(self, count=1):
+        """Announce count new jobs, waking up to that many trainers."""
+        for _ in range(count):
+            self._semaphore.release()
+
+    def wait(self, timeout):
+        """Wait for a new job, returning True if one may be available."""
+        return self._semaphore.acquire(timeout=timeout)
+
+
+class PostgresNotifier(object):
+    """Notify trainers on any host through PostgreSQL LISTEN/NOTIFY."""
+
+    channel = 'rtraind_jobs'
+
+    def __init__(self, db_string):
+        self.db_string = db_string
+        self._engine = None
+        self._listener = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = sqlalchemy.create_engine(self.db_string)
+        return self._engine
+
+    def notify(self, count=1):
+        # A single notification wakes every listening trainer.
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text('NOTIFY %s' % self.channel))
+
+    def _listen(self):
+        """Open a dedicated connection on which to receive notifications."""
+        connection = self.engine.raw_connection()
+        dbapi_connection = getattr(connection, 'dbapi_connection', None)
+        if dbapi_connection is None:
+            dbapi_connection = connection.connection
+        dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        cursor.execute('LISTEN %s' % self.channel)
+        cursor.close()
+        self._connection = connection
+        self._listener = dbapi_connection
+
+    def wait(self, timeout):
+        """Wait for a new job, returning True if one may be available."""
+        if self._listener is None:
+            self._listen()
+
+        if select.select([self._listener], [], [], timeout) == ([], [], []):
+            return False
+
+        self._listener.poll()
+        notified = bool(self._listener.notifies)
+        del self._listener.notifies[:]
+        return notified
+
+
+def make_notifier(config, local_notifier=None):
+    """Choose the best notifier for a configuration.
+
+    PostgreSQL databases accessed through psycopg2 use LISTEN/NOTIFY, which
+    reaches every rtraind process sharing the database.  Otherwise, the
+    local notifier is used if given, and trainers poll if not."""
+    url = sqlalchemy.engine.make_url(config.db_string)
+    if url.get_backend_name() == 'postgresql' and \
+            url.get_driver_name() == 'psycopg2':
+        return PostgresNotifier(config.db_string)
+    if local_notifier is not None:
+        return local_notifier
+    return PollingNotifier()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""In-memory job status shared between trainers and request handlers."""
+
+import threading
+import time
+
+
+def new_timings():
+    """Create a record of the time taken by each phase of a job."""
+    return {'phases': {}, 'samples_per_second': []}
+
+
+class StatusBoard(object):
+    """The latest known status of each job.
+
+    Each entry carries a version number that increases with every change,
+    so that request handlers can wait for a job's status to change rather
+    than repeatedly querying the database."""
+
+    def __init__(self):
+        self._entries = {}
+        self._condition = threading.Condition()
+        self._version = 0
+        self._dirty = {}
+
+    def _entry(self, job_id):
+        return self._entries.setdefault(job_id, {
+            'status': 0.0,
+            'finished': 0,
+            'state': None,
+            'epochs': [],
+            'timings': None,
+            'version': 0,
+            'updated': 0
+        })
+
+    def _changed(self, entry):
+        # Versions are unique across jobs, so that an entry that is
+        # pruned and then re-created cannot repeat an old version.
+        self._version += 1
+        entry['version'] = self._version
+        self._condition.notify_all()
+
+    def publish(self, job_id, epoch=None, **fields):
+        """Record a change to the status of a job.
+
+        The fields may include status, finished and state; an epoch, if
+        given, is a dictionary of metrics to append to the job's history.
+        Changes to the status are remembered until take_dirty() is called,
+        so that they can be written to the database."""
+        with self._condition:
+            entry = self._entry(job_id)
+            entry.update(fields)
+            if epoch is not None:
+                entry['epochs'] = entry['epochs'] + [epoch]
+            if 'status' in fields:
+                self._dirty[job_id] = fields['status']
+            entry['updated'] = time.time()
+            self._changed(entry)
+
+    def refresh(self, job_id, **fields):
+        """Update a job's status with values read from the database.
+
+        Unlike publish(), the version changes only if the values do, and
+        nothing is marked to be written back."""
+        with self._condition:
+            entry = self._entry(job_id)
+            if any(entry.get(k) != v for k, v in fields.items()):
+                entry.update(fields)
+                self._changed(entry)
+            entry['updated'] = time.time()
+
+    def take_dirty(self):
+        """Return, and forget, the statuses published since the last call.
+
+        The result maps job IDs to their latest status."""
+        with self._condition:
+            dirty = self._dirty
+            self._dirty = {}
+            return dirty
+
+    def get(self, job_id):
+        """Get a copy of a job's status, or None if it is not known."""
+        with self._condition:
+            entry = self._entries.get(job_id)
+            return dict(entry) if entry is not None else None
+
+    def wait(self, job_id, since, timeout):
+        """Wait until a job's version exceeds since, or until timeout.
+
+        Returns the job's status as for get()."""
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                entry = self._entries.get(job_id)
+                if entry is not None and entry['version'] > since:
+                    return dict(entry)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(entry) if entry is not None else None
+                self._condition.wait(remaining)
+
+    def wait_any(self, job_ids, since, timeout):
+        """Wait until the version of any of several jobs exceeds since.
+
+        Returns True if one did, or False if the timeout expired first."""
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                if any(entry['version'] > since
+                       for entry in (self._entries.get(job_id)
+                                     for job_id in job_ids)
+                       if entry is not None):
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+    def prune(self, max_age):
+        """Forget finished jobs not updated in the last max_age seconds."""
+        cutoff = time.time() - max_age
+        with self._condition:
+            for job_id in [
+                    job_id for job_id, entry in self._entries.items()
+                    if entry['finished'] and entry['updated'] < cutoff
+            ]:
+                del self._entries[job_id]
+
+
+def writer(board, write, interval):
+    """Periodically write published statuses to the database, forever.
+
+    All of the statuses published during each interval are passed to
+    write() together, only the latest being kept for each job."""
+    while True:
+        time.sleep(interval)
+        dirty = board.take_dirty()
+        if dirty:
+            write(dirty)
+
+
+class QueuePublisher(object):
+    """Publish status changes from a worker process through a queue.
+
+    The queue is read by relay() in the process holding the StatusBoard."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def publish(self, job_id, epoch=None, **fields):
+        self.queue.put((job_id, epoch, fields))
+
+
+def relay(queue, board):
+    """Copy status changes from a queue to a StatusBoard, forever."""
+    while True:
+        job_id, epoch, fields = queue.get()
+        board.publish(job_id, epoch=epoch, **fields)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""On-disk storage for rtraind."""
+
+import base64
+import collections
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+
+import numpy
+
+import rtrain.compression
+import rtrain.wire_format
+
+# Request bodies are copied to disk in pieces of this size.
+_CHUNK_SIZE = 1 << 20
+
+SpooledFile = collections.namedtuple('SpooledFile',
+                                     ['path', 'checksum', 'size'])
+
+
+def spool_stream(stream, directory, suffix='.job', chunk_size=_CHUNK_SIZE):
+    """Copy a stream into a new file in directory, hashing it on the way.
+
+    The checksum is the upper-case hexadecimal SHA-256 digest of the data,
+    as stored in TrainingJob.job_checksum."""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        remove_file(path)
+        raise
+
+    return SpooledFile(path, str(base64.b16encode(digest.digest()), 'ascii'),
+                       size)
+
+
+def write_file(path, chunks):
+    """Write a sequence of bytes-like chunks to a file atomically.
+
+    The file does not appear at path until it is complete."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temporary_path, path)
+    except BaseException:
+        remove_file(temporary_path)
+        raise
+
+
+def read_file(path, chunk_size=_CHUNK_SIZE):
+    """Read a file in pieces, yielding bytes objects."""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def compressed_path(path, encoding):
+    """Get the path of the compressed copy of a file."""
+    return '%s.%s' % (path, encoding)
+
+
+def compressed_file(path, encoding):
+    """Get the path of a compressed copy of a file, creating it if needed."""
+    target = compressed_path(path, encoding)
+    if not os.path.exists(target):
+        write_file(target,
+                   rtrain.compression.compress(read_file(path), encoding))
+    return target
+
+
+def map_file(path):
+    """Map a file into memory read-only, returning a bytes-like object.
+
+    The mapping is released once nothing refers to it any longer."""
+    if os.path.getsize(path) == 0:
+        return b''
+    return numpy.memmap(path, dtype=numpy.uint8, mode='r')
+
+
+def is_mapped(array):
+    """Determine whether an array refers to memory-mapped data."""
+    base = array
+    while base is not None:
+        if isinstance(base, (numpy.memmap, mmap.mmap)):
+            return True
+        if isinstance(base, memoryview):
+            base = base.obj
+        else:
+            base = getattr(base, 'base', None)
+    return False
+
+
+def remove_file(path):
+    """Remove a file if it exists."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class DatasetStore(object):
+    """A size-bounded, content-addressed store of arrays in .npy form.
+
+    Arrays are named by the SHA-256 digest of their encoding.  When the
+    store grows beyond max_bytes the least-recently used arrays are evicted;
+    the modification time of each file records when it was last used, so
+    several processes may safely share one store.  If in_use is given, it
+    is called before each eviction to list the digests of arrays that are
+    still needed, such as those to which queued jobs refer; these are
+    never evicted."""
+
+    _digest_pattern = re.compile('^[0-9a-f]{64}$')
+
+    def __init__(self, directory, max_bytes, in_use=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.in_use = in_use
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def valid_digest(cls, digest):
+        """Check that a digest is of the form used to name arrays."""
+        return isinstance(digest, str) and bool(
+            cls._digest_pattern.match(digest))
+
+    def path(self, digest):
+        if not self.valid_digest(digest):
+            raise ValueError('Invalid dataset digest.')
+        return os.path.join(self.directory, digest + '.npy')
+
+    def touch(self, digest):
+        """Mark an array as recently used, returning False if it is absent."""
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def missing(self, digests):
+        """Return those digests not present in the store.
+
+        Those that are present are marked as recently used."""
+        return [d for d in digests if not self.touch(d)]
+
+    def add(self, digest, stream):
+        """Add an array to the store from a stream of its .npy encoding.
+
+        Raises ValueError if the stream is not a valid array or does not
+        match its digest."""
+        path = self.path(digest)
+        spooled = spool_stream(stream, self.directory, suffix='.tmp')
+        try:
+            if spooled.checksum.lower() != digest:
+                raise ValueError('Dataset does not match its digest.')
+            with open(spooled.path, 'rb') as f:
+                header = f.read(_CHUNK_SIZE)
+            _, _, length = rtrain.wire_format.read_npy_header(header)
+            if length != spooled.size:
+                raise ValueError('Dataset length does not match its header.')
+            os.replace(spooled.path, path)
+        except BaseException:
+            remove_file(spooled.path)
+            raise
+        self.evict(keep=[digest])
+
+    def load(self, digest):
+        """Open a memory-mapped, read-only copy of an array in the store."""
+        path = self.path(digest)
+        os.utime(path)
+        return numpy.load(path, mmap_mode='r', allow_pickle=False)
+
+    def evict(self, keep=()):
+        """Remove least-recently used arrays until the store fits.
+
+        Arrays whose digests are listed in keep, or are in use, are never
+        removed."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        keep = list(keep)
+        if self.in_use is not None:
+            keep.extend(self.in_use())
+        keep = {self.path(d) for d in keep}
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            remove_file(path)
+            total -= size
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""The parts of a trainer that are built on Keras.
+
+Importing this module imports Keras, which takes some time, so it is only
+imported by trainers when they first run a job."""
+
+import copy
+import time
+
+import keras.callbacks
+import keras.utils
+import numpy
+
+import rtrain.server_utils.status
+
+
+class ArraySequence(keras.utils.Sequence):
+    """Batches of training data drawn from memory-mapped arrays.
+
+    Only one batch at a time is read into memory.  Batches are contiguous,
+    so that they can be read sequentially from disk, and are presented in
+    a different order each epoch."""
+
+    def __init__(self, x, y, batch_size):
+        super().__init__()
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.order = numpy.random.permutation(len(self))
+
+    def __len__(self):
+        return (len(self.x) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, index):
+        start = self.order[index] * self.batch_size
+        end = start + self.batch_size
+        return numpy.array(self.x[start:end]), numpy.array(self.y[start:end])
+
+    def on_epoch_end(self):
+        self.order = numpy.random.permutation(len(self))
+
+
+class StatusCallback(keras.callbacks.Callback):
+    """A callback class to report job status.
+
+    Progress and per-epoch metrics are sent to the publisher, which makes
+    them available to request handlers and writes them to the database in
+    the background; no database access is made from the training loop."""
+
+    def __init__(self, job_id, publisher, timings=None):
+        self.publisher = publisher
+        self.job_id = job_id
+        self.timings = timings if timings is not None else \
+            rtrain.server_utils.status.new_timings()
+        self.epochs_finished = 0
+        self.samples_this_epoch = 0
+        self.samples_per_epoch = None
+        self.epoch_start = None
+        self.last_update = -1
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.samples_this_epoch = 0
+        self.epoch_start = time.perf_counter()
+
+    def on_batch_end(self, batch, logs=None):
+        batch_size = logs.get('size', 0)
+        self.samples_this_epoch += batch_size
+
+        current_time = time.time()
+        if current_time - self.last_update > 0.5:
+            status = 100.0 * (self._epoch_fraction(batch) +
+                              self.epochs_finished) / self.params['epochs']
+            self.publisher.publish(self.job_id, status=status)
+            self.last_update = current_time
+
+    def _epoch_fraction(self, batch):
+        """Estimate the fraction of the current epoch that is complete."""
+        # When training from a Sequence, Keras counts batches, not samples.
+        if self.params.get('samples'):
+            return float(self.samples_this_epoch) / self.params['samples']
+        return float(batch + 1) / self.params['steps']
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs_finished += 1
+
+        metrics = {k: float(v) for k, v in (logs or {}).items()}
+        metrics['epoch'] = epoch
+
+        # Keras does not always report the size of each batch.
+        samples = self.samples_this_epoch or self.samples_per_epoch
+        if samples and self.epoch_start is not None:
+            metrics['samples_per_second'] = samples / max(
+                time.perf_counter() - self.epoch_start, 1e-9)
+            self.timings['samples_per_second'].append(
+                metrics['samples_per_second'])
+        self.publisher.publish(
+            self.job_id, epoch=metrics, timings=copy.deepcopy(self.timings))
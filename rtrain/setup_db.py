@@ -10,6 +10,54 @@ import rtrain.server_utils.config
 import rtrain.server_utils.model
 
 
+def enable_incremental_vacuum(engine):
+    """Let an SQLite database return the space of purged jobs to the system.
+
+    An existing database is rebuilt, which may take some time."""
+    with engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.exec_driver_sql('VACUUM')
+
+
+def add_missing_columns(engine):
+    """Bring the tables of a database created by an older rtraind up to date.
+
+    Columns and indices added since the database was created are added to
+    its tables, and the state of each existing job is derived from whether
+    and how it finished.  Tables that do not exist yet are left to
+    create_all()."""
+    model = rtrain.server_utils.model
+    with engine.begin() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        added = set()
+        for table in model.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    connection.exec_driver_sql(
+                        'ALTER TABLE %s ADD COLUMN %s %s' %
+                        (table.name, column.name,
+                         column.type.compile(dialect=engine.dialect)))
+                    added.add(column)
+            indices = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indices:
+                    index.create(connection)
+
+        jobs = model.Job.__table__
+        if jobs.c.state in added:
+            connection.execute(jobs.update().values(
+                state=sqlalchemy.case(
+                    (jobs.c.finished == 0, model.JOB_QUEUED),
+                    (jobs.c.status == -1, model.JOB_FAILED),
+                    else_=model.JOB_DONE)))
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -29,6 +77,9 @@ def main():
         sys.exit(1)
 
     engine = sqlalchemy.create_engine(config.db_string)
+    if engine.dialect.name == 'sqlite':
+        enable_incremental_vacuum(engine)
+    add_missing_columns(engine)
     rtrain.server_utils.model.Base.metadata.create_all(engine)
 
 
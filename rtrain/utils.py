@@ -2,9 +2,10 @@ import base64
 import io
 import json
 
-import keras.models
 import numpy
 
+import rtrain.wire_format
+
 
 def serialize_array(array):
     f = io.BytesIO()
@@ -28,31 +29,378 @@ def serialize_model(model):
     return json.dumps({'architecture': architecture, 'weights': weights_lists})
 
 
-def deserialize_model(model_json):
-    """Deserialize a Keras model from JSON."""
-    parsed_model = json.loads(model_json)
-    model = keras.models.model_from_json(parsed_model['architecture'])
-    model.set_weights([deserialize_array(w) for w in parsed_model['weights']])
+class ModelDescription(object):
+    """A model given by its architecture and weights, without Keras.
+
+    The architecture is a model's JSON description, as produced by Keras'
+    to_json(), and the weights are a list of NumPy arrays, as returned by
+    get_weights().  A description may be trained in place of a Keras model,
+    which does not require Keras to be installed, and the trained model is
+    returned as another description."""
+
+    def __init__(self, architecture, weights):
+        self.architecture = architecture
+        self.weights = list(weights)
+
+    def to_json(self):
+        return self.architecture
+
+    def get_weights(self):
+        return list(self.weights)
+
+    def set_weights(self, weights):
+        self.weights = list(weights)
+
+
+def _build_model(architecture, weights, keras_model):
+    """Build a Keras model, or a description of one if keras_model is false."""
+    if not keras_model:
+        # The weights may be read-only views onto a downloaded buffer.
+        return ModelDescription(architecture,
+                                [numpy.array(w) for w in weights])
+
+    # Keras is only imported when it is needed, as it takes some time.
+    import keras.models
+    model = keras.models.model_from_json(architecture)
+    model.set_weights(weights)
     return model
 
 
-def serialize_training_job(model, loss, optimizer, x_train, y_train, epochs,
-                           batch_size):
+def deserialize_model(model_json, keras_model=True):
+    """Deserialize a Keras model from JSON.
+
+    If keras_model is false, a ModelDescription is returned instead."""
+    parsed_model = json.loads(model_json)
+    return _build_model(
+        parsed_model['architecture'],
+        [deserialize_array(w) for w in parsed_model['weights']], keras_model)
+
+
+# Floating-point arrays may be sent at a lower precision than they are
+# held in.  NumPy has no bfloat16, so those are sent as the upper half of
+# each float32.  Labels may also be sent as int8 if no value is changed.
+PRECISIONS = ('float32', 'float16', 'bfloat16')
+LABEL_PRECISIONS = PRECISIONS + ('int8', )
+
+
+def to_transfer_precision(array, precision):
+    """Cast an array to a transfer precision.
+
+    Only floating-point arrays are cast, except to int8, which raises
+    ValueError if the array does not hold only small integers."""
+    array = numpy.asarray(array)
+    if precision is None:
+        return array
+    if precision == 'int8':
+        cast = array.astype(numpy.int8)
+        if not numpy.array_equal(cast, array):
+            raise ValueError('Array cannot be represented as int8.')
+        return cast
+    if not numpy.issubdtype(array.dtype, numpy.floating):
+        return array
+    if precision == 'bfloat16':
+        bits = numpy.ascontiguousarray(
+            array, dtype=numpy.float32).view(numpy.uint32)
+        # Round to nearest, ties to even.
+        rounded = (bits + (0x7FFF + ((bits >> 16) & 1))) >> 16
+        return numpy.where(
+            numpy.isnan(array), 0x7FC0, rounded).astype(numpy.uint16)
+    return array.astype(precision)
+
+
+def from_transfer_precision(array, precision, dtype):
+    """Restore an array sent at a transfer precision to its original dtype."""
+    dtype = numpy.dtype(dtype)
+    if precision == 'bfloat16' and array.dtype == numpy.uint16 and \
+            numpy.issubdtype(dtype, numpy.floating):
+        array = (array.astype(numpy.uint32) << 16).view(numpy.float32)
+    return array.astype(dtype, copy=False)
+
+
+def _transfer_fields(weights, x_train, y_train, precision, label_precision):
+    """Describe the transfer precision of a job's arrays."""
+    if precision is None and label_precision is None:
+        return {}
+    fields = {
+        'dtypes': {
+            'weights': [numpy.asarray(w).dtype.str for w in weights],
+            'x_train': x_train.dtype.str,
+            'y_train': y_train.dtype.str
+        }
+    }
+    if precision is not None:
+        fields['precision'] = precision
+    if label_precision is not None:
+        fields['label_precision'] = label_precision
+    return fields
+
+
+# Profilers that may be run on the server while a job trains.
+PROFILERS = ('cprofile', 'tensorflow')
+
+
+def _job_fields(weights, x_train, y_train, precision, label_precision,
+                profile):
+    """Describe the optional settings of a job."""
+    fields = _transfer_fields(weights, x_train, y_train, precision,
+                              label_precision)
+    if profile is not None:
+        fields['profile'] = profile
+    return fields
+
+
+def label_precision(job):
+    """Get the precision at which a job's labels were sent."""
+    return job.get('label_precision') or job.get('precision')
+
+
+def dataset_reference(digest):
+    """Refer to an array held in the server's dataset store."""
+    return {'dataset': digest}
+
+
+def is_dataset_reference(value):
+    return isinstance(value, dict) and 'dataset' in value
+
+
+def dataset_references(job):
+    """List the digests of the stored datasets to which a job refers."""
+    values = list(job.get('weights', [])) + [
+        job.get('x_train'), job.get('y_train')
+    ]
+    return [v['dataset'] for v in values if is_dataset_reference(v)]
+
+
+def serialize_model_binary(model, precision=None, dtypes=None, timings=None):
+    """Serialize a Keras model into a binary container.
+
+    If precision is given, the weights are sent at that precision, and are
+    restored on receipt to dtypes, or to their present dtypes if None.  The
+    timings of training, if given, are included in the header."""
+    weights = model.get_weights()
+    header = {'architecture': model.to_json()}
+    if timings is not None:
+        header['timings'] = timings
+    if precision is not None:
+        header['precision'] = precision
+        header['dtypes'] = dtypes or [w.dtype.str for w in weights]
+        weights = [to_transfer_precision(w, precision) for w in weights]
+    return rtrain.wire_format.Container(header, weights)
+
+
+def _model_container_weights(data):
+    """Decode a model container, restoring its weights' original dtypes."""
+    header, weights = rtrain.wire_format.read_container(data)
+    if 'dtypes' in header:
+        weights = [
+            from_transfer_precision(w, header.get('precision'), dtype)
+            for w, dtype in zip(weights, header['dtypes'])
+        ]
+    return header, weights
+
+
+def deserialize_model_binary(data, keras_model=True):
+    """Deserialize a Keras model from a binary container.
+
+    If keras_model is false, a ModelDescription is returned instead."""
+    header, weights = _model_container_weights(data)
+    return _build_model(header['architecture'], weights, keras_model)
+
+
+def model_container_to_json(data):
+    """Convert a model in a binary container to the JSON format."""
+    header, weights = _model_container_weights(data)
+    result = {
+        'architecture': header['architecture'],
+        'weights': [serialize_array(w) for w in weights]
+    }
+    if 'timings' in header:
+        result['timings'] = header['timings']
+    return json.dumps(result)
+
+
+def serialize_training_job(model,
+                           loss,
+                           optimizer,
+                           x_train,
+                           y_train,
+                           epochs,
+                           batch_size,
+                           references=None,
+                           precision=None,
+                           label_precision=None,
+                           profile=None):
+    """Serialize a training job into a JSON-compatible dictionary.
+
+    If references maps 'x_train' or 'y_train' to a digest, that array is
+    not sent and the job instead refers to the server's copy, which should
+    already be at the transfer precision.
+
+    Floating-point arrays are sent at the given precision, if any, and the
+    labels at label_precision if that is given; their original dtypes are
+    recorded in the job.  If profile is 'cprofile' or 'tensorflow', the
+    server records a profile of the job with that profiler."""
+    references = references or {}
     architecture = model.to_json()
     weights = model.get_weights()
+    fields = _job_fields(weights, x_train, y_train, precision,
+                         label_precision, profile)
 
     # We need to convert the arrays to strings
-    weights_serialized = [serialize_array(w) for w in weights]
+    weights_serialized = [
+        serialize_array(to_transfer_precision(w, precision)) for w in weights
+    ]
 
-    return ({
+    def array_or_reference(name, array, precision):
+        if name in references:
+            return dataset_reference(references[name])
+        return serialize_array(to_transfer_precision(array, precision))
+
+    return dict(fields, **{
         'architecture': architecture,
         'weights': weights_serialized,
         'loss': loss,
         'optimizer': optimizer,
-        'x_train': serialize_array(x_train),
-        'y_train': serialize_array(y_train),
+        'x_train': array_or_reference('x_train', x_train, precision),
+        'y_train': array_or_reference('y_train', y_train, label_precision
+                                      or precision),
         'x_train_shape': x_train.shape,
         'y_train_shape': y_train.shape,
         'epochs': epochs,
         'batch_size': batch_size
     })
+
+
+class _ContainerArrays(object):
+    """The arrays of a binary container under construction.
+
+    An array object used several times, at the same precision, is stored
+    only once."""
+
+    def __init__(self):
+        self.arrays = []
+        self._indices = {}
+        # Holding on to the originals keeps their ids from being reused.
+        self._originals = []
+
+    def add(self, array, precision):
+        """Add an array to the container, returning its index."""
+        key = (id(array), precision)
+        if key not in self._indices:
+            self._originals.append(array)
+            self.arrays.append(to_transfer_precision(array, precision))
+            self._indices[key] = len(self.arrays) - 1
+        return self._indices[key]
+
+
+def _binary_job(arrays, model, loss, optimizer, x_train, y_train, epochs,
+                batch_size, references, precision, label_precision, profile):
+    """Describe a training job whose arrays are held in a container."""
+    weights = model.get_weights()
+    fields = _job_fields(weights, x_train, y_train, precision,
+                         label_precision, profile)
+
+    def array_or_reference(name, array, precision):
+        if name in references:
+            return dataset_reference(references[name])
+        return arrays.add(array, precision)
+
+    return dict(fields, **{
+        'architecture': model.to_json(),
+        'weights': [arrays.add(w, precision) for w in weights],
+        'loss': loss,
+        'optimizer': optimizer,
+        'x_train': array_or_reference('x_train', x_train, precision),
+        'y_train': array_or_reference('y_train', y_train, label_precision
+                                      or precision),
+        'x_train_shape': x_train.shape,
+        'y_train_shape': y_train.shape,
+        'epochs': epochs,
+        'batch_size': batch_size
+    })
+
+
+def serialize_training_job_binary(model,
+                                  loss,
+                                  optimizer,
+                                  x_train,
+                                  y_train,
+                                  epochs,
+                                  batch_size,
+                                  references=None,
+                                  precision=None,
+                                  label_precision=None,
+                                  profile=None):
+    """Serialize a training job into a binary container.
+
+    The job is described as for serialize_training_job(), except that each
+    array is replaced by its index in the container's array list."""
+    arrays = _ContainerArrays()
+    job = _binary_job(arrays, model, loss, optimizer, x_train, y_train,
+                      epochs, batch_size, references or {}, precision,
+                      label_precision, profile)
+    return rtrain.wire_format.Container({'job': job}, arrays.arrays)
+
+
+def serialize_training_batch(jobs,
+                             references=None,
+                             precision=None,
+                             label_precision=None,
+                             profile=None):
+    """Serialize several training jobs into a JSON-compatible dictionary.
+
+    Each job is a dictionary of the arguments model, loss, optimizer,
+    x_train, y_train, epochs and batch_size.  If given, references is a
+    list holding the references for each job, as for
+    serialize_training_job()."""
+    references = references or [None] * len(jobs)
+    return {
+        'jobs': [
+            serialize_training_job(
+                references=r,
+                precision=precision,
+                label_precision=label_precision,
+                profile=profile,
+                **job) for job, r in zip(jobs, references)
+        ]
+    }
+
+
+def serialize_training_batch_binary(jobs,
+                                    references=None,
+                                    precision=None,
+                                    label_precision=None,
+                                    profile=None):
+    """Serialize several training jobs into a binary container.
+
+    The arguments are as for serialize_training_batch().  Arrays shared
+    between jobs, such as a common x_train, are stored only once."""
+    arrays = _ContainerArrays()
+    references = references or [None] * len(jobs)
+    batch = [
+        _binary_job(
+            arrays,
+            references=r or {},
+            precision=precision,
+            label_precision=label_precision,
+            profile=profile,
+            **job) for job, r in zip(jobs, references)
+    ]
+    return rtrain.wire_format.Container({'jobs': batch}, arrays.arrays)
+
+
+def resolve_training_job_arrays(job, arrays):
+    """Replace the array indices in a binary training job with the arrays."""
+
+    def lookup(index):
+        if is_dataset_reference(index):
+            return index
+        if not 0 <= index < len(arrays):
+            raise ValueError('Array index %d out of range.' % index)
+        return arrays[index]
+
+    resolved = dict(job)
+    resolved['weights'] = [lookup(i) for i in job['weights']]
+    resolved['x_train'] = lookup(job['x_train'])
+    resolved['y_train'] = lookup(job['y_train'])
+    return resolved
@@ -1,14 +1,35 @@
 #!/usr/bin/env python3
 """Request validation."""
 
+import copy
+
 import jsonschema
 
 schema = {
     "$id":
     "http://twopif.net/rtrain/schema/training-job/1.0",
     "definitions": {
+        "dataset": {
+            "type": "object",
+            "required": ["dataset"],
+            "additionalProperties": False,
+            "properties": {
+                "dataset": {
+                    "type": "string",
+                    "pattern": "^[0-9a-f]{64}$"
+                }
+            }
+        },
         "ndarray": {
-            "type": "string"
+            "oneOf": [{
+                "type": "string"
+            }, {
+                "$ref": "#/definitions/dataset"
+            }]
+        },
+        "dtype": {
+            "type": "string",
+            "pattern": "^[<>|=][biufc][0-9]+$"
         }
     },
     "type":
@@ -61,11 +82,99 @@ schema = {
         "batch_size": {
             "type": "integer",
             "minimum": 1
+        },
+        "precision": {
+            "enum": ["float32", "float16", "bfloat16"]
+        },
+        "label_precision": {
+            "enum": ["float32", "float16", "bfloat16", "int8"]
+        },
+        "profile": {
+            "enum": ["cprofile", "tensorflow"]
+        },
+        "dtypes": {
+            "type": "object",
+            "required": ["weights", "x_train", "y_train"],
+            "additionalProperties": False,
+            "properties": {
+                "weights": {
+                    "type": "array",
+                    "items": {
+                        "$ref": "#/definitions/dtype"
+                    }
+                },
+                "x_train": {
+                    "$ref": "#/definitions/dtype"
+                },
+                "y_train": {
+                    "$ref": "#/definitions/dtype"
+                }
+            }
         }
+    },
+    # Arrays sent at a transfer precision can only be restored to their
+    # original dtypes if those are given.
+    "dependencies": {
+        "precision": ["dtypes"],
+        "label_precision": ["dtypes"]
     }
 }
 
 
+# In a binary container the arrays are stored outside of the job
+# description, which refers to them by index.
+binary_schema = copy.deepcopy(schema)
+binary_schema["$id"] = "http://twopif.net/rtrain/schema/binary-training-job/1.0"
+binary_schema["definitions"]["ndarray"] = {
+    "oneOf": [{
+        "type": "integer",
+        "minimum": 0
+    }, {
+        "$ref": "#/definitions/dataset"
+    }]
+}
+
+
+# Compiling a validator costs far more than using one, so the validator for
+# each schema is built once and shared.
+_validator = jsonschema.Draft4Validator(schema)
+_binary_validator = jsonschema.Draft4Validator(binary_schema)
+
+# The kinds of dtype permitted for arrays: booleans, signed and unsigned
+# integers, floating-point and complex numbers.
+_array_kinds = 'biufc'
+
+
 def validate_training_request(request):
     """Validate a JSON-formatted training request."""
-    return jsonschema.Draft4Validator(schema).is_valid(request)
+    return _validator.is_valid(request)
+
+
+def validate_binary_training_request(request):
+    """Validate the job description from a binary training request."""
+    return _binary_validator.is_valid(request)
+
+
+def validate_array_headers(request, header):
+    """Check the arrays of a valid training request against its description.
+
+    header is called with each array in the request, in whatever form it
+    takes there, and returns the array's shape and dtype, or None if they
+    are not yet known; it should read no more than the array's header, and
+    raise ValueError if that is invalid.  The training data must have the
+    declared shapes, with as many labels as samples, and every array must
+    have a numeric dtype."""
+    if request['x_train_shape'][:1] != request['y_train_shape'][:1]:
+        return False
+    try:
+        x_header = header(request['x_train'])
+        y_header = header(request['y_train'])
+        headers = [x_header, y_header] + [header(w) for w in request['weights']]
+    except ValueError:
+        return False
+
+    for array_header, shape in ((x_header, request['x_train_shape']),
+                                (y_header, request['y_train_shape'])):
+        if array_header is not None and tuple(array_header[0]) != tuple(shape):
+            return False
+    return all(h is None or h[1].kind in _array_kinds for h in headers)
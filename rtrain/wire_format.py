@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Binary container format for training jobs and trained models.
+
+A container consists of a fixed-size preamble, a JSON header, and a
+sequence of arrays, each encoded in the NumPy ``.npy`` format:
+
+    +--------+---------+---------------+--------+---------+-----+
+    | magic  | version | header length | header | array 0 | ... |
+    | 6 byte | uint16  | uint64        | JSON   | .npy    |     |
+    +--------+---------+---------------+--------+---------+-----+
+
+The header is an object whose ``arrays`` member lists the length in bytes
+of each encoded array, in order.  All other members are left to the caller.
+Arrays are decoded as views onto the underlying buffer, so no copy of the
+array data is made on either side of the connection.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import json
+import struct
+
+import numpy
+import numpy.lib.format
+
+CONTENT_TYPE = 'application/x-rtrain-job'
+MODEL_CONTENT_TYPE = 'application/x-rtrain-model'
+ARRAY_CONTENT_TYPE = 'application/x-npy'
+MAGIC = b'RTRAIN'
+VERSION = 1
+
+_preamble = struct.Struct('<6sHQ')
+
+# Arrays are sent in pieces of this size so that the HTTP layer never
+# needs to copy more than this much at once.
+_CHUNK_SIZE = 1 << 20
+
+
+def _npy_header(array):
+    """Produce the .npy header for a C-contiguous array."""
+    f = io.BytesIO()
+    numpy.lib.format.write_array_header_1_0(
+        f, numpy.lib.format.header_data_from_array_1_0(array))
+    return f.getvalue()
+
+
+def _array_bytes(array):
+    """Return a flat byte view of a C-contiguous array."""
+    return array.reshape(-1).view(numpy.uint8).data
+
+
+class EncodedArray(object):
+    """A single array in .npy form.
+
+    The array is iterable, yielding bytes-like chunks that refer to the
+    original array data where possible, and has a known length."""
+
+    def __init__(self, array):
+        array = numpy.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError('Object arrays are not permitted.')
+        self.array = array
+        self.header = _npy_header(array)
+        self._digest = None
+
+    def __len__(self):
+        return len(self.header) + self.array.nbytes
+
+    def __iter__(self):
+        yield self.header
+        data = _array_bytes(self.array)
+        for i in range(0, len(data), _CHUNK_SIZE):
+            yield data[i:i + _CHUNK_SIZE]
+
+    @property
+    def digest(self):
+        """The hexadecimal SHA-256 digest of the encoded array."""
+        if self._digest is None:
+            digest = hashlib.sha256()
+            for chunk in self:
+                digest.update(chunk)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+
+class Container(object):
+    """An encoded container, ready to be written to a socket or file.
+
+    The container is iterable, yielding bytes-like chunks, and has a known
+    length so that it can be sent without chunked transfer encoding."""
+
+    def __init__(self, header, arrays):
+        self.arrays = [EncodedArray(a) for a in arrays]
+
+        header = dict(header)
+        header['arrays'] = [len(a) for a in self.arrays]
+        header_json = json.dumps(header).encode('utf8')
+
+        self.preamble = _preamble.pack(MAGIC, VERSION, len(header_json))
+        self.header_json = header_json
+
+    def __len__(self):
+        return (len(self.preamble) + len(self.header_json) + sum(
+            len(a) for a in self.arrays))
+
+    def __iter__(self):
+        yield self.preamble
+        yield self.header_json
+        for array in self.arrays:
+            yield from array
+
+    def to_bytes(self):
+        """Encode the container into a single bytes object."""
+        return b''.join(self)
+
+
+def is_container(data):
+    """Determine whether a buffer begins with a container preamble."""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def _read_npy_header(view):
+    """Parse an .npy header, returning (shape, fortran_order, dtype, length).
+
+    Only the header itself is read; the array body is left untouched."""
+    if len(view) < numpy.lib.format.MAGIC_LEN + 2:
+        raise ValueError('Truncated array header.')
+    major = view[len(numpy.lib.format.MAGIC_PREFIX)]
+    if major == 1:
+        length_format = '<H'
+    elif major in (2, 3):
+        length_format = '<I'
+    else:
+        raise ValueError('Unsupported array format version %d.' % major)
+    header_length, = struct.unpack_from(length_format, view,
+                                        numpy.lib.format.MAGIC_LEN)
+    header_end = (numpy.lib.format.MAGIC_LEN +
+                  struct.calcsize(length_format) + header_length)
+    if len(view) < header_end:
+        raise ValueError('Truncated array header.')
+
+    f = io.BytesIO(bytes(view[:header_end]))
+    version = numpy.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = \
+            numpy.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = \
+            numpy.lib.format.read_array_header_2_0(f)
+    if dtype.hasobject:
+        raise ValueError('Object arrays are not permitted.')
+    return shape, fortran_order, dtype, header_end
+
+
+def read_npy_header(data):
+    """Parse the header of an .npy-encoded array.
+
+    Returns the shape, dtype and the length of the complete encoding, which
+    must be equal to the length of the data for a valid array."""
+    shape, _, dtype, header_end = _read_npy_header(memoryview(data))
+    count = int(numpy.prod(shape, dtype=numpy.int64))
+    return shape, dtype, header_end + count * dtype.itemsize
+
+
+def _base64_prefix(s, length):
+    """Decode enough of a base64 string to give its first length bytes."""
+    return base64.b64decode(s[:-(-length // 3) * 4], validate=True)
+
+
+def read_base64_npy_header(s):
+    """Parse the header of a base64-encoded .npy array.
+
+    Only the header is decoded; the length of the rest of the string is
+    checked against the header without decoding it.  Returns the shape and
+    dtype of the array."""
+    if not isinstance(s, str) or len(s) % 4:
+        raise ValueError('Invalid base64 array.')
+    try:
+        prefix = _base64_prefix(s, numpy.lib.format.MAGIC_LEN + 4)
+        if prefix[len(numpy.lib.format.MAGIC_PREFIX):
+                  numpy.lib.format.MAGIC_LEN] == b'\x01\x00':
+            header_length, = struct.unpack_from('<H', prefix,
+                                                numpy.lib.format.MAGIC_LEN)
+            header_end = numpy.lib.format.MAGIC_LEN + 2 + header_length
+        else:
+            header_length, = struct.unpack_from('<I', prefix,
+                                                numpy.lib.format.MAGIC_LEN)
+            header_end = numpy.lib.format.MAGIC_LEN + 4 + header_length
+        shape, dtype, length = read_npy_header(_base64_prefix(s, header_end))
+    except (binascii.Error, struct.error) as e:
+        raise ValueError('Invalid base64 array.') from e
+
+    padding = len(s) - len(s.rstrip('='))
+    if len(s) // 4 * 3 - padding != length:
+        raise ValueError('Array length does not match its header.')
+    return shape, dtype
+
+
+def _array_from_npy(view):
+    """Decode an .npy-encoded array as a view onto a buffer."""
+    shape, fortran_order, dtype, header_end = _read_npy_header(view)
+    count = int(numpy.prod(shape, dtype=numpy.int64))
+    if len(view) - header_end != count * dtype.itemsize:
+        raise ValueError('Array length does not match its header.')
+    array = numpy.frombuffer(view[header_end:], dtype=dtype, count=count)
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def read_header(data):
+    """Parse the preamble and header of a container.
+
+    Returns the header and the offset at which the array data begins."""
+    view = memoryview(data)
+    if len(view) < _preamble.size:
+        raise ValueError('Truncated container.')
+    magic, version, header_length = _preamble.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Not an rtrain container.')
+    if version != VERSION:
+        raise ValueError('Unsupported container version %d.' % version)
+
+    header_end = _preamble.size + header_length
+    if len(view) < header_end:
+        raise ValueError('Truncated container.')
+    try:
+        header = json.loads(str(view[_preamble.size:header_end], 'utf8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('Invalid container header.') from e
+    if not isinstance(header, dict) or not isinstance(
+            header.get('arrays'), list):
+        raise ValueError('Invalid container header.')
+    return header, header_end
+
+
+def read_container(data):
+    """Decode a container, returning its header and a list of arrays.
+
+    The arrays are read-only views onto ``data``."""
+    view = memoryview(data)
+    header, offset = read_header(view)
+
+    arrays = []
+    for length in header['arrays']:
+        if not isinstance(length, int) or length < 0 or \
+                offset + length > len(view):
+            raise ValueError('Truncated container.')
+        arrays.append(_array_from_npy(view[offset:offset + length]))
+        offset += length
+    if offset != len(view):
+        raise ValueError('Trailing data after container.')
+    return header, arrays
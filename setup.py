@@ -22,14 +22,20 @@ setup(
     ],
     keywords='deeplearning neuralnetworks',
     packages=find_packages(),
-    install_requires=[
-        'flask', 'keras>=2.0.6', 'tensorflow', 'jsonschema', 'numpy',
-        'requests', 'requests-toolbelt', 'structlog', 'tqdm', 'sqlalchemy'
-    ],
+    # The client needs only these; Keras is used if it is installed.
+    install_requires=['numpy', 'requests', 'requests-toolbelt', 'tqdm'],
     python_requires='>=3',
     extras_require={
+        'client': [],
+        'keras': ['keras>=2.0.6', 'tensorflow'],
+        'server': [
+            'flask', 'keras>=2.0.6', 'tensorflow', 'jsonschema', 'structlog',
+            'sqlalchemy'
+        ],
         'gpu': 'tensorflow-gpu',
         'tests': ['pytest', 'pytest-flask'],
+        'zstd': 'zstandard',
+        'lz4': 'lz4',
     },
     entry_points={
         'console_scripts': [
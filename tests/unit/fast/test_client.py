@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+
+import numpy
+import pytest
+import requests
+
+import rtrain.client
+import rtrain.compression
+import rtrain.server_utils.http
+import rtrain.utils
+
+ARCHITECTURE = json.dumps({
+    'class_name': 'Sequential',
+    'config': {
+        'layers': []
+    }
+})
+
+
+class FakeServer(object):
+    """A stand-in for rtraind, answering each path with a fixed response.
+
+    Every request is recorded with its headers and body."""
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        self._server = rtrain.server_utils.http.Server(
+            '127.0.0.1', 0, self.application, 4, 5)
+        self.url = 'http://127.0.0.1:%d' % self._server.port
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+
+    def application(self, environ, start_response):
+        if environ.get('HTTP_TRANSFER_ENCODING') == 'chunked':
+            body = environ['wsgi.input'].read()
+        else:
+            body = environ['wsgi.input'].read(
+                int(environ.get('CONTENT_LENGTH') or 0))
+        self.requests.append({
+            'method': environ['REQUEST_METHOD'],
+            'path': environ['PATH_INFO'],
+            'content_type': environ.get('CONTENT_TYPE'),
+            'content_encoding': environ.get('HTTP_CONTENT_ENCODING'),
+            'body': body
+        })
+        status, headers, body = self.responses.get(
+            environ['PATH_INFO'], ('404 Not Found', {}, b''))
+        headers = dict(headers)
+        headers['Content-Length'] = str(len(body))
+        start_response(status, list(headers.items()))
+        return [body]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    yield server
+    server.close()
+
+
+def make_job():
+    return {
+        'model':
+        rtrain.utils.ModelDescription(ARCHITECTURE, [numpy.zeros(3)]),
+        'loss': 'mse',
+        'optimizer': 'sgd',
+        'x_train': numpy.zeros((4, 2)),
+        'y_train': numpy.zeros((4, 3)),
+        'epochs': 1,
+        'batch_size': 2
+    }
+
+
+# Older servers accept no codings, and say nothing of them on /ping.
+@pytest.mark.parametrize('compression', [None, 'auto'])
+def test_submit_json_uncompressed(server, compression):
+    server.responses['/ping'] = ('200 OK', {}, b'{}')
+    server.responses['/train'] = ('200 OK', {}, b'a_job_id')
+    session = rtrain.client.RTrainSession(
+        server.url, wire_format='json', compression=compression)
+    response = session._submit(**make_job())
+    assert response.status_code == 200
+    assert response.text == 'a_job_id'
+
+    request = server.requests[-1]
+    assert request['path'] == '/train'
+    assert request['content_type'] == 'application/json'
+    assert request['content_encoding'] is None
+    job = json.loads(request['body'])
+    assert job['loss'] == 'mse'
+    assert job['architecture'] == ARCHITECTURE
+
+
+def test_submit_batch_json_uncompressed(server):
+    server.responses['/train/batch'] = ('200 OK', {}, b'["a", "b"]')
+    session = rtrain.client.RTrainSession(
+        server.url, wire_format='json', compression=None)
+    assert session._submit_batch([make_job(), make_job()], None,
+                                 None) == ['a', 'b']
+
+    request, = server.requests
+    assert len(json.loads(request['body'])['jobs']) == 2
+
+
+def test_submit_json_compressed(server):
+    # The server's codings are learned from /ping.
+    server.responses['/ping'] = ('200 OK', {
+        'Accept-Encoding': 'gzip'
+    }, b'{}')
+    server.responses['/train'] = ('200 OK', {}, b'a_job_id')
+    session = rtrain.client.RTrainSession(
+        server.url, wire_format='json', compression='gzip')
+    assert session._submit(**make_job()).text == 'a_job_id'
+
+    request = server.requests[-1]
+    assert request['content_encoding'] == 'gzip'
+    job = json.loads(
+        rtrain.compression.decompress(request['body'], 'gzip'))
+    assert job['loss'] == 'mse'
+
+
+# Older servers report failure only by a status of -1.
+@pytest.mark.parametrize('status', [{
+    'status': -1,
+    'finished': 1,
+    'state': 'failed'
+}, {
+    'status': -1,
+    'finished': 1
+}])
+def test_train_failed(server, status):
+    traceback = b'ValueError: Unknown loss function: no_such_loss'
+    server.responses['/train'] = ('200 OK', {}, b'a_job_id')
+    server.responses['/status/a_job_id'] = ('200 OK', {
+        'Content-Type': 'application/json'
+    }, json.dumps(status).encode('utf8'))
+    server.responses['/result/a_job_id'] = ('200 OK', {}, traceback)
+    session = rtrain.client.RTrainSession(
+        server.url, wire_format='json', compression=None)
+
+    with pytest.raises(rtrain.client.JobFailedError) as e:
+        session.train(quiet=True, **make_job())
+    assert e.value.job_id == 'a_job_id'
+    assert e.value.message == traceback.decode('utf8')
+
+    future = session.submit(**make_job())
+    with pytest.raises(rtrain.client.JobFailedError):
+        future.result(timeout=30)
+    session.close()
+
+
+def test_upload_connect_retries(monkeypatch):
+    attempts = []
+
+    def create_connection(*args, **kwargs):
+        attempts.append(args)
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr('urllib3.util.connection.create_connection',
+                        create_connection)
+    session = rtrain.client.RTrainSession(
+        'http://127.0.0.1:1',
+        compression=None,
+        retries=2,
+        backoff_factor=0,
+        backoff_jitter=0)
+
+    # Uploads are retried by the session alone, not by urllib3 as well.
+    with pytest.raises(requests.ConnectionError):
+        session._send('POST', 'train', [b'{}'], 'application/json')
+    assert len(attempts) == 3
+
+    del attempts[:]
+    with pytest.raises(requests.ConnectionError):
+        session.session.get('http://127.0.0.1:1/ping')
+    assert len(attempts) == 3
+
+
+def test_poll_retries(server):
+    server.responses['/status/a_job_id'] = ('503 Service Unavailable', {},
+                                            b'')
+    server.responses['/status'] = ('503 Service Unavailable', {}, b'')
+    session = rtrain.client.RTrainSession(
+        server.url, retries=2, backoff_factor=0, backoff_jitter=0)
+
+    # Status requests are retried by the adapter alone, not by the poll
+    # loops as well.
+    assert session._poll_status('a_job_id', lambda status: None) is None
+    assert len(server.requests) == 3
+
+    del server.requests[:]
+    with pytest.raises(IOError):
+        session._poll_statuses(['a_job_id'], lambda statuses: None)
+    assert len(server.requests) == 3
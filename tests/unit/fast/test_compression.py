@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import io
+import tracemalloc
+
+import pytest
+
+import rtrain.compression
+
+
+@pytest.mark.parametrize('encoding', rtrain.compression.supported())
+def test_round_trip(encoding):
+    data = bytes(range(256)) * 1000
+    chunks = [data[i:i + 3000] for i in range(0, len(data), 3000)]
+    compressed = b''.join(rtrain.compression.compress(chunks, encoding))
+    assert len(compressed) < len(data)
+    assert rtrain.compression.decompress(compressed, encoding) == data
+
+    reader = rtrain.compression.DecompressingReader(
+        io.BytesIO(compressed), encoding)
+    pieces = []
+    while True:
+        piece = reader.read(1000)
+        if not piece:
+            break
+        assert len(piece) <= 1000
+        pieces.append(piece)
+    assert b''.join(pieces) == data
+
+
+@pytest.mark.parametrize('encoding', rtrain.compression.supported())
+def test_empty(encoding):
+    compressed = b''.join(rtrain.compression.compress([], encoding))
+    assert rtrain.compression.decompress(compressed, encoding) == b''
+
+
+def test_invalid_data():
+    compressed = b''.join(rtrain.compression.compress([b'x' * 1000], 'gzip'))
+    with pytest.raises(ValueError):
+        rtrain.compression.decompress(compressed[:-10], 'gzip')
+    with pytest.raises(ValueError):
+        rtrain.compression.decompress(b'not gzip data', 'gzip')
+
+
+def test_parse_accept_encoding():
+    parse = rtrain.compression.parse_accept_encoding
+    assert parse(None) == []
+    assert parse('br, GZIP;q=0.5, identity') == ['gzip']
+    assert parse('gzip;q=0') == []
+
+
+@pytest.mark.parametrize('encoding', rtrain.compression.supported())
+def test_bounded_reads(encoding):
+    # A small body that expands enormously is decoded a piece at a time.
+    compressed = b''.join(
+        rtrain.compression.compress([bytes(1 << 20)] * 64, encoding))
+    reader = rtrain.compression.DecompressingReader(
+        io.BytesIO(compressed), encoding)
+    tracemalloc.start()
+    try:
+        total = 0
+        while True:
+            piece = reader.read(1 << 16)
+            if not piece:
+                break
+            assert len(piece) <= 1 << 16
+            total += len(piece)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert total == 64 << 20
+    assert peak < 8 << 20
@@ -22,3 +22,86 @@ def test_config_empty_has_no_password():
                                      "the password")
     config = rtrain.server_utils.config.RTrainConfig(config_string)
     assert config.password == ""
+
+
+def test_config_data_directory():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nDataDirectory=/var/lib/rtraind")
+    assert config.data_directory == "/var/lib/rtraind"
+    assert config.spool_directory == "/var/lib/rtraind/spool"
+
+
+def test_config_workers():
+    config = rtrain.server_utils.config.RTrainConfig("[rtraind]\nWorkers=4")
+    assert config.workers == 4
+    assert rtrain.server_utils.config.RTrainConfig("").workers == 1
+
+
+def test_config_result_retention():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nResultRetention=86400\nDeduplicateJobs=no")
+    assert config.result_retention == 86400
+    assert not config.deduplicate_jobs
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.result_retention == 3600
+    assert config.deduplicate_jobs
+
+
+def test_config_retention_limits():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nMaxJobs=100\nMaxResultBytes=1000000\n"
+        "UnfinishedJobRetention=60")
+    assert config.max_jobs == 100
+    assert config.max_result_bytes == 1000000
+    assert config.unfinished_job_retention == 60
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.max_jobs is None
+    assert config.max_result_bytes is None
+    assert config.unfinished_job_retention == 7 * 24 * 3600
+
+
+def test_config_model_cache_bytes():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nModelCacheBytes=1000")
+    assert config.model_cache_bytes == 1000
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.model_cache_bytes == 256 << 20
+
+
+def test_config_worker_recycling():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nWorkerMaxJobs=100\nWorkerMaxMemory=1000000")
+    assert config.worker_max_jobs == 100
+    assert config.worker_max_memory == 1000000
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.worker_max_jobs is None
+    assert config.worker_max_memory is None
+
+
+def test_config_max_attempts():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nMaxAttempts=5")
+    assert config.max_attempts == 5
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.max_attempts == 3
+
+
+def test_config_http():
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nBind=0.0.0.0\nPort=8080\nHttpWorkers=0\nHttpThreads=16\n"
+        "HttpWaiters=8\nHttpTimeout=30\nMaxRequestBytes=1000000")
+    assert config.bind == '0.0.0.0'
+    assert config.port == 8080
+    assert config.http_workers == 0
+    assert config.http_threads == 16
+    assert config.http_waiters == 8
+    assert config.http_timeout == 30
+    assert config.max_request_bytes == 1000000
+    config = rtrain.server_utils.config.RTrainConfig("")
+    assert config.bind == '127.0.0.1'
+    assert config.port == 5000
+    assert config.http_workers == 1
+    assert config.http_threads == 64
+    assert config.http_waiters == 256
+    assert config.http_timeout == 60
+    assert config.max_request_bytes is None
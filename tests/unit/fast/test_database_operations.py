@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import base64
+import json
 import pytest
 import datetime
 
@@ -34,6 +35,7 @@ def test_create_new_job(session):
     assert job.id == job_id
     assert job.status == 0.0
     assert job.finished == 0
+    assert job.state == model.JOB_QUEUED
 
     assert abs(job.creation_time -
                datetime.datetime.utcnow()) < datetime.timedelta(minutes=1)
@@ -43,6 +45,129 @@ def test_create_new_job(session):
     assert job.training_jobs[0].training_job == b'["foobarbaz"]'
 
 
+def test_create_spooled_job(session):
+    job_id = ops.create_spooled_job('/path/to/job', 'ABCDEF', session)
+
+    job = session.query(model.Job).first()
+    assert job.id == job_id
+    assert job.finished == 0
+    assert len(job.training_jobs) == 1
+    assert job.training_jobs[0].training_job is None
+    assert job.training_jobs[0].training_job_path == '/path/to/job'
+    assert job.training_jobs[0].job_checksum == 'ABCDEF'
+
+
+def test_create_spooled_batch(session):
+    job_ids = ops.create_spooled_batch('/path/to/batch', 'ABCDEF', 3,
+                                       session)
+    assert len(set(job_ids)) == 3
+
+    checksums = set()
+    for index, job_id in enumerate(job_ids):
+        job = session.query(model.Job).filter_by(id=job_id).first()
+        assert job.state == model.JOB_QUEUED
+        assert job.training_jobs[0].training_job_path == '/path/to/batch'
+        assert job.training_jobs[0].training_job_index == index
+        checksums.add(job.training_jobs[0].job_checksum)
+    assert len(checksums) == 3
+
+    # The same batch gives the same checksums.
+    job_ids = ops.create_spooled_batch('/path/to/batch', 'ABCDEF', 1,
+                                       session)
+    job = session.query(model.Job).filter_by(id=job_ids[0]).first()
+    assert job.training_jobs[0].job_checksum in checksums
+
+    # Jobs may instead be stored in files of their own.
+    job_ids = ops.create_spooled_batch(
+        '/path/to/batch',
+        'ABCDEF',
+        3,
+        session, [0, 2],
+        paths=['/path/to/%d' % i for i in range(3)])
+    training_jobs = [
+        session.query(model.TrainingJob).filter_by(job_id=job_id).first()
+        for job_id in job_ids
+    ]
+    assert [tj.training_job_path
+            for tj in training_jobs] == ['/path/to/0', '/path/to/2']
+    assert [tj.training_job_index for tj in training_jobs] == [None, None]
+    assert [tj.job_checksum for tj in training_jobs
+            ] == [ops.batch_checksums('ABCDEF', 3)[i] for i in (0, 2)]
+
+
+def test_find_jobs(session):
+    old_job_id = ops.create_spooled_job('/path/to/old', 'A' * 64, session)
+    job = session.query(model.Job).filter_by(id=old_job_id).first()
+    job.creation_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    assert ops.find_jobs(['A' * 64], 60, session) == {}
+    assert ops.find_jobs(['A' * 64], 3 * 3600, session) == {
+        'A' * 64: old_job_id
+    }
+
+    job_id = ops.create_spooled_job('/path/to/new', 'A' * 64, session)
+    batch_ids = ops.create_spooled_batch('/path/to/batch', 'B' * 64, 2,
+                                         session)
+    batch_checksums = [
+        session.query(model.TrainingJob).filter_by(job_id=i).first()
+        .job_checksum for i in batch_ids
+    ]
+    found = ops.find_jobs(['A' * 64, 'C' * 64] + batch_checksums, 3 * 3600,
+                          session)
+    assert found == {
+        'A' * 64: job_id,
+        batch_checksums[0]: batch_ids[0],
+        batch_checksums[1]: batch_ids[1]
+    }
+
+
+def test_find_duplicate_jobs(session):
+    queued_id = ops.create_spooled_job('/path/to/queued', 'A' * 64, session)
+    failed_id = ops.create_spooled_job('/path/to/failed', 'B' * 64, session)
+    ops.finish_job(failed_id, 'error', session, failed=True)
+    done_id = ops.create_spooled_job('/path/to/done', 'C' * 64, session)
+    ops.finish_job(done_id, None, session, result_path='/path/to/result')
+    old_id = ops.create_spooled_job('/path/to/old', 'D' * 64, session)
+    ops.finish_job(old_id, None, session, result_path='/path/to/old_result')
+    job = session.query(model.Job).filter_by(id=old_id).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+
+    found = ops.find_duplicate_jobs(
+        ['A' * 64, 'B' * 64, 'C' * 64, 'D' * 64, 'E' * 64], 3600, session)
+    assert found == {'A' * 64: queued_id, 'C' * 64: done_id}
+
+
+def test_create_spooled_batch_indices(session):
+    job_ids = ops.create_spooled_batch('/path/to/batch', 'A' * 64, 3,
+                                       session, [0, 2])
+    assert len(job_ids) == 2
+    checksums = ops.batch_checksums('A' * 64, 3)
+    assert ops.find_jobs(checksums, 60, session) == {
+        checksums[0]: job_ids[0],
+        checksums[2]: job_ids[1]
+    }
+    indices = [
+        session.query(model.TrainingJob).filter_by(job_id=i).first()
+        .training_job_index for i in job_ids
+    ]
+    assert indices == [0, 2]
+
+
+def test_get_statuses(session):
+    job_id_1 = ops.create_new_job([], session)
+    job_id_2 = ops.create_new_job([], session)
+    ops.update_status(job_id_2, 50.0, session)
+
+    statuses = ops.get_statuses([job_id_1, job_id_2, 'unknown'], session)
+    assert set(statuses) == {job_id_1, job_id_2}
+    assert statuses[job_id_1].status == 0
+    assert statuses[job_id_2].status == 50.0
+    assert statuses[job_id_2].state == model.JOB_QUEUED
+
+
 def test_update_status(session):
     job_id = ops.create_new_job([], session)
     ops.update_status(job_id, 3.14159, session)
@@ -75,6 +200,7 @@ def test_finish(session):
 
     result = session.query(model.Job).first()
     assert result.finished == 1
+    assert result.state == model.JOB_DONE
     assert len(result.training_results) == 1
     assert result.training_results[0].result == b'result'
     assert abs(result.modification_time - modification_time) \
@@ -96,6 +222,42 @@ def test_get_results_not_available(session):
     assert result is None
 
 
+def test_get_result_path(session):
+    job_id = ops.create_new_job([], session)
+    assert ops.get_result_path(job_id, session) is None
+
+    ops.finish_job(job_id, None, session, result_path='/results/1.model')
+    assert ops.get_results(job_id, session) is None
+    assert ops.get_result_path(job_id, session) == '/results/1.model'
+
+
+def test_timings_and_profile(session):
+    job_id = ops.create_new_job([], session)
+    assert ops.get_status(job_id, session).timings is None
+    assert ops.get_profile_path(job_id, session) is None
+
+    timings = {'phases': {'fit': 1.5}, 'samples_per_second': [100.0]}
+    ops.finish_job(
+        job_id,
+        None,
+        session,
+        result_path='/results/1.model',
+        timings=timings,
+        profile_path='/results/1.prof')
+    assert json.loads(ops.get_status(job_id, session).timings) == timings
+    assert json.loads(
+        ops.get_statuses([job_id], session)[job_id].timings) == timings
+    assert ops.get_profile_path(job_id, session) == '/results/1.prof'
+
+    job = session.query(model.Job).filter_by(id=job_id).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    assert ops.purge_old_jobs(session) == [
+        '/results/1.model', '/results/1.prof'
+    ]
+
+
 def test_purge(session):
     job_id_1 = ops.create_new_job([], session)
     ops.finish_job(job_id_1, 'result', session)
@@ -120,7 +282,7 @@ def test_purge(session):
         hours=2)
     session.commit()
 
-    ops.purge_old_jobs(session)
+    assert ops.purge_old_jobs(session) == []
 
     jobs = session.query(model.Job).order_by(model.Job.modification_time).all()
 
@@ -156,3 +318,294 @@ def test_get_next_job(session):
 
     job = ops.get_next_job(session)
     assert job.id == job_id_3
+
+
+def test_purge_spooled(session):
+    job_id = ops.create_spooled_job('/path/to/job', 'ABCDEF', session)
+    ops.finish_job(job_id, 'result', session)
+    job = session.query(model.Job).filter_by(id=job_id).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+
+    ops.create_spooled_job('/path/to/unfinished', 'ABCDEF', session)
+
+    assert ops.purge_old_jobs(session) == ['/path/to/job']
+    assert session.query(model.Job).count() == 1
+
+
+def test_datasets_in_use(session):
+    job_id = ops.create_spooled_job(
+        '/path/to/job', 'A' * 64, session, datasets=['a' * 64, 'b' * 64])
+    ops.create_spooled_batch(
+        '/path/to/batch',
+        'B' * 64,
+        2,
+        session,
+        datasets=[['b' * 64], ['c' * 64]])
+    assert sorted(ops.datasets_in_use(session)) == ['a' * 64, 'b' * 64,
+                                                    'c' * 64]
+
+    ops.finish_job(job_id, 'result', session)
+    assert sorted(ops.datasets_in_use(session)) == ['b' * 64, 'c' * 64]
+
+    job = session.query(model.Job).filter_by(id=job_id).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    ops.purge_old_jobs(session)
+    assert session.query(model.DatasetReference).count() == 2
+
+
+def test_purge_shared_spool(session):
+    job_ids = ops.create_spooled_batch('/path/to/batch', 'ABCDEF', 2,
+                                       session)
+    ops.finish_job(job_ids[0], 'result', session)
+    job = session.query(model.Job).filter_by(id=job_ids[0]).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+
+    # The other job in the batch still needs the file.
+    assert ops.purge_old_jobs(session) == []
+
+    ops.finish_job(job_ids[1], 'result', session)
+    job = session.query(model.Job).filter_by(id=job_ids[1]).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    assert ops.purge_old_jobs(session) == ['/path/to/batch']
+
+
+def _age(job_id, session, hours):
+    job = session.query(model.Job).filter_by(id=job_id).first()
+    job.modification_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=hours)
+    session.commit()
+
+
+def test_purge_least_recently_used(session):
+    job_ids = []
+    for i in range(4):
+        job_id = ops.create_new_job([], session)
+        ops.finish_job(
+            job_id,
+            None,
+            session,
+            result_path='/path/to/result%d' % i,
+            result_size=100)
+        _age(job_id, session, 4 - i)
+        job_ids.append(job_id)
+
+    # Fetching a result makes it the most recently used.
+    ops.record_access([job_ids[0]], session)
+
+    assert ops.purge_old_jobs(
+        session, max_age=86400, max_jobs=3) == ['/path/to/result1']
+    assert ops.purge_old_jobs(
+        session, max_age=86400, max_result_bytes=250) == ['/path/to/result2']
+    remaining = {job.id for job in session.query(model.Job)}
+    assert remaining == {job_ids[0], job_ids[3]}
+
+    # The time-to-live is measured from the last use.
+    assert ops.purge_old_jobs(session, max_age=3600) == ['/path/to/result3']
+
+
+def test_purge_unfinished(session):
+    job_id_1 = ops.create_spooled_job('/path/to/abandoned', 'A' * 64,
+                                      session)
+    _age(job_id_1, session, 48)
+    job_id_2 = ops.create_spooled_job('/path/to/queued', 'B' * 64, session)
+    _age(job_id_2, session, 2)
+
+    assert ops.purge_old_jobs(session) == []
+    assert ops.purge_old_jobs(
+        session, max_unfinished_age=86400) == ['/path/to/abandoned']
+    assert [job.id for job in session.query(model.Job)] == [job_id_2]
+
+
+def test_purge_orphans(session):
+    job_id = ops.create_spooled_job('/path/to/job', 'A' * 64, session)
+    ops.finish_job(job_id, None, session, result_path='/path/to/result')
+
+    # SQLite does not enforce the foreign keys unless asked to.
+    session.query(model.Job).delete()
+    session.add(model.TrainingJob(job_id=None, training_job=b'{}'))
+    session.commit()
+
+    assert ops.purge_old_jobs(session) == ['/path/to/job', '/path/to/result']
+    assert session.query(model.TrainingJob).count() == 0
+    assert session.query(model.TrainingResult).count() == 0
+
+
+def test_purge_batches(session):
+    for i in range(5):
+        job_id = ops.create_spooled_job('/path/to/job%d' % i, 'A' * 64,
+                                        session)
+        ops.finish_job(job_id, 'result', session)
+        _age(job_id, session, 2)
+
+    assert ops.purge_old_jobs(
+        session, batch_size=2) == ['/path/to/job%d' % i for i in range(5)]
+    assert session.query(model.Job).count() == 0
+    assert session.query(model.TrainingJob).count() == 0
+
+
+def test_claim_next_job(session):
+    job_id_1 = ops.create_new_job([], session)
+    job_1 = session.query(model.Job).filter_by(id=job_id_1).first()
+    job_1.creation_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    job_id_2 = ops.create_new_job([], session)
+
+    job = ops.claim_next_job('worker-a', session)
+    assert job.id == job_id_1
+    assert job.claimed_by == 'worker-a'
+    assert job.state == model.JOB_RUNNING
+    assert abs(job.claim_time -
+               datetime.datetime.utcnow()) < datetime.timedelta(minutes=1)
+
+    job = ops.claim_next_job('worker-b', session)
+    assert job.id == job_id_2
+    assert job.claimed_by == 'worker-b'
+
+    assert ops.claim_next_job('worker-a', session) is None
+    assert ops.get_next_job(session) is None
+
+
+def test_claim_next_job_lost_race(session, monkeypatch):
+    job_id_1 = ops.create_new_job([], session)
+    job_1 = session.query(model.Job).filter_by(id=job_id_1).first()
+    job_1.creation_time = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=2)
+    session.commit()
+    job_id_2 = ops.create_new_job([], session)
+
+    # Another worker claims the first job between our SELECT and UPDATE.
+    get_next_job = ops.get_next_job
+
+    def racing_get_next_job(session):
+        job = get_next_job(session)
+        if job is not None and job.id == job_id_1:
+            session.query(model.Job).filter_by(id=job_id_1).update(
+                {
+                    'state': model.JOB_RUNNING,
+                    'claimed_by': 'worker-b'
+                },
+                synchronize_session=False)
+        return job
+
+    monkeypatch.setattr(ops, 'get_next_job', racing_get_next_job)
+    job = ops.claim_next_job('worker-a', session)
+    assert job.id == job_id_2
+    assert job.claimed_by == 'worker-a'
+
+
+def test_claim_next_job_skip_locked(session, monkeypatch):
+    # SQLite ignores FOR UPDATE, but this exercises the code path.
+    monkeypatch.setattr(ops, '_skip_locked_dialects', ('sqlite', ))
+    job_id = ops.create_new_job([], session)
+
+    job = ops.claim_next_job('worker-a', session)
+    assert job.id == job_id
+    assert job.state == model.JOB_RUNNING
+    assert job.claimed_by == 'worker-a'
+    assert ops.claim_next_job('worker-b', session) is None
+
+
+def test_finish_failed(session):
+    job_id = ops.create_new_job([], session)
+    ops.finish_job(job_id, 'traceback', session, failed=True)
+
+    job = session.query(model.Job).first()
+    assert job.finished == 1
+    assert job.state == model.JOB_FAILED
+    assert job.status == -1
+
+
+def test_requeue_stale_jobs(session):
+    job_id_1 = ops.create_new_job([], session)
+    job_id_2 = ops.create_new_job([], session)
+    ops.claim_next_job('worker-a', session)
+    ops.claim_next_job('worker-b', session)
+
+    # The second job has made no progress for a long time, but its worker
+    # is still alive.
+    two_hours_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    job_1 = session.query(model.Job).filter_by(id=job_id_1).first()
+    job_1.heartbeat_time = two_hours_ago
+    job_2 = session.query(model.Job).filter_by(id=job_id_2).first()
+    job_2.modification_time = two_hours_ago
+    session.commit()
+
+    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    assert ops.requeue_stale_jobs(cutoff_time, session) == (1, 0)
+
+    job_1 = session.query(model.Job).filter_by(id=job_id_1).first()
+    assert job_1.state == model.JOB_QUEUED
+    assert job_1.claimed_by is None
+    job_2 = session.query(model.Job).filter_by(id=job_id_2).first()
+    assert job_2.state == model.JOB_RUNNING
+
+
+def test_requeue_stale_jobs_attempts(session):
+    job_id = ops.create_new_job([], session)
+    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+
+    # The job kills each worker that claims it.
+    for attempt in range(3):
+        job = ops.claim_next_job('worker-%d' % attempt, session)
+        assert job.attempts == attempt + 1
+        job.heartbeat_time = cutoff_time - datetime.timedelta(hours=1)
+        session.commit()
+        expected = (1, 0) if attempt < 2 else (0, 1)
+        assert ops.requeue_stale_jobs(cutoff_time, session, 3) == expected
+
+    job = session.query(model.Job).filter_by(id=job_id).first()
+    assert job.state == model.JOB_FAILED
+    assert job.finished == 1
+    assert 'abandoned' in ops.get_results(job_id, session)
+    assert ops.claim_next_job('worker-3', session) is None
+
+
+def test_heartbeat(session):
+    job_id = ops.create_new_job([], session)
+    ops.claim_next_job('worker-a', session)
+    assert ops.heartbeat(job_id, 'worker-a', session)
+    assert not ops.heartbeat(job_id, 'worker-b', session)
+
+
+def test_finish_job_claimed(session):
+    job_id = ops.create_new_job([], session)
+    ops.claim_next_job('worker-a', session)
+    cutoff_time = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    ops.requeue_stale_jobs(cutoff_time, session)
+    ops.claim_next_job('worker-b', session)
+
+    # The first worker has lost the job to the second.
+    assert not ops.finish_job(
+        job_id, 'result', session, worker_name='worker-a')
+    assert ops.get_status(job_id, session).state == model.JOB_RUNNING
+    assert ops.finish_job(job_id, 'result', session, worker_name='worker-b')
+    assert ops.get_status(job_id, session).state == model.JOB_DONE
+    assert session.query(model.TrainingResult).count() == 1
+
+
+def test_update_statuses(session):
+    job_id_1 = ops.create_new_job([], session)
+    job_id_2 = ops.create_new_job([], session)
+    job_id_3 = ops.create_new_job([], session)
+    ops.finish_job(job_id_3, 'result', session)
+
+    ops.update_statuses({
+        job_id_1: 10.0,
+        job_id_2: 20.0,
+        job_id_3: 30.0
+    }, session)
+
+    assert ops.get_status(job_id_1, session).status == pytest.approx(10.0)
+    assert ops.get_status(job_id_2, session).status == pytest.approx(20.0)
+
+    # Finished jobs are left alone.
+    assert ops.get_status(job_id_3, session).status == 0.0
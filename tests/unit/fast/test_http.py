@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import rtrain.server_utils.http
+
+
+def blocking_application(barrier):
+    """A WSGI application whose requests all wait for each other."""
+
+    def application(environ, start_response):
+        barrier.wait(5)
+        start_response('200 OK', [('Content-Length', '2')])
+        return [b'ok']
+
+    return application
+
+
+def serve(servers):
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def stop(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def get_all(port, count):
+    """Make count concurrent requests, returning their bodies."""
+    bodies = []
+
+    def get():
+        with urllib.request.urlopen(
+                'http://127.0.0.1:%d/' % port, timeout=10) as response:
+            bodies.append(response.read())
+
+    threads = [threading.Thread(target=get) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return bodies
+
+
+def test_server_threads():
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', 0, blocking_application(threading.Barrier(3)), 3, 5)
+    serve([server])
+    try:
+        assert get_all(server.port, 3) == [b'ok'] * 3
+    finally:
+        stop([server])
+
+
+def test_server_socket():
+    sock = rtrain.server_utils.http.listen('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', port, blocking_application(threading.Barrier(1)), 1, 5,
+        sock)
+    serve([server])
+    try:
+        assert get_all(port, 1) == [b'ok']
+    finally:
+        stop([server])
+        sock.close()
+
+
+def waiting_application(event):
+    """A WSGI application whose requests to /wait wait for an event."""
+
+    def application(environ, start_response):
+        if environ['PATH_INFO'] == '/wait':
+            with rtrain.server_utils.http.waiting(environ):
+                event.wait(5)
+        start_response('200 OK', [('Content-Length', '2')])
+        return [b'ok']
+
+    return application
+
+
+def test_server_waiters():
+    event = threading.Event()
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', 0, waiting_application(event), 1, 5, waiters=1)
+    serve([server])
+    waiter = threading.Thread(
+        target=urllib.request.urlopen,
+        args=('http://127.0.0.1:%d/wait' % server.port, ),
+        kwargs={'timeout': 10})
+    waiter.start()
+    try:
+        # A waiting request leaves the only thread free for others.
+        time.sleep(0.2)
+        assert get_all(server.port, 1) == [b'ok']
+        assert waiter.is_alive()
+    finally:
+        event.set()
+        waiter.join()
+        stop([server])
+
+
+def test_server_unavailable():
+    event = threading.Event()
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', 0, waiting_application(event), 1, 5)
+    serve([server])
+    # With no room to wait, the request keeps the only thread busy.
+    waiter = threading.Thread(
+        target=urllib.request.urlopen,
+        args=('http://127.0.0.1:%d/wait' % server.port, ),
+        kwargs={'timeout': 10})
+    waiter.start()
+    try:
+        time.sleep(0.2)
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(
+                'http://127.0.0.1:%d/' % server.port, timeout=10)
+        assert e.value.code == 503
+        assert e.value.headers['Retry-After'] == '1'
+    finally:
+        event.set()
+        waiter.join()
+        stop([server])
+
+
+def test_server_timeout():
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', 0, blocking_application(threading.Barrier(1)), 1, 0.2)
+    serve([server])
+    try:
+        # A client that sends nothing is disconnected, freeing the thread.
+        with socket.create_connection(('127.0.0.1', server.port)) as idle:
+            idle.settimeout(10)
+            assert idle.recv(1) == b''
+        assert get_all(server.port, 1) == [b'ok']
+    finally:
+        stop([server])
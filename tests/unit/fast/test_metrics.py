@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+import time
+
+import pytest
+
+import rtrain.server_utils.metrics as metrics
+
+
+def test_counter():
+    registry = metrics.Registry()
+    counter = registry.counter('requests', 'Requests handled.',
+                               ('endpoint', ))
+    counter.inc(endpoint='ping')
+    counter.inc(2, endpoint='ping')
+    counter.inc(endpoint='say "hi"')
+
+    assert registry.render() == '\n'.join([
+        '# HELP requests Requests handled.', '# TYPE requests counter',
+        'requests_total{endpoint="ping"} 3.0',
+        'requests_total{endpoint="say \\"hi\\""} 1.0', ''
+    ])
+
+    with pytest.raises(ValueError):
+        counter.inc(-1, endpoint='ping')
+    with pytest.raises(ValueError):
+        counter.inc(method='GET')
+
+
+def test_gauge():
+    registry = metrics.Registry()
+    registry.gauge('temperature', 'Temperature.').set(20.5)
+    registry.gauge(
+        'jobs', 'Jobs.', ('state', ),
+        function=lambda: {('queued', ): 2, ('running', ): 1})
+    assert registry.render().splitlines()[2:] == [
+        'temperature 20.5', '# HELP jobs Jobs.', '# TYPE jobs gauge',
+        'jobs{state="queued"} 2.0', 'jobs{state="running"} 1.0'
+    ]
+
+
+def test_gauge_function_unlocked():
+    registry = metrics.Registry()
+    counter = registry.counter('queries', 'Queries.')
+
+    def count_jobs():
+        # Requests may record their metrics meanwhile.
+        assert not registry._lock.locked()
+        counter.inc()
+        return 3
+
+    def fail():
+        raise RuntimeError('The database is down.')
+
+    registry.gauge('jobs', 'Jobs.', function=count_jobs)
+    registry.gauge('broken', 'Broken.', function=fail)
+    assert registry.render().splitlines() == [
+        '# HELP queries Queries.', '# TYPE queries counter',
+        '# HELP jobs Jobs.', '# TYPE jobs gauge', 'jobs 3.0'
+    ]
+    assert counter._values == {(): 1}
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    histogram = registry.histogram('latency', 'Latency.', buckets=(1, 10))
+    histogram.observe(0.5)
+    histogram.observe(5)
+    histogram.observe(50)
+    with histogram.time():
+        pass
+
+    lines = registry.render().splitlines()[2:]
+    assert lines[:3] == [
+        'latency_bucket{le="1.0"} 2.0', 'latency_bucket{le="10.0"} 3.0',
+        'latency_bucket{le="+Inf"} 4.0'
+    ]
+    assert lines[3].startswith('latency_sum 55.5')
+    assert lines[4] == 'latency_count 4.0'
+
+
+def test_duplicate_metric():
+    registry = metrics.Registry()
+    registry.counter('requests', 'Requests handled.')
+    with pytest.raises(ValueError):
+        registry.gauge('requests', 'Requests handled.')
+
+
+def test_relay():
+    registry = metrics.Registry()
+    counter = registry.counter('jobs', 'Jobs finished.', ('state', ))
+    metrics_queue = queue.Queue()
+    threading.Thread(
+        target=metrics.relay, args=(metrics_queue, registry),
+        daemon=True).start()
+
+    # A worker process has its own copy of the registry.
+    worker_registry = metrics.Registry()
+    worker_counter = worker_registry.counter('jobs', 'Jobs finished.',
+                                             ('state', ))
+    worker_registry.forward(metrics_queue)
+    worker_counter.inc(state='done')
+    assert worker_counter._values == {}
+
+    deadline = time.time() + 10
+    while not counter._values and time.time() < deadline:
+        time.sleep(0.01)
+    assert counter._values == {('done', ): 1}
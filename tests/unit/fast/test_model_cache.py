@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import rtrain.server_utils.model_cache
+
+
+def test_model_key():
+    key = rtrain.server_utils.model_cache.model_key('{}', 'mse', 'sgd')
+    assert key == rtrain.server_utils.model_cache.model_key('{}', 'mse', 'sgd')
+    assert key != rtrain.server_utils.model_cache.model_key('{}', 'mse', 'adam')
+    assert rtrain.server_utils.model_cache.model_key('a', 'b', 'c') != \
+        rtrain.server_utils.model_cache.model_key('a', 'bc', '')
+
+
+def test_take_and_put():
+    cache = rtrain.server_utils.model_cache.ModelCache(100)
+    assert cache.take('a') is None
+    assert cache.put('a', 'model a', 40)
+    assert len(cache) == 1 and cache.size == 40
+
+    # A model is out of the cache while it is in use.
+    assert cache.take('a') == 'model a'
+    assert cache.take('a') is None
+    assert cache.size == 0
+
+    assert cache.put('a', 'model a', 40)
+    assert cache.put('a', 'new model a', 50)
+    assert len(cache) == 1 and cache.size == 50
+    assert cache.take('a') == 'new model a'
+
+
+def test_eviction():
+    cache = rtrain.server_utils.model_cache.ModelCache(100)
+    cache.put('a', 'model a', 40)
+    cache.put('b', 'model b', 40)
+    assert cache.take('a') == 'model a'
+    cache.put('a', 'model a', 40)
+
+    # The least recently used model is evicted first.
+    cache.put('c', 'model c', 40)
+    assert cache.take('b') is None
+    assert cache.size == 80
+
+    assert not cache.put('d', 'model d', 101)
+    assert cache.take('d') is None
+    assert cache.size == 80
+
+
+def test_disabled():
+    cache = rtrain.server_utils.model_cache.ModelCache(0)
+    assert not cache.put('a', 'model a', 1)
+    assert cache.take('a') is None
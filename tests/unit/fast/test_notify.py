@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+import rtrain.server_utils.config
+import rtrain.server_utils.notify as notify
+
+
+def make_config(database):
+    return rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nDatabase=%s" % database)
+
+
+def test_local_notifier_wakes_waiter():
+    notifier = notify.LocalNotifier()
+    woken = []
+
+    def waiter():
+        woken.append(notifier.wait(10))
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    start = time.time()
+    notifier.notify()
+    thread.join()
+
+    assert woken == [True]
+    assert time.time() - start < 5
+
+
+def test_local_notifier_remembers_notifications():
+    notifier = notify.LocalNotifier()
+    notifier.notify()
+    assert notifier.wait(0)
+    assert not notifier.wait(0)
+
+
+def test_polling_notifier():
+    notifier = notify.PollingNotifier()
+    notifier.notify()
+    assert not notifier.wait(0)
+
+
+def test_make_notifier():
+    local = notify.LocalNotifier()
+    config = make_config('sqlite:////tmp/rtraind.sqlite')
+    assert notify.make_notifier(config, local) is local
+    assert isinstance(
+        notify.make_notifier(config), notify.PollingNotifier)
+
+    config = make_config('postgresql+psycopg2://localhost/rtraind')
+    assert isinstance(
+        notify.make_notifier(config, local), notify.PostgresNotifier)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import rtrain.server_utils.model as model
+import rtrain.server_utils.model.database_operations as ops
+import rtrain.setup_db
+
+# The tables created by the first releases of rtraind.
+_old_schema = [
+    '''CREATE TABLE "Jobs" (
+        id CHAR(32) NOT NULL, creation_time TIMESTAMP,
+        modification_time TIMESTAMP, status REAL, finished INTEGER,
+        job_type VARCHAR(16), PRIMARY KEY (id))''',
+    '''CREATE TABLE "TrainingJobs" (
+        id INTEGER NOT NULL, job_id CHAR(32), training_job BLOB,
+        job_checksum CHAR(64), PRIMARY KEY (id),
+        FOREIGN KEY(job_id) REFERENCES "Jobs" (id) ON DELETE CASCADE)''',
+    '''CREATE TABLE "TrainingResults" (
+        id INTEGER NOT NULL, job_id CHAR(32), result_type VARCHAR(16),
+        result BLOB, PRIMARY KEY (id),
+        FOREIGN KEY(job_id) REFERENCES "Jobs" (id) ON DELETE CASCADE)''',
+]
+
+
+def test_add_missing_columns(tmpdir):
+    engine = sqlalchemy.create_engine('sqlite:///%s' % tmpdir.join('db'))
+    with engine.begin() as connection:
+        for statement in _old_schema:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO Jobs (id, status, finished, job_type) VALUES "
+            "('a', 0, 0, 'train'), ('b', 100, 1, 'train'), "
+            "('c', -1, 1, 'train')")
+
+    rtrain.setup_db.add_missing_columns(engine)
+    model.Base.metadata.create_all(engine)
+    # Running it again leaves an up to date database alone.
+    rtrain.setup_db.add_missing_columns(engine)
+
+    inspector = sqlalchemy.inspect(engine)
+    for table in model.Base.metadata.sorted_tables:
+        assert {c['name'] for c in inspector.get_columns(table.name)} == \
+            set(table.columns.keys())
+        assert {i['name'] for i in inspector.get_indexes(table.name)} == \
+            {i.name for i in table.indexes}
+
+    session = sqlalchemy.orm.Session(bind=engine)
+    assert dict(session.query(model.Job.id, model.Job.state)) == {
+        'a': model.JOB_QUEUED,
+        'b': model.JOB_DONE,
+        'c': model.JOB_FAILED
+    }
+    job = ops.claim_next_job('worker', session)
+    assert job.id == 'a'
+    assert job.attempts == 1
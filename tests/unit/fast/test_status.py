@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+import time
+
+import rtrain.server_utils.status as status
+
+
+def test_publish_and_get():
+    board = status.StatusBoard()
+    assert board.get('job') is None
+
+    board.publish('job', status=12.5, state='running')
+    board.publish('job', epoch={'epoch': 0, 'loss': 1.5})
+    entry = board.get('job')
+    assert entry['status'] == 12.5
+    assert entry['state'] == 'running'
+    assert not entry['finished']
+    assert entry['epochs'] == [{'epoch': 0, 'loss': 1.5}]
+
+
+def test_versions_increase():
+    board = status.StatusBoard()
+    board.publish('job-a', status=1)
+    version_a = board.get('job-a')['version']
+    board.publish('job-b', status=1)
+    board.publish('job-a', status=2)
+    assert board.get('job-a')['version'] > version_a
+
+
+def test_wait():
+    board = status.StatusBoard()
+    board.publish('job', status=1)
+    version = board.get('job')['version']
+
+    # Nothing has changed, so we time out.
+    start = time.time()
+    assert board.wait('job', version, 0.1)['version'] == version
+    assert time.time() - start >= 0.1
+
+    # An old version returns immediately.
+    assert board.wait('job', version - 1, 10)['version'] == version
+
+    def publish():
+        time.sleep(0.1)
+        board.publish('job', status=2)
+
+    threading.Thread(target=publish).start()
+    entry = board.wait('job', version, 10)
+    assert entry['status'] == 2
+
+    assert board.wait('unknown', 0, 0) is None
+
+
+def test_wait_any():
+    board = status.StatusBoard()
+    board.publish('a', status=1)
+    board.publish('b', status=1)
+    version = max(board.get('a')['version'], board.get('b')['version'])
+
+    assert not board.wait_any(['a', 'b', 'unknown'], version, 0.1)
+    assert board.wait_any(['a', 'b'], version - 1, 10)
+
+    def publish():
+        time.sleep(0.1)
+        board.publish('b', status=2)
+
+    threading.Thread(target=publish).start()
+    assert board.wait_any(['a', 'b'], version, 10)
+    assert board.get('b')['status'] == 2
+
+
+def test_prune():
+    board = status.StatusBoard()
+    board.publish('running', status=50)
+    board.publish('finished', finished=1)
+    board.prune(0)
+    assert board.get('running') is not None
+    assert board.get('finished') is None
+
+
+def test_relay():
+    board = status.StatusBoard()
+    status_queue = queue.Queue()
+    threading.Thread(
+        target=status.relay, args=(status_queue, board), daemon=True).start()
+
+    publisher = status.QueuePublisher(status_queue)
+    publisher.publish('job', status=5, epoch={'epoch': 0})
+    entry = board.wait('job', 0, 10)
+    assert entry['status'] == 5
+    assert entry['epochs'] == [{'epoch': 0}]
+
+
+def test_refresh():
+    board = status.StatusBoard()
+    board.refresh('job', status=0.0, finished=0, state='queued')
+    version = board.get('job')['version']
+
+    # Unchanged values do not change the version.
+    board.refresh('job', status=0.0, finished=0, state='queued')
+    assert board.get('job')['version'] == version
+
+    board.refresh('job', status=10.0, finished=0, state='running')
+    assert board.get('job')['version'] > version
+    assert board.get('job')['status'] == 10.0
+
+    # Nothing read from the database is written back.
+    assert board.take_dirty() == {}
+
+
+def test_take_dirty():
+    board = status.StatusBoard()
+    board.publish('job-a', status=1.0)
+    board.publish('job-a', status=2.0)
+    board.publish('job-b', state='running')
+    board.publish('job-c', status=3.0)
+
+    assert board.take_dirty() == {'job-a': 2.0, 'job-c': 3.0}
+    assert board.take_dirty() == {}
+
+
+def test_writer():
+    board = status.StatusBoard()
+    written = queue.Queue()
+    threading.Thread(
+        target=status.writer, args=(board, written.put, 0.01),
+        daemon=True).start()
+
+    board.publish('job', status=1.0)
+    board.publish('job', status=2.0)
+    assert written.get(timeout=10) == {'job': 2.0}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import os
+
+import numpy
+import pytest
+
+import rtrain.server_utils.storage as storage
+import rtrain.wire_format
+
+
+def test_spool_stream(tmpdir):
+    data = os.urandom(10000)
+    spooled = storage.spool_stream(
+        io.BytesIO(data), str(tmpdir.join('spool')), chunk_size=1000)
+
+    assert spooled.size == len(data)
+    assert spooled.checksum == hashlib.sha256(data).hexdigest().upper()
+    with open(spooled.path, 'rb') as f:
+        assert f.read() == data
+    assert bytes(storage.map_file(spooled.path)) == data
+
+    storage.remove_file(spooled.path)
+    assert not os.path.exists(spooled.path)
+    storage.remove_file(spooled.path)
+
+
+def test_map_empty_file(tmpdir):
+    spooled = storage.spool_stream(io.BytesIO(b''), str(tmpdir))
+    assert spooled.size == 0
+    assert bytes(storage.map_file(spooled.path)) == b''
+
+
+def encode(array):
+    encoded = rtrain.wire_format.EncodedArray(array)
+    return encoded.digest, b''.join(encoded)
+
+
+def test_dataset_store(tmpdir):
+    store = storage.DatasetStore(str(tmpdir), 1 << 20)
+    digest, data = encode(numpy.arange(100))
+
+    assert store.missing([digest]) == [digest]
+    store.add(digest, io.BytesIO(data))
+    assert store.missing([digest]) == []
+    loaded = store.load(digest)
+    assert storage.is_mapped(loaded)
+    numpy.testing.assert_array_equal(loaded, numpy.arange(100))
+
+
+def test_dataset_store_rejects_bad_data(tmpdir):
+    store = storage.DatasetStore(str(tmpdir), 1 << 20)
+    digest, data = encode(numpy.arange(100))
+
+    with pytest.raises(ValueError):
+        store.add(digest, io.BytesIO(data[:-1]))
+    with pytest.raises(ValueError):
+        store.add('0' * 64, io.BytesIO(data))
+    with pytest.raises(ValueError):
+        store.add('not a digest', io.BytesIO(data))
+
+    bad_digest = hashlib.sha256(b'not an array').hexdigest()
+    with pytest.raises(ValueError):
+        store.add(bad_digest, io.BytesIO(b'not an array'))
+
+    assert store.missing([digest, bad_digest]) == [digest, bad_digest]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_dataset_store_eviction(tmpdir):
+    store = storage.DatasetStore(str(tmpdir), 30000)
+    digests = []
+    for i in range(3):
+        digest, data = encode(numpy.full(1000, i))
+        store.add(digest, io.BytesIO(data))
+        os.utime(store.path(digest), (i, i))
+        digests.append(digest)
+
+    # The first array has been used most recently.
+    store.touch(digests[0])
+    digest, data = encode(numpy.full(1000, 3))
+    store.add(digest, io.BytesIO(data))
+
+    assert store.missing(digests) == [digests[1]]
+    assert store.missing([digest]) == []
+
+
+def test_dataset_store_keeps_in_use(tmpdir):
+    in_use = []
+    store = storage.DatasetStore(str(tmpdir), 30000, in_use=lambda: in_use)
+    digests = []
+    for i in range(3):
+        digest, data = encode(numpy.full(1000, i))
+        store.add(digest, io.BytesIO(data))
+        os.utime(store.path(digest), (i, i))
+        digests.append(digest)
+
+    # A queued job still needs the least recently used array.
+    in_use.append(digests[0])
+    digest, data = encode(numpy.full(1000, 3))
+    store.add(digest, io.BytesIO(data))
+
+    assert store.missing(digests) == [digests[1]]
+    assert store.missing([digest]) == []
+
+
+def test_is_mapped(tmpdir):
+    data = rtrain.wire_format.Container({}, [numpy.ones((10, 3))]).to_bytes()
+    path = str(tmpdir.join('container'))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    _, (array, ) = rtrain.wire_format.read_container(storage.map_file(path))
+    assert storage.is_mapped(array)
+    assert storage.is_mapped(array[2:5])
+
+    _, (array, ) = rtrain.wire_format.read_container(data)
+    assert not storage.is_mapped(array)
+    assert not storage.is_mapped(numpy.ones(3))
+
+
+def test_write_file(tmpdir):
+    path = str(tmpdir.join('results', 'result'))
+    storage.write_file(path, [b'abc', memoryview(b'def')])
+    with open(path, 'rb') as f:
+        assert f.read() == b'abcdef'
+
+    def failing_chunks():
+        yield b'123'
+        raise IOError()
+
+    with pytest.raises(IOError):
+        storage.write_file(path, failing_chunks())
+    with open(path, 'rb') as f:
+        assert f.read() == b'abcdef'
+    assert os.listdir(str(tmpdir.join('results'))) == ['result']
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import numpy
+
+import rtrain.server_utils.training
+
+
+def test_array_sequence():
+    x = numpy.arange(10).reshape(10, 1)
+    sequence = rtrain.server_utils.training.ArraySequence(x, 2 * x, 4)
+    assert len(sequence) == 3
+
+    for _ in range(2):
+        batches = [sequence[i] for i in range(len(sequence))]
+        assert sorted(len(bx) for bx, _ in batches) == [2, 4, 4]
+        numpy.testing.assert_array_equal(
+            numpy.sort(numpy.concatenate([bx for bx, _ in batches]), axis=0),
+            x)
+        for bx, by in batches:
+            numpy.testing.assert_array_equal(by, 2 * bx)
+        sequence.on_epoch_end()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+
+import numpy
+import pytest
+
+import rtrain.utils
+
+
+def test_no_keras_on_import():
+    # Clients, and rtraind until it trains a model, should start without
+    # waiting for Keras.
+    subprocess.check_call([
+        sys.executable, '-c', 'import sys, rtrain.client, rtrain.server; '
+        'assert "keras" not in sys.modules, "Keras was imported"; '
+        'assert "tensorflow" not in sys.modules, "TensorFlow was imported"'
+    ])
+
+
+def test_model_description():
+    weights = [
+        numpy.arange(6, dtype=numpy.float32).reshape(2, 3),
+        numpy.zeros(3, dtype=numpy.float64)
+    ]
+    model = rtrain.utils.ModelDescription('{"class_name": "Model"}', weights)
+    assert model.to_json() == '{"class_name": "Model"}'
+
+    data = rtrain.utils.serialize_model_binary(model, 'float16').to_bytes()
+    restored = rtrain.utils.deserialize_model_binary(data, keras_model=False)
+    assert isinstance(restored, rtrain.utils.ModelDescription)
+    assert restored.architecture == model.architecture
+    for a, b in zip(weights, restored.get_weights()):
+        assert b.dtype == a.dtype
+        assert b.flags.writeable
+        numpy.testing.assert_array_equal(a, b)
+
+    restored = rtrain.utils.deserialize_model(
+        rtrain.utils.model_container_to_json(data), keras_model=False)
+    for a, b in zip(weights, restored.get_weights()):
+        numpy.testing.assert_array_equal(a, b)
+
+    job = rtrain.utils.serialize_training_job(
+        model, 'mean_squared_error', 'sgd', numpy.ones((4, 2)),
+        numpy.ones((4, 3)), 1, 2)
+    assert job['architecture'] == model.architecture
+    assert len(job['weights']) == 2
+
+
+def test_transfer_precision():
+    x = numpy.array([1.0, -2.5, 3.14159, numpy.inf, numpy.nan, 1e-3])
+    to_precision = rtrain.utils.to_transfer_precision
+    from_precision = rtrain.utils.from_transfer_precision
+
+    half = to_precision(x, 'float16')
+    assert half.dtype == numpy.float16
+    restored = from_precision(half, 'float16', x.dtype)
+    assert restored.dtype == x.dtype
+    numpy.testing.assert_allclose(restored, x, rtol=1e-3)
+
+    bfloat = to_precision(x, 'bfloat16')
+    assert bfloat.dtype == numpy.uint16
+    restored = from_precision(bfloat, 'bfloat16', x.dtype)
+    assert restored.dtype == x.dtype
+    numpy.testing.assert_allclose(restored, x, rtol=1e-2)
+    assert restored[0] == 1.0 and restored[1] == -2.5
+
+    # Only floating-point arrays are cast.
+    labels = numpy.arange(5)
+    assert to_precision(labels, 'float16').dtype == labels.dtype
+
+    assert to_precision(numpy.eye(3), 'int8').dtype == numpy.int8
+    with pytest.raises(ValueError):
+        to_precision(numpy.array([0.5]), 'int8')
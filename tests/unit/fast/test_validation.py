@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import numpy
+
 import rtrain.validation
 
 
@@ -54,3 +56,136 @@ def test_validation():
             "batch_size": 1,
             "ham": False
         })
+
+
+def test_binary_validation():
+    request = {
+        "architecture": "",
+        "weights": [0, 1],
+        "loss": "mean_squared_error",
+        "optimizer": "rmsprop",
+        "x_train": 2,
+        "y_train": 3,
+        "x_train_shape": [3],
+        "y_train_shape": [3],
+        "epochs": 10,
+        "batch_size": 1
+    }
+    assert rtrain.validation.validate_binary_training_request(request)
+    assert not rtrain.validation.validate_training_request(request)
+
+    # Arrays must be referred to by index.
+    request["x_train"] = "more array"
+    assert not rtrain.validation.validate_binary_training_request(request)
+
+    request["x_train"] = -1
+    assert not rtrain.validation.validate_binary_training_request(request)
+
+
+def test_dataset_references():
+    request = {
+        "architecture": "",
+        "weights": ["yay_for_arrays"],
+        "loss": "mean_squared_error",
+        "optimizer": "rmsprop",
+        "x_train": {
+            "dataset": "0123456789abcdef" * 4
+        },
+        "y_train": "more array",
+        "x_train_shape": [3],
+        "y_train_shape": [3],
+        "epochs": 10,
+        "batch_size": 1
+    }
+    assert rtrain.validation.validate_training_request(request)
+
+    request["x_train"] = {"dataset": "not a digest"}
+    assert not rtrain.validation.validate_training_request(request)
+
+    request["x_train"] = {"dataset": "0123456789abcdef" * 4, "ham": False}
+    assert not rtrain.validation.validate_training_request(request)
+
+
+def test_transfer_precision():
+    request = {
+        "architecture": "",
+        "weights": [0],
+        "loss": "mean_squared_error",
+        "optimizer": "rmsprop",
+        "x_train": 1,
+        "y_train": 2,
+        "x_train_shape": [3],
+        "y_train_shape": [3],
+        "epochs": 10,
+        "batch_size": 1,
+        "precision": "bfloat16",
+        "label_precision": "int8",
+        "dtypes": {
+            "weights": ["<f4"],
+            "x_train": "<f8",
+            "y_train": "|u1"
+        }
+    }
+    assert rtrain.validation.validate_binary_training_request(request)
+
+    request["precision"] = "int8"
+    assert not rtrain.validation.validate_binary_training_request(request)
+
+    request["precision"] = "float16"
+    request["dtypes"]["x_train"] = "object"
+    assert not rtrain.validation.validate_binary_training_request(request)
+
+    # Without their dtypes, the arrays could not be restored.
+    del request["dtypes"]
+    assert not rtrain.validation.validate_binary_training_request(request)
+    del request["precision"]
+    assert not rtrain.validation.validate_binary_training_request(request)
+    del request["label_precision"]
+    assert rtrain.validation.validate_binary_training_request(request)
+
+
+def test_array_headers():
+    request = {
+        "architecture": "",
+        "weights": ["w"],
+        "loss": "mean_squared_error",
+        "optimizer": "rmsprop",
+        "x_train": "x",
+        "y_train": "y",
+        "x_train_shape": [3, 2],
+        "y_train_shape": [3],
+        "epochs": 10
+    }
+    headers = {
+        "w": ((2, ), numpy.dtype('<f4')),
+        "x": ((3, 2), numpy.dtype('<f8')),
+        "y": ((3, ), numpy.dtype('|u1'))
+    }
+
+    def header(value):
+        if value not in headers:
+            raise ValueError('Invalid array.')
+        return headers[value]
+
+    assert rtrain.validation.validate_array_headers(request, header)
+
+    # Arrays whose headers are not yet known are not checked.
+    assert rtrain.validation.validate_array_headers(request, lambda v: None)
+
+    # The training data must have the declared shapes.
+    headers["x"] = ((3, 3), numpy.dtype('<f8'))
+    assert not rtrain.validation.validate_array_headers(request, header)
+    headers["x"] = ((3, 2), numpy.dtype('<f8'))
+
+    # Arrays must be numeric.
+    headers["w"] = ((2, ), numpy.dtype('<U4'))
+    assert not rtrain.validation.validate_array_headers(request, header)
+    headers["w"] = ((2, ), numpy.dtype('<f4'))
+
+    request["weights"] = ["invalid"]
+    assert not rtrain.validation.validate_array_headers(request, header)
+    request["weights"] = ["w"]
+
+    # There must be a label for every sample.
+    request["y_train_shape"] = [4]
+    assert not rtrain.validation.validate_array_headers(request, lambda v: None)
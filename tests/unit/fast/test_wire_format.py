@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import base64
+import io
+
+import numpy
+import pytest
+
+import rtrain.wire_format
+
+
+def test_round_trip():
+    arrays = [
+        numpy.arange(12, dtype=numpy.float32).reshape(3, 4),
+        numpy.asfortranarray(numpy.random.randn(5, 2)),
+        numpy.zeros((0, 3), dtype=numpy.int8),
+    ]
+    container = rtrain.wire_format.Container({'job': {'foo': 'bar'}}, arrays)
+    data = container.to_bytes()
+    assert len(container) == len(data)
+    assert rtrain.wire_format.is_container(data)
+
+    header, decoded = rtrain.wire_format.read_container(data)
+    assert header['job'] == {'foo': 'bar'}
+    assert len(decoded) == len(arrays)
+    for original, result in zip(arrays, decoded):
+        assert result.dtype == original.dtype
+        numpy.testing.assert_array_equal(result, original)
+
+
+def test_arrays_are_views():
+    data = rtrain.wire_format.Container({}, [numpy.ones(1000)]).to_bytes()
+    _, (array, ) = rtrain.wire_format.read_container(data)
+    assert not array.flags.owndata
+    assert not array.flags.writeable
+
+
+def test_not_a_container():
+    assert not rtrain.wire_format.is_container(b'{"json": true}')
+    with pytest.raises(ValueError):
+        rtrain.wire_format.read_container(b'{"json": true}')
+
+
+def test_truncated():
+    data = rtrain.wire_format.Container({}, [numpy.ones(100)]).to_bytes()
+    with pytest.raises(ValueError):
+        rtrain.wire_format.read_container(data[:-8])
+    with pytest.raises(ValueError):
+        rtrain.wire_format.read_container(data + b'junk')
+
+
+def test_object_arrays_rejected():
+    with pytest.raises(ValueError):
+        rtrain.wire_format.Container(
+            {}, [numpy.array([None, 1], dtype=object)])
+
+
+def test_base64_header():
+    for array in [
+            numpy.arange(12, dtype=numpy.float32).reshape(3, 4),
+            numpy.zeros((0, 3), dtype=numpy.int8),
+            numpy.ones(7, dtype=numpy.float16),
+    ]:
+        f = io.BytesIO()
+        numpy.save(f, array)
+        s = str(base64.b64encode(f.getvalue()), 'ascii')
+        assert rtrain.wire_format.read_base64_npy_header(s) == (array.shape,
+                                                                array.dtype)
+
+        for invalid in [s[:-4], s + 'AAAA', s[:12], '', s[:20] + '!' + s[21:]]:
+            with pytest.raises(ValueError):
+                rtrain.wire_format.read_base64_npy_header(invalid)
@@ -1,21 +1,64 @@
 #!/usr/bin/env python3
 
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import pstats
+import sys
+import threading
+import time
+import types
+import urllib.request
+
 import flask
+import keras.layers
+import keras.models
+import numpy
 import pytest
+import sqlalchemy
 
+import rtrain.compression
 import rtrain.server
 import rtrain.server_utils
+import rtrain.server_utils.http
+import rtrain.server_utils.model
 import rtrain.server_utils.model.database_operations
+import rtrain.server_utils.model_cache
+import rtrain.server_utils.notify
+import rtrain.server_utils.status
+import rtrain.server_utils.training
 import rtrain.utils
+import rtrain.wire_format
+
+
+class NullSession(object):
+    """Stands in for the database session factory where none is used."""
+
+    def __call__(self):
+        return None
+
+    def remove(self):
+        pass
+
+
+def make_model(weights=None):
+    """Describe a model with an empty architecture, without Keras."""
+    if weights is None:
+        weights = [numpy.ones((2, 3)), numpy.zeros(3)]
+    return rtrain.utils.ModelDescription('{}', weights)
 
 
 @pytest.fixture
-def app():
+def app(tmpdir):
     return rtrain.server.create_app(rtrain.server_utils.config.RTrainConfig(
         """[rtraind]
         Database=
         Password=
-        """
+        DataDirectory=%s
+        DeduplicateJobs=false
+        """ % tmpdir
     ))
 
 
@@ -25,6 +68,19 @@ def test_ping(client):
     assert result.json == {}
 
 
+def test_metrics(client):
+    client.get(flask.url_for('rtraind.ping'))
+    result = client.get(flask.url_for('rtraind.request_metrics'))
+    assert result.status_code == 200
+    assert result.mimetype == 'text/plain'
+    lines = str(result.data, 'utf8').splitlines()
+    assert '# TYPE rtraind_http_request_duration_seconds histogram' in lines
+    assert any(
+        line.startswith('rtraind_http_requests_total{method="GET",'
+                        'endpoint="rtraind.ping",status="200"} ')
+        for line in lines)
+
+
 def test_train_badjson_fail(client, monkeypatch):
     result = client.post(
         flask.url_for('rtraind.request_training'),
@@ -44,25 +100,27 @@ def test_train_badrequest_success(client, monkeypatch):
 
 
 def test_train_success(client, monkeypatch):
-    def add_job(job_data, _):
-        assert job_data == {}
+    def add_job(path, checksum, _, datasets=()):
+        with open(path, 'rb') as f:
+            assert f.read() == b'{}'
+        assert checksum == hashlib.sha256(b'{}').hexdigest().upper()
         return '01234567890123456789012345678901'
 
-    monkeypatch.setattr('rtrain.server.Session', lambda: None)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
     monkeypatch.setattr('rtrain.server.extract_training_request', lambda x: {})
     monkeypatch.setattr(
-        'rtrain.server_utils.model.database_operations.create_new_job',
+        'rtrain.server_utils.model.database_operations.create_spooled_job',
         add_job)
     result = client.post(
         flask.url_for('rtraind.request_training'),
         data='{}',
         content_type='application/json')
     assert result.status_code == 200
-    assert result.data == add_job({}, None).encode('utf8')
+    assert result.data == b'01234567890123456789012345678901'
 
 
 def test_status_fail_badjob(client, monkeypatch):
-    monkeypatch.setattr('rtrain.server.Session', lambda: None)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
     monkeypatch.setattr(
         'rtrain.server_utils.model.database_operations.get_status',
         lambda x, y: None)
@@ -75,9 +133,11 @@ def test_status_success(client, monkeypatch):
     class Status(object):
         """Class to replace the SQLAlchemy model object."""
 
-        def __init__(self, status, finished):
+        def __init__(self, status, finished, state):
             self.status = status
             self.finished = finished
+            self.state = state
+            self.timings = None
 
         def test_func(self, test_job_id):
             """Return a stub function for get_status that checks job_id."""
@@ -89,32 +149,34 @@ def test_status_success(client, monkeypatch):
             return f
 
     # Stub out the database.
-    monkeypatch.setattr('rtrain.server.Session', lambda: None)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
 
     # Test with one value.
     monkeypatch.setattr(
         'rtrain.server_utils.model.database_operations.get_status',
-        Status(3.14159, False).test_func('a_real_id'))
+        Status(3.14159, False, 'running').test_func('a_real_id'))
     result = client.get(
         flask.url_for('rtraind.request_status', job_id='a_real_id'))
     assert result.status_code == 200
     assert result.json['status'] == 3.14159
     assert not result.json['finished']
+    assert result.json['state'] == 'running'
 
     # Test with another value to make sure it isn't just a constant function.
     monkeypatch.setattr(
         'rtrain.server_utils.model.database_operations.get_status',
-        Status(2.71, True).test_func('another_real_id'))
+        Status(2.71, True, 'done').test_func('another_real_id'))
     result = client.get(
         flask.url_for('rtraind.request_status', job_id='another_real_id'))
     assert result.status_code == 200
     assert result.json['status'] == 2.71
     assert result.json['finished']
+    assert result.json['state'] == 'done'
 
 
 def test_results_badjob(client, monkeypatch):
     # Stub out the database.
-    monkeypatch.setattr('rtrain.server.Session', lambda: None)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
 
     def get_check_job_id(desired_job_id):
         def check_job_id(job_id, _):
@@ -127,6 +189,9 @@ def test_results_badjob(client, monkeypatch):
     monkeypatch.setattr(
         'rtrain.server_utils.model.database_operations.get_results',
         get_check_job_id('not_a_real_id'), )
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_result_path',
+        get_check_job_id('not_a_real_id'), )
 
     result = client.get(
         flask.url_for('rtraind.request_result', job_id='not_a_real_id'))
@@ -136,7 +201,7 @@ def test_results_badjob(client, monkeypatch):
 
 def test_results_success(client, monkeypatch):
     # Stub out the database.
-    monkeypatch.setattr('rtrain.server.Session', lambda: None)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
 
     def perform_test(job_id, result):
         """Test /result/XXX in a way that should succeed."""
@@ -165,3 +230,921 @@ def test_results_success(client, monkeypatch):
     # sure it is really doing something.
     perform_test('the_first_real_id', "A result")
     perform_test('the_second_real_id', "Another result")
+
+
+def test_results_binary(client, monkeypatch, tmpdir):
+    model = keras.models.Sequential([keras.layers.Dense(3, input_shape=(2, ))])
+    path = str(tmpdir.join('1.model'))
+    with open(path, 'wb') as f:
+        f.write(rtrain.utils.serialize_model_binary(model).to_bytes())
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_results',
+        lambda job_id, session: None)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_result_path',
+        lambda job_id, session: path)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.record_access',
+        lambda job_ids, session: None)
+    url = flask.url_for('rtraind.request_result', job_id='1')
+
+    response = client.get(
+        url, headers={'Accept': rtrain.wire_format.MODEL_CONTENT_TYPE})
+    assert response.status_code == 200
+    assert response.mimetype == rtrain.wire_format.MODEL_CONTENT_TYPE
+    data = response.data
+    restored = rtrain.utils.deserialize_model_binary(data)
+    for a, b in zip(model.get_weights(), restored.get_weights()):
+        assert numpy.array_equal(a, b)
+
+    # An interrupted download can be resumed.
+    response = client.get(
+        url,
+        headers={
+            'Accept': rtrain.wire_format.MODEL_CONTENT_TYPE,
+            'Range': 'bytes=10-',
+            'If-Range': response.headers['ETag']
+        })
+    assert response.status_code == 206
+    assert response.data == data[10:]
+
+    # Compressed downloads are resumed in the compressed data.
+    response = client.get(
+        url,
+        headers={
+            'Accept': rtrain.wire_format.MODEL_CONTENT_TYPE,
+            'Accept-Encoding': 'gzip'
+        })
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    compressed = response.data
+    assert rtrain.compression.decompress(compressed, 'gzip') == data
+    response = client.get(
+        url,
+        headers={
+            'Accept': rtrain.wire_format.MODEL_CONTENT_TYPE,
+            'Accept-Encoding': 'gzip',
+            'Range': 'bytes=10-',
+            'If-Range': response.headers['ETag']
+        })
+    assert response.status_code == 206
+    assert response.data == compressed[10:]
+
+    # Other clients receive JSON.
+    response = client.get(url)
+    assert response.status_code == 200
+    restored = rtrain.utils.deserialize_model(str(response.data, 'utf8'))
+    for a, b in zip(model.get_weights(), restored.get_weights()):
+        assert numpy.array_equal(a, b)
+
+
+def test_train_binary_success(client, monkeypatch):
+    container = rtrain.utils.serialize_training_job_binary(
+        make_model(), 'mean_squared_error', 'rmsprop', numpy.ones((10, 2)),
+        numpy.ones((10, 3)), 1, 5)
+
+    def add_job(path, checksum, _, datasets=()):
+        with open(path, 'rb') as f:
+            assert f.read() == container.to_bytes()
+        return '01234567890123456789012345678901'
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_job',
+        add_job)
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=container.to_bytes(),
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 200
+
+    job = rtrain.server.load_training_request(container.to_bytes())
+    assert job['epochs'] == 1
+    numpy.testing.assert_array_equal(job['weights'][0], numpy.ones((2, 3)))
+    numpy.testing.assert_array_equal(job['y_train'], numpy.ones((10, 3)))
+
+
+def test_train_batch(client, monkeypatch):
+    x = numpy.random.randn(10, 2)
+    y = numpy.random.randn(10, 3)
+    jobs = [
+        dict(
+            model=make_model(),
+            loss='mean_squared_error',
+            optimizer=optimizer,
+            x_train=x,
+            y_train=y,
+            epochs=1,
+            batch_size=5) for optimizer in ('rmsprop', 'adam', 'sgd')
+    ]
+    container = rtrain.utils.serialize_training_batch_binary(jobs)
+    # The training data is sent only once.
+    assert len(container.arrays) == 3 * 2 + 2
+
+    def add_jobs(path,
+                 checksum,
+                 count,
+                 _,
+                 indices=None,
+                 datasets=None,
+                 paths=None):
+        if paths is None:
+            with open(path, 'rb') as f:
+                assert f.read() == container.to_bytes()
+        else:
+            # The jobs of a JSON batch are each stored on their own.
+            assert not os.path.exists(path)
+            assert len(paths) == count
+            for path, optimizer in zip(paths, ('rmsprop', 'adam', 'sgd')):
+                with open(path, 'rb') as f:
+                    job = rtrain.server.load_training_request(f.read())
+                assert job['optimizer'] == optimizer
+        return ['job%d' % i for i in range(count)]
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_batch',
+        add_jobs)
+    result = client.post(
+        flask.url_for('rtraind.request_training_batch'),
+        data=container.to_bytes(),
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 200
+    assert json.loads(result.data) == ['job0', 'job1', 'job2']
+
+    job = rtrain.server.load_training_request(container.to_bytes(), 2)
+    assert job['optimizer'] == 'sgd'
+    numpy.testing.assert_array_equal(job['x_train'], x)
+    assert rtrain.server.load_training_request(container.to_bytes(),
+                                               3) is None
+
+    json_batch = json.loads(
+        json.dumps(rtrain.utils.serialize_training_batch(jobs)))
+    data = json.dumps(json_batch).encode('utf8')
+    job = rtrain.server.load_training_request(data, 1)
+    assert job['optimizer'] == 'adam'
+
+    result = client.post(
+        flask.url_for('rtraind.request_training_batch'),
+        data=data,
+        content_type='application/json')
+    assert result.status_code == 200
+    assert json.loads(result.data) == ['job0', 'job1', 'job2']
+
+    # A single job is not a batch.
+    result = client.post(
+        flask.url_for('rtraind.request_training_batch'),
+        data=rtrain.utils.serialize_training_job_binary(**jobs[0]).to_bytes(),
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 400
+
+
+def test_train_duplicate(client, monkeypatch):
+    jobs = [
+        dict(
+            model=make_model([numpy.ones((2, 3))]),
+            loss='mean_squared_error',
+            optimizer=optimizer,
+            x_train=numpy.ones((4, 2)),
+            y_train=numpy.ones((4, 3)),
+            epochs=1,
+            batch_size=2) for optimizer in ('rmsprop', 'adam', 'sgd')
+    ]
+    job = rtrain.utils.serialize_training_job_binary(**jobs[0]).to_bytes()
+    batch = rtrain.utils.serialize_training_batch_binary(jobs).to_bytes()
+    batch_checksums = rtrain.server_utils.model.database_operations.\
+        batch_checksums(hashlib.sha256(batch).hexdigest().upper(), 3)
+    existing = {
+        hashlib.sha256(job).hexdigest().upper(): 'existing_job',
+        batch_checksums[1]: 'existing_batch_job'
+    }
+
+    def find_duplicate_jobs(checksums, max_age, _):
+        assert max_age == rtrain.server.result_retention
+        return {c: existing[c] for c in checksums if c in existing}
+
+    def add_jobs(path,
+                 checksum,
+                 count,
+                 _,
+                 indices=None,
+                 datasets=None,
+                 paths=None):
+        assert count == 3
+        assert indices == [0, 2]
+        return ['new_job_0', 'new_job_2']
+
+    def add_job(*_):
+        raise AssertionError('A duplicate job was created.')
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    accessed = []
+    monkeypatch.setattr('rtrain.server.deduplicate_jobs', True)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.record_access',
+        lambda job_ids, _: accessed.extend(job_ids))
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.find_duplicate_jobs',
+        find_duplicate_jobs)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_job',
+        add_job)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_batch',
+        add_jobs)
+
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=job,
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 200
+    assert result.data == b'existing_job'
+
+    result = client.post(
+        flask.url_for('rtraind.request_training_batch'),
+        data=batch,
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 200
+    assert json.loads(
+        result.data) == ['new_job_0', 'existing_batch_job', 'new_job_2']
+    assert accessed == ['existing_job', 'existing_batch_job']
+
+
+def test_bulk_status(client, monkeypatch):
+    class Status(object):
+        def __init__(self, status, finished, state):
+            self.status = status
+            self.finished = finished
+            self.state = state
+            self.timings = None
+
+    def get_statuses(job_ids, _):
+        assert sorted(job_ids) == ['bulk_a', 'bulk_b', 'bulk_c']
+        return {
+            'bulk_a': Status(10.0, 0, 'running'),
+            'bulk_b': Status(100.0, 1, 'done')
+        }
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_statuses',
+        get_statuses)
+    result = client.get(
+        flask.url_for('rtraind.request_statuses'),
+        query_string={'ids': 'bulk_a,bulk_b,bulk_c'})
+    assert result.status_code == 200
+    jobs = json.loads(result.data)['jobs']
+    assert jobs['bulk_a']['status'] == 10.0
+    assert jobs['bulk_b']['finished']
+    assert jobs['bulk_b']['state'] == 'done'
+    assert jobs['bulk_c'] is None
+
+    result = client.get(flask.url_for('rtraind.request_statuses'))
+    assert result.status_code == 400
+
+
+def test_find_jobs(client, monkeypatch):
+    def find_jobs(checksums, max_age, _):
+        assert max_age == 120
+        return {c: 'job_' + c[0] for c in checksums if c.startswith('A')}
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.find_jobs', find_jobs)
+    result = client.post(
+        flask.url_for('rtraind.request_find_jobs'),
+        json={
+            'checksums': ['A' * 64, 'B' * 64],
+            'max_age': 120
+        })
+    assert result.status_code == 200
+    assert json.loads(result.data) == {'jobs': {'A' * 64: 'job_A'}}
+
+    result = client.post(
+        flask.url_for('rtraind.request_find_jobs'),
+        json={'checksums': ['not a checksum']})
+    assert result.status_code == 400
+
+
+def test_train_compressed(client, monkeypatch):
+    container = rtrain.utils.serialize_training_job_binary(
+        make_model(), 'mean_squared_error', 'rmsprop', numpy.ones((10, 2)),
+        numpy.ones((10, 3)), 1, 5)
+
+    def add_job(path, checksum, _, datasets=()):
+        with open(path, 'rb') as f:
+            assert f.read() == container.to_bytes()
+        return '01234567890123456789012345678901'
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_job',
+        add_job)
+
+    result = client.get(flask.url_for('rtraind.ping'))
+    assert 'gzip' in result.headers['Accept-Encoding']
+
+    compressed = b''.join(rtrain.compression.compress(container, 'gzip'))
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=compressed,
+        content_type=rtrain.wire_format.CONTENT_TYPE,
+        headers={'Content-Encoding': 'gzip'})
+    assert result.status_code == 200
+
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=compressed[:-10],
+        content_type=rtrain.wire_format.CONTENT_TYPE,
+        headers={'Content-Encoding': 'gzip'})
+    assert result.status_code == 400
+
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=compressed,
+        content_type=rtrain.wire_format.CONTENT_TYPE,
+        headers={'Content-Encoding': 'unknown'})
+    assert result.status_code == 415
+    assert 'gzip' in result.headers['Accept-Encoding']
+
+
+def test_train_binary_badrequest(client, monkeypatch):
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data=b'RTRAIN not really',
+        content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 400
+
+
+def test_datasets(client):
+    encoded = rtrain.wire_format.EncodedArray(numpy.arange(10))
+    result = client.post(
+        flask.url_for('rtraind.request_missing_datasets'),
+        json={'datasets': [encoded.digest]})
+    assert result.status_code == 200
+    assert json.loads(result.data) == {'missing': [encoded.digest]}
+
+    result = client.put(
+        flask.url_for('rtraind.request_upload_dataset', digest='0' * 64),
+        data=b''.join(encoded))
+    assert result.status_code == 400
+
+    result = client.put(
+        flask.url_for('rtraind.request_upload_dataset', digest=encoded.digest),
+        data=b''.join(encoded))
+    assert result.status_code == 200
+
+    result = client.post(
+        flask.url_for('rtraind.request_missing_datasets'),
+        json={'datasets': [encoded.digest]})
+    assert json.loads(result.data) == {'missing': []}
+
+
+def test_train_missing_dataset(client, monkeypatch):
+    monkeypatch.setattr('rtrain.server.extract_training_request',
+                        lambda x: {
+                            'weights': [],
+                            'x_train': {'dataset': 'a' * 64},
+                            'y_train': 'more array'
+                        })
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data='{}',
+        content_type='application/json')
+    assert result.status_code == 409
+    assert result.get_json() == {'missing': ['a' * 64]}
+
+
+def test_train_records_datasets(client, monkeypatch):
+    encoded = rtrain.wire_format.EncodedArray(numpy.arange(10))
+    result = client.put(
+        flask.url_for('rtraind.request_upload_dataset', digest=encoded.digest),
+        data=b''.join(encoded))
+    assert result.status_code == 200
+
+    created = []
+
+    def add_job(path, checksum, _, datasets=()):
+        created.append(datasets)
+        return '01234567890123456789012345678901'
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr('rtrain.server.extract_training_request',
+                        lambda x: {
+                            'weights': [],
+                            'x_train': {'dataset': encoded.digest},
+                            'y_train': {'dataset': encoded.digest}
+                        })
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.create_spooled_job',
+        add_job)
+    result = client.post(
+        flask.url_for('rtraind.request_training'),
+        data='{}',
+        content_type='application/json')
+    assert result.status_code == 200
+    assert created == [[encoded.digest]]
+
+
+def test_events(client, monkeypatch):
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    board = rtrain.server.status_board
+    board.publish('a_real_id', status=50.0, state='running')
+    board.publish('a_real_id', epoch={'epoch': 0, 'loss': 0.25})
+    board.publish('a_real_id', status=100.0, finished=1, state='done')
+
+    result = client.get(
+        flask.url_for('rtraind.request_events', job_id='a_real_id'))
+    assert result.status_code == 200
+    assert result.mimetype == 'text/event-stream'
+
+    events = [
+        dict(line.split(': ', 1) for line in block.split('\n'))
+        for block in str(result.data, 'utf8').split('\n\n') if block
+    ]
+    assert [e['event'] for e in events] == ['epoch', 'status']
+    assert json.loads(events[0]['data']) == {'epoch': 0, 'loss': 0.25}
+    assert json.loads(events[1]['data']) == {
+        'status': 100.0,
+        'finished': 1,
+        'state': 'done'
+    }
+
+
+def test_events_badjob(client, monkeypatch):
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_status',
+        lambda x, y: None)
+    result = client.get(
+        flask.url_for('rtraind.request_events', job_id='not_a_real_id'))
+    assert result.status_code == 404
+
+
+def test_status_long_poll(client, monkeypatch):
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    board = rtrain.server.status_board
+    board.publish('a_real_id', status=50.0, state='running')
+    version = board.get('a_real_id')['version']
+
+    # An old version is answered immediately.
+    result = client.get(
+        flask.url_for(
+            'rtraind.request_status',
+            job_id='a_real_id',
+            wait=30,
+            since=version - 1))
+    assert json.loads(result.data)['version'] == version
+
+    def publish():
+        time.sleep(0.2)
+        board.publish('a_real_id', status=75.0)
+
+    threading.Thread(target=publish).start()
+    start = time.time()
+    result = client.get(
+        flask.url_for(
+            'rtraind.request_status',
+            job_id='a_real_id',
+            wait=30,
+            since=version))
+    assert result.status_code == 200
+    assert time.time() - start < 10
+
+    status = json.loads(result.data)
+    assert status['status'] == 75.0
+    assert status['version'] > version
+
+
+def test_status_long_poll_server(app, monkeypatch):
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    board = rtrain.server.status_board
+    board.publish('a_real_id', status=50.0, state='running')
+    version = board.get('a_real_id')['version']
+
+    server = rtrain.server_utils.http.Server(
+        '127.0.0.1', 0, app, 1, 5, waiters=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d' % server.port
+    statuses = []
+
+    def long_poll():
+        with urllib.request.urlopen(
+                '%s/status/a_real_id?wait=30&since=%d' % (url, version),
+                timeout=30) as response:
+            statuses.append(json.loads(response.read()))
+
+    poller = threading.Thread(target=long_poll)
+    poller.start()
+    try:
+        # The long poll leaves the server's only thread free for others.
+        time.sleep(0.5)
+        with urllib.request.urlopen(url + '/ping', timeout=10) as response:
+            assert response.status == 200
+        assert poller.is_alive()
+    finally:
+        board.publish('a_real_id', status=75.0)
+        poller.join()
+        server.shutdown()
+        server.server_close()
+    assert statuses[0]['status'] == 75.0
+
+
+def test_train_binary_precision():
+    model = make_model([numpy.ones((2, 3), dtype=numpy.float32)])
+    x = numpy.random.randn(10, 2)
+    y = numpy.eye(10)[:, :3]
+    container = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'rmsprop', x, y, 1, 5,
+        precision='bfloat16', label_precision='int8')
+    plain = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'rmsprop', x, y, 1, 5)
+    assert len(container) < len(plain)
+
+    job = rtrain.server.load_training_request(container.to_bytes())
+    assert job is not None
+    assert job['dtypes'] == {
+        'weights': ['<f4'],
+        'x_train': '<f8',
+        'y_train': '<f8'
+    }
+    assert job['x_train'].dtype == numpy.uint16
+    assert job['y_train'].dtype == numpy.int8
+    assert rtrain.utils.label_precision(job) == 'int8'
+
+    x_train = rtrain.server._training_array(job['x_train'], 'bfloat16',
+                                            job['dtypes']['x_train'])
+    assert x_train.dtype == numpy.float32
+    numpy.testing.assert_allclose(x_train, x, rtol=1e-2)
+
+    job = rtrain.utils.serialize_training_job(
+        model, 'mean_squared_error', 'rmsprop', x, y, 1, 5,
+        precision='float16')
+    assert rtrain.server.extract_training_request(
+        json.loads(json.dumps(job))) is not None
+    assert rtrain.utils.deserialize_array(job['x_train']).dtype == \
+        numpy.float16
+
+
+def test_array_headers():
+    model = make_model([numpy.ones((2, 3), dtype=numpy.float32)])
+    x = numpy.random.randn(10, 2)
+    y = numpy.random.randn(10, 3)
+    job = json.loads(
+        json.dumps(
+            rtrain.utils.serialize_training_job(
+                model, 'mean_squared_error', 'rmsprop', x, y, 1, 5)))
+    assert rtrain.server.extract_training_request(dict(job)) is not None
+
+    job['x_train'] = rtrain.utils.serialize_array(x[:9])
+    assert rtrain.server.extract_training_request(dict(job)) is None
+    job['x_train'] = job['x_train'][:-8]
+    assert rtrain.server.extract_training_request(dict(job)) is None
+
+    container = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'rmsprop', x, y, 1, 5)
+    header, arrays = rtrain.wire_format.read_container(container.to_bytes())
+    header['job']['y_train_shape'] = [10, 4]
+    data = rtrain.wire_format.Container(header, arrays).to_bytes()
+    assert rtrain.server.extract_binary_training_request(data) is None
+
+    # Jobs validated on submission are only decoded when they are run.
+    job = rtrain.server.load_training_request(data)
+    assert job['y_train'].shape == (10, 3)
+
+
+def test_model_binary_precision():
+    model = keras.models.Sequential(
+        [keras.layers.Dense(100, input_shape=(100, ))])
+    container = rtrain.utils.serialize_model_binary(model, 'float16')
+    assert len(container) < len(rtrain.utils.serialize_model_binary(model))
+
+    restored = rtrain.utils.deserialize_model_binary(container.to_bytes())
+    for a, b in zip(model.get_weights(), restored.get_weights()):
+        assert b.dtype == a.dtype
+        numpy.testing.assert_allclose(a, b, rtol=1e-3, atol=1e-4)
+
+
+def test_execute_training_request_timings():
+    model = keras.models.Sequential(
+        [keras.layers.Dense(3, input_shape=(2, ))])
+    container = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'sgd', numpy.random.randn(20, 2),
+        numpy.random.randn(20, 3), 2, 5, profile='cprofile')
+    job = rtrain.server.load_training_request(container.to_bytes())
+    assert job['profile'] == 'cprofile'
+
+    board = rtrain.server_utils.status.StatusBoard()
+    timings = rtrain.server.new_timings()
+    callback = rtrain.server_utils.training.StatusCallback(
+        'job', board, timings)
+    result = rtrain.server.execute_training_request(job, callback, timings)
+
+    phases = ('model_from_json', 'compile', 'set_weights', 'decode', 'fit',
+              'serialize_model')
+    assert set(timings['phases']) == set(phases)
+    assert all(t >= 0 for t in timings['phases'].values())
+    assert len(timings['samples_per_second']) == 2
+    assert board.get('job')['timings']['samples_per_second'] == \
+        timings['samples_per_second']
+    assert all('samples_per_second' in e for e in board.get('job')['epochs'])
+
+    # The result carries the timings up to the end of training.
+    header, _ = rtrain.wire_format.read_container(result.to_bytes())
+    assert set(header['timings']['phases']) == set(phases[:-1])
+
+
+def test_model_cache(monkeypatch):
+    model = keras.models.Sequential(
+        [keras.layers.Dense(3, input_shape=(2, ))])
+    x = numpy.random.randn(20, 2)
+    y = numpy.random.randn(20, 3)
+    data = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'adam', x, y, 5, 20).to_bytes()
+
+    def train():
+        timings = rtrain.server.new_timings()
+        result = rtrain.server.execute_training_request(
+            rtrain.server.load_training_request(data), keras.callbacks.
+            Callback(), timings)
+        _, weights = rtrain.wire_format.read_container(result.to_bytes())
+        return weights, set(timings['phases'])
+
+    uncached_weights, _ = train()
+
+    cache = rtrain.server_utils.model_cache.ModelCache(1 << 20)
+    monkeypatch.setattr('rtrain.server.model_cache', cache)
+    weights, phases = train()
+    assert 'compile' in phases
+    assert len(cache) == 1
+
+    # A cached model is reused with fresh weights and optimizer state, so
+    # that it trains exactly as a new one would.
+    cached_weights, phases = train()
+    assert 'compile' not in phases and 'reset_optimizer' in phases
+    for a, b, c in zip(uncached_weights, weights, cached_weights):
+        numpy.testing.assert_allclose(a, b, rtol=1e-5)
+        numpy.testing.assert_allclose(a, c, rtol=1e-5)
+    assert len(cache) == 1
+
+
+def test_supervise_trainers(monkeypatch):
+    monkeypatch.setattr('rtrain.server.trainer_restart_delay', 0)
+    context = multiprocessing.get_context('spawn')
+    reasons = []
+
+    def start_worker(reason, target=time.sleep, args=(60, ), retire=False):
+        reasons.append(reason)
+        connection, retiring = context.Pipe(duplex=False)
+        worker = context.Process(target=target, args=args, daemon=True)
+        worker.start()
+        if retire:
+            retiring.send('retiring')
+        retiring.close()
+        return worker, connection
+
+    # One worker retires, one fails and one carries on.
+    workers = [
+        start_worker('start', retire=True),
+        start_worker('start', sys.exit, (3, )),
+        start_worker('start')
+    ]
+    retired = workers[0][0]
+    threading.Thread(
+        target=rtrain.server.supervise_trainers,
+        args=(workers, start_worker),
+        daemon=True).start()
+
+    # Replacements are recorded as they are started, before they take the
+    # place of the workers that they replace.
+    deadline = time.time() + 60
+    while (len(reasons) < 5 or not all(w.is_alive() for w, _ in workers)) \
+            and time.time() < deadline:
+        time.sleep(0.1)
+    assert sorted(reasons[3:]) == ['failure', 'recycle']
+    assert all(w.is_alive() for w, _ in workers)
+
+    # A retiring worker is replaced before it exits.
+    assert retired.is_alive()
+    for worker in [retired] + [w for w, _ in workers]:
+        worker.terminate()
+
+
+def test_warm_up():
+    rtrain.server.warm_up()
+    assert rtrain.server._resident_bytes() > 0
+    assert rtrain.server._available_cores() >= 1
+
+
+def test_profile(client, monkeypatch, tmpdir):
+    path = str(tmpdir.join('job.prof'))
+    with rtrain.server._profiled('cprofile', path):
+        sum(range(1000))
+    pstats.Stats(path)
+
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_profile_path',
+        lambda job_id, _: path if job_id == 'job' else None)
+    result = client.get(flask.url_for('rtraind.request_profile', job_id='job'))
+    assert result.status_code == 200
+    with open(path, 'rb') as f:
+        assert result.data == f.read()
+
+    result = client.get(
+        flask.url_for('rtraind.request_profile', job_id='other'))
+    assert result.status_code == 404
+
+
+def test_status_long_poll_database(client, monkeypatch):
+    # The job is being run by a trainer in another process, which only
+    # reports its progress through the database.
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    monkeypatch.setattr('rtrain.server.status_refresh_interval', 0.1)
+    monkeypatch.setattr('rtrain.server.Session', NullSession())
+    status = types.SimpleNamespace(
+        status=50.0, finished=0, state='running', timings=None)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_status',
+        lambda x, y: status)
+    monkeypatch.setattr(
+        'rtrain.server_utils.model.database_operations.get_statuses',
+        lambda x, y: {job_id: status for job_id in x})
+    board = rtrain.server.status_board
+    board.refresh('a_real_id', status=50.0, finished=0, state='running')
+    version = board.get('a_real_id')['version']
+
+    def finish():
+        time.sleep(0.5)
+        status.status = 75.0
+
+    threading.Thread(target=finish).start()
+    start = time.time()
+    result = client.get(
+        flask.url_for(
+            'rtraind.request_status',
+            job_id='a_real_id',
+            wait=30,
+            since=version))
+    assert result.status_code == 200
+    assert time.time() - start < 10
+    assert json.loads(result.data)['status'] == 75.0
+
+
+def test_max_request_bytes(tmpdir):
+    app = rtrain.server.create_app(
+        rtrain.server_utils.config.RTrainConfig(
+            "[rtraind]\nDataDirectory=%s\nMaxRequestBytes=100" % tmpdir))
+    with app.test_request_context():
+        url = flask.url_for('rtraind.request_training')
+    result = app.test_client().post(
+        url, data='{}' + ' ' * 100, content_type='application/json')
+    assert result.status_code == 413
+
+    # The limit applies to the body once it has been decompressed.
+    body = b''.join(rtrain.compression.compress([b'{}' + b' ' * 1000],
+                                                'gzip'))
+    assert len(body) < 100
+    result = app.test_client().post(
+        url,
+        data=body,
+        content_type='application/json',
+        headers={'Content-Encoding': 'gzip'})
+    assert result.status_code == 413
+    assert os.listdir(rtrain.server.spool_directory) == []
+
+
+def test_make_app(tmpdir, monkeypatch):
+    config_path = tmpdir.join('rtraind.conf')
+    config_path.write("[rtraind]\nDatabase=sqlite:///%s\nDataDirectory=%s\n"
+                      "MaxRequestBytes=1000" % (tmpdir.join('db'), tmpdir))
+    monkeypatch.setenv('RTRAIND_CONFIG', str(config_path))
+    app = rtrain.server.make_app()
+    assert app.config['MAX_CONTENT_LENGTH'] == 1000
+    assert app.test_client().get('/ping').status_code == 200
+
+
+def test_trainer_database(tmpdir, monkeypatch):
+    # Run one job from submission to result against a real database.
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nDatabase=sqlite:///%s\nDataDirectory=%s\n" %
+        (tmpdir.join('db.sqlite'), tmpdir))
+    rtrain.server_utils.model.Base.metadata.create_all(
+        sqlalchemy.create_engine(config.db_string))
+    monkeypatch.setattr('rtrain.server.Session', None)
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    rtrain.server.prepare_database(config)
+    app = rtrain.server.create_app(config)
+
+    model = keras.models.Sequential(
+        [keras.layers.Dense(3, input_shape=(2, ))])
+    data = rtrain.utils.serialize_training_job_binary(
+        model, 'mean_squared_error', 'sgd', numpy.random.randn(20, 2),
+        numpy.random.randn(20, 3), 2, 10).to_bytes()
+    client = app.test_client()
+    result = client.post(
+        '/train', data=data, content_type=rtrain.wire_format.CONTENT_TYPE)
+    assert result.status_code == 200
+    job_id = str(result.data, 'ascii')
+
+    rtrain.server.trainer(
+        'worker',
+        rtrain.server_utils.notify.PollingNotifier(),
+        1,
+        rtrain.server.status_board,
+        max_jobs=1)
+
+    session = rtrain.server.Session()
+    status = rtrain.server_utils.model.database_operations.get_status(
+        job_id, session)
+    assert status.state == rtrain.server_utils.model.JOB_DONE
+    path = rtrain.server_utils.model.database_operations.get_result_path(
+        job_id, session)
+    assert path == os.path.join(rtrain.server.result_directory,
+                                job_id + '.model')
+    rtrain.server.Session.remove()
+
+    result = client.get(
+        '/result/%s' % job_id,
+        headers={'Accept': rtrain.wire_format.MODEL_CONTENT_TYPE})
+    assert result.status_code == 200
+    _, weights = rtrain.wire_format.read_container(result.data)
+    assert [w.shape for w in weights] == [(2, 3), (3, )]
+
+    job = session.query(rtrain.server_utils.model.Job).filter_by(
+        id=job_id).one()
+    assert job.attempts == 1
+    rtrain.server.Session.remove()
+
+    # Requests return their connections to the pool when they finish.
+    assert client.get('/status/%s' % job_id).status_code == 200
+    assert not rtrain.server.Session.registry.has()
+
+
+def test_main_http_workers(tmpdir, monkeypatch):
+    # Each process would count its own status versions and metrics.
+    config = tmpdir.join('rtraind.conf')
+    config.write('[rtraind]\nHttpWorkers=2\nDataDirectory=%s\n' % tmpdir)
+    monkeypatch.setattr(sys, 'argv', ['rtraind', '-c', str(config)])
+    monkeypatch.setattr(
+        'rtrain.server.start_trainers',
+        lambda *args: pytest.fail('Trainers were started.'))
+    with pytest.raises(SystemExit):
+        rtrain.server.main()
+
+
+def test_trainer_claim_lost(tmpdir, monkeypatch):
+    ops = rtrain.server_utils.model.database_operations
+    config = rtrain.server_utils.config.RTrainConfig(
+        "[rtraind]\nDatabase=sqlite:///%s\nDataDirectory=%s\n" %
+        (tmpdir.join('db.sqlite'), tmpdir))
+    rtrain.server_utils.model.Base.metadata.create_all(
+        sqlalchemy.create_engine(config.db_string))
+    monkeypatch.setattr('rtrain.server.Session', None)
+    monkeypatch.setattr('rtrain.server.status_board',
+                        rtrain.server_utils.status.StatusBoard())
+    rtrain.server.prepare_database(config)
+    rtrain.server.prepare_storage(config)
+    session = rtrain.server.Session()
+    job_id = ops.create_new_job(b'{}', session)
+    beats = []
+
+    def execute_training_request(request, callback, timings):
+        # A long phase that reports no progress.
+        time.sleep(0.5)
+        Job = rtrain.server_utils.model.Job
+        heartbeat_time, claim_time = session.query(
+            Job.heartbeat_time, Job.claim_time).filter_by(id=job_id).one()
+        beats.append(heartbeat_time - claim_time)
+        session.commit()
+
+        # The job is then given to another worker.
+        ops.requeue_stale_jobs(
+            datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+            session)
+        ops.claim_next_job('other', session)
+        return [b'model']
+
+    monkeypatch.setattr('rtrain.server.execute_training_request',
+                        execute_training_request)
+    rtrain.server.trainer(
+        'worker',
+        rtrain.server_utils.notify.PollingNotifier(),
+        1,
+        rtrain.server.status_board,
+        max_jobs=1,
+        heartbeat_interval=0.1)
+
+    assert beats[0] >= datetime.timedelta(seconds=0.3)
+    status = ops.get_status(job_id, session)
+    assert status.state == rtrain.server_utils.model.JOB_RUNNING
+    assert not os.path.exists(
+        os.path.join(rtrain.server.result_directory, job_id + '.model'))